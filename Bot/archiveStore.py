@@ -0,0 +1,293 @@
+# python imports
+from dataclasses import dataclass, asdict
+from collections import Counter
+from dotenv import load_dotenv
+import mimetypes
+import asyncio
+import hashlib
+import shutil
+import gzip
+import json
+import time
+import os
+
+# local imports
+from attachments import BLOB_DIR, MANIFEST_NAME, blob_path
+from transcript import COMPRESSED_SUFFIX
+from closeJobs import CLOSE_JOBS_DIR
+from transcriptSearch import transcript_index, TRANSCRIPT_SEARCH
+from logger import logger
+
+load_dotenv()
+ARCHIVE_ROOT: str = os.getenv("ARCHIVE_ROOT", "/dreamy-data/tickets")
+ARCHIVE_MAX_BYTES: int = int(os.getenv("ARCHIVE_MAX_BYTES", 0))  # size budget of all tickets and blobs together, 0 for no limit
+ARCHIVE_MAX_AGE_DAYS: float = float(os.getenv("ARCHIVE_MAX_AGE_DAYS", 0))  # closed tickets older than this are removed, 0 to keep them forever
+ARCHIVE_COMPACT_AFTER: float = float(os.getenv("ARCHIVE_COMPACT_AFTER", 6)) * 3600  # hours a ticket is left alone after it was last written to
+ARCHIVE_COMPACT_INTERVAL: float = float(os.getenv("ARCHIVE_COMPACT_INTERVAL", 6)) * 3600  # hours between two compactions
+_KEEP = (MANIFEST_NAME, "capture.jsonl")  # files of a ticket folder that are not attachments
+_COPY_SIZE: int = 1024 * 1024
+
+
+@dataclass(slots=True)
+class CompactionReport:
+    tickets: int = 0
+    transcripts_compressed: int = 0
+    zips_removed: int = 0
+    files_moved: int = 0  # loose attachments moved into the blob store
+    tickets_expired: int = 0
+    blobs_removed: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    seconds: float = 0.0
+
+    @property
+    def reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_COPY_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArchiveStore(object):
+    """Keeps `/dreamy-data/tickets` from growing without bound.
+
+    A closed ticket leaves a folder with its transcript, a manifest and the zip that was uploaded
+    when it closed. The attachments themselves are in the shared blob store, named after the hash
+    of their content. Once a ticket folder has not been written to for `ARCHIVE_COMPACT_AFTER`, the
+    compaction:
+
+    - gzips the transcript, `read_transcript` still finds it by its old name
+    - removes the zip, it only holds copies of blobs that are in the store
+    - moves loose attachments of tickets from before the blob store into it
+    - removes the tickets over the age and size budgets, oldest first
+    - removes the blobs that no manifest points to anymore
+    """
+
+    def __init__(self, root: str = ARCHIVE_ROOT, blob_dir: str = BLOB_DIR, max_bytes: int = ARCHIVE_MAX_BYTES,
+                 max_age: float = ARCHIVE_MAX_AGE_DAYS * 86400, compact_after: float = ARCHIVE_COMPACT_AFTER) -> None:
+        self.root = root
+        self.blob_dir = blob_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compact_after = compact_after
+        self.last_report: CompactionReport | None = None
+        self.reclaimed = 0
+        self._lock = asyncio.Lock()
+
+    def _busy_folders(self) -> set[str]:
+        # folders of tickets that are still being closed, their files are about to be uploaded
+        busy = set()
+        if not os.path.isdir(CLOSE_JOBS_DIR):
+            return busy
+        for name in os.listdir(CLOSE_JOBS_DIR):
+            try:
+                with open(os.path.join(CLOSE_JOBS_DIR, name), "r", encoding="utf-8") as f:
+                    transcript = json.load(f).get("transcript")
+            except (OSError, ValueError):
+                continue
+            if transcript:
+                busy.add(os.path.dirname(transcript))
+        return busy
+
+    def _ticket_folders(self) -> list[str]:
+        special = {os.path.abspath(self.blob_dir), os.path.abspath(CLOSE_JOBS_DIR)}
+        folders = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and os.path.abspath(entry.path) not in special and entry.name != "capture":
+                folders.append(entry.path)
+        return folders
+
+    @staticmethod
+    def _last_written(folder: str) -> float:
+        return max((entry.stat().st_mtime for entry in os.scandir(folder) if entry.is_file()), default=os.path.getmtime(folder))
+
+    @staticmethod
+    def _folder_size(folder: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+    def _read_manifest(self, folder: str) -> dict:
+        try:
+            with open(os.path.join(folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"attachments": [], "failed": []}
+
+    def _write_manifest(self, folder: str, manifest: dict) -> None:
+        path = os.path.join(folder, MANIFEST_NAME)
+        with open(path + ".part", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(path + ".part", path)
+
+    def _store(self, path: str) -> tuple[str, str]:
+        """Move a file into the blob store, or drop it when the store has it already. Returns the blob name and hash."""
+        digest = _hash_file(path)
+        name = digest + os.path.splitext(path)[1].lower()
+        blob = blob_path(name, self.blob_dir)
+        if os.path.exists(blob):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(path, blob)
+        return name, digest
+
+    def _compress(self, path: str) -> None:
+        with open(path, "rb") as source, gzip.open(path + COMPRESSED_SUFFIX + ".part", "wb", compresslevel=6) as target:
+            shutil.copyfileobj(source, target, _COPY_SIZE)
+        shutil.copystat(path, path + COMPRESSED_SUFFIX + ".part")  # the age of the ticket stays the same
+        os.replace(path + COMPRESSED_SUFFIX + ".part", path + COMPRESSED_SUFFIX)
+        os.remove(path)
+
+    def _compact_folder(self, folder: str, report: CompactionReport) -> None:
+        manifest = self._read_manifest(folder)
+        last_written = self._last_written(folder)
+        changed = False
+        zips = []
+        for entry in list(os.scandir(folder)):
+            name = entry.name
+            if not entry.is_file() or name in _KEEP or name.endswith((COMPRESSED_SUFFIX, ".part")):
+                continue
+            if name.startswith("transcript-"):
+                self._compress(entry.path)
+                report.transcripts_compressed += 1
+            elif name.startswith("attachments-") and name.endswith(".zip"):
+                zips.append(entry.path)
+            else:
+                # a blob of a ticket from before the shared store, or an attachment of a ticket from before the manifests
+                size = entry.stat().st_size
+                blob, digest = self._store(entry.path)
+                listed = [item for item in manifest["attachments"] if item["blob"] == name]
+                for item in listed:
+                    item["blob"] = blob
+                if not listed:
+                    manifest["attachments"].append({"message_id": None, "filename": name, "blob": blob, "sha256": digest, "size": size,
+                                                    "content_type": mimetypes.guess_type(name)[0], "duplicate": False})
+                report.files_moved += 1
+                changed = True
+        if changed:
+            self._write_manifest(folder, manifest)
+            os.utime(os.path.join(folder, MANIFEST_NAME), (last_written, last_written))  # the age of the ticket stays the same
+        # the zip can only go when every attachment in it can be found in the store
+        stored = manifest["attachments"] and all(os.path.exists(blob_path(item["blob"], self.blob_dir)) for item in manifest["attachments"])
+        for path in zips if stored else []:
+            os.remove(path)
+            report.zips_removed += 1
+
+    def _referenced_blobs(self, folders: list[str]) -> dict[str, int]:
+        references: dict[str, int] = {}
+        for folder in folders:
+            for entry in self._read_manifest(folder)["attachments"]:
+                references[entry["blob"]] = references.get(entry["blob"], 0) + 1
+        return references
+
+    def _blobs(self) -> dict[str, tuple[int, float]]:
+        blobs = {}
+        if not os.path.isdir(self.blob_dir):
+            return blobs
+        for shard in os.scandir(self.blob_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.endswith(".part"):
+                        stat = entry.stat()
+                        blobs[entry.name] = (stat.st_size, stat.st_mtime)
+        return blobs
+
+    def _remove_ticket(self, folder: str, references: dict[str, int]) -> None:
+        for entry in self._read_manifest(folder)["attachments"]:
+            references[entry["blob"]] -= 1
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def compact(self) -> CompactionReport:
+        """Run one compaction, blocking, call it from a worker thread."""
+        started = time.perf_counter()
+        now = time.time()
+        report = CompactionReport()
+        if not os.path.isdir(self.root):
+            return report
+        busy = self._busy_folders()
+        folders = [folder for folder in self._ticket_folders() if folder not in busy]
+        blobs = self._blobs()
+        report.tickets = len(folders)
+        report.bytes_before = sum(self._folder_size(folder) for folder in folders) + sum(size for size, _ in blobs.values())
+
+        settled = [folder for folder in folders if now - self._last_written(folder) >= self.compact_after]
+        for folder in settled:
+            try:
+                self._compact_folder(folder, report)
+            except OSError as e:
+                logger.error(f"Could not compact the ticket folder {folder}: {e!r}")
+
+        references = self._referenced_blobs(folders)
+        blobs = self._blobs()
+        # the retention budgets only remove settled tickets, oldest first
+        settled.sort(key=self._last_written)
+        if self.max_age:
+            while settled and now - self._last_written(settled[0]) > self.max_age:
+                self._remove_ticket(settled.pop(0), references)
+                report.tickets_expired += 1
+        if self.max_bytes:
+            sizes = {folder: self._folder_size(folder) for folder in settled}
+            total = sum(sizes.values()) + sum(size for name, (size, _) in blobs.items() if references.get(name, 0) > 0)
+            while settled and total > self.max_bytes:
+                folder = settled.pop(0)
+                total -= sizes[folder]
+                own = Counter(entry["blob"] for entry in self._read_manifest(folder)["attachments"])
+                for name, count in own.items():
+                    if references.get(name) == count and name in blobs:
+                        total -= blobs[name][0]  # no other ticket uses the blob, it goes with this one
+                self._remove_ticket(folder, references)
+                report.tickets_expired += 1
+
+        # downloads that were cut off by a crash leave their temporary file behind
+        for entry in os.scandir(self.blob_dir) if os.path.isdir(self.blob_dir) else []:
+            if entry.is_file() and entry.name.endswith(".part") and now - entry.stat().st_mtime >= self.compact_after:
+                os.remove(entry.path)
+
+        # blobs younger than the grace period can belong to a ticket that has not written its manifest yet
+        for name, (size, mtime) in blobs.items():
+            if references.get(name, 0) <= 0 and now - mtime >= self.compact_after:
+                try:
+                    os.remove(blob_path(name, self.blob_dir))
+                    report.blobs_removed += 1
+                except OSError as e:
+                    logger.error(f"Could not remove the blob {name}: {e!r}")
+
+        folders = [folder for folder in folders if os.path.isdir(folder)]
+        report.bytes_after = sum(self._folder_size(folder) for folder in folders) + sum(size for size, _ in self._blobs().values())
+        report.seconds = time.perf_counter() - started
+        return report
+
+    async def run(self) -> CompactionReport:
+        async with self._lock:
+            report = await asyncio.to_thread(self.compact)
+        self.last_report = report
+        self.reclaimed += report.reclaimed
+        if report.tickets_expired and TRANSCRIPT_SEARCH:
+            await transcript_index.prune()
+        logger.info(f"Compacted the ticket archive, reclaimed {report.reclaimed / 1024 / 1024:.1f} MiB: " + ", ".join(f"{key}={value}" for key, value in asdict(report).items()))
+        return report
+
+    async def maintain(self, interval: float = ARCHIVE_COMPACT_INTERVAL) -> None:
+        """Compact the archive every `interval` seconds, for as long as the bot runs."""
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                # the next run tries again, the loop must not die on one bad folder or a locked index
+                logger.error(f"Compacting the ticket archive failed: {type(e).__name__} {e}")
+            await asyncio.sleep(interval)
+
+    @property
+    def stats(self) -> str:
+        if self.last_report is None:
+            return "not compacted yet"
+        report = self.last_report
+        return (f"{report.tickets} tickets, {report.bytes_after / 1024 / 1024:.1f} MiB, "
+                f"reclaimed {report.reclaimed / 1024 / 1024:.1f} MiB last run and {self.reclaimed / 1024 / 1024:.1f} MiB since start")
+
+
+archive_store = ArchiveStore()
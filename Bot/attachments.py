@@ -0,0 +1,211 @@
+# discord imports
+import discord
+
+# python imports
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv
+from typing import Callable
+import hashlib
+import asyncio
+import json
+import uuid
+import os
+
+# 3rd party imports
+import aiohttp
+
+# local imports
+from logger import logger
+
+load_dotenv()
+ATTACHMENT_CONCURRENCY: int = int(os.getenv("ATTACHMENT_CONCURRENCY", 4))  # downloads that run at the same time
+ATTACHMENT_TIMEOUT: float = float(os.getenv("ATTACHMENT_TIMEOUT", 30))  # seconds a download may go without receiving anything
+ATTACHMENT_MAX_FILE_BYTES: int = int(os.getenv("ATTACHMENT_MAX_FILE_BYTES", 50 * 1024 * 1024))  # bigger attachments are linked instead of stored
+ATTACHMENT_MAX_TICKET_BYTES: int = int(os.getenv("ATTACHMENT_MAX_TICKET_BYTES", 250 * 1024 * 1024))  # attachments of one ticket that are stored, the rest is linked
+ATTACHMENT_CHUNK_SIZE: int = 1024 * 1024  # bytes held in memory per download before they are written to disk
+MANIFEST_NAME: str = "manifest.json"
+BLOB_DIR: str = os.getenv("ATTACHMENT_BLOB_DIR", "/dreamy-data/tickets/blobs")  # one store for the attachments of every ticket
+
+
+@dataclass(slots=True)
+class StoredAttachment:
+    """One attachment of a ticket and the blob it is stored in."""
+    message_id: int
+    filename: str  # the name the attachment was posted with
+    blob: str  # path of the stored file, named after the hash of its content
+    sha256: str
+    size: int
+    content_type: str | None
+    duplicate: bool  # True when the same content was already stored for an earlier attachment
+
+
+def blob_path(name: str, blob_dir: str = BLOB_DIR) -> str:
+    """Where the blob `<sha256><extension>` is stored, spread over 256 folders by the first two characters of the hash."""
+    return os.path.join(blob_dir, name[:2], name)
+
+
+def unique_name(filename: str, taken: set[str]) -> str:
+    """Add a counter to a filename until it is not taken, `image.png` becomes `image (1).png`, `image (2).png`, ..."""
+    name = filename
+    stem, extension = os.path.splitext(filename)
+    counter = 1
+    while name in taken:
+        name = f"{stem} ({counter}){extension}"
+        counter += 1
+    taken.add(name)
+    return name
+
+
+class AttachmentDownloader(object):
+    """Downloads the attachments of a ticket concurrently and stores every unique file once.
+
+    The files are stored as `<sha256><extension>` in the shared blob store, so an image that is
+    posted twice, in this ticket or any other, only takes up space once. `finish` waits for the
+    downloads and writes a manifest to `directory` that maps the original filenames to the blobs.
+
+    A download is streamed to disk `ATTACHMENT_CHUNK_SIZE` bytes at a time and hashed on the way,
+    so a big video never sits in memory as a whole. Attachments over `max_file_bytes`, or over what
+    is left of the `max_ticket_bytes` budget of the ticket, are not downloaded; the manifest keeps
+    their link under `skipped`.
+    """
+
+    def __init__(self, directory: str, concurrency: int = ATTACHMENT_CONCURRENCY, timeout: float = ATTACHMENT_TIMEOUT, blob_dir: str = BLOB_DIR,
+                 max_file_bytes: int = ATTACHMENT_MAX_FILE_BYTES, max_ticket_bytes: int = ATTACHMENT_MAX_TICKET_BYTES) -> None:
+        self.directory = directory
+        self.blob_dir = blob_dir
+        self.timeout = timeout
+        self.max_file_bytes = max_file_bytes
+        self.max_ticket_bytes = max_ticket_bytes
+        self.reserved = 0  # bytes of the ticket budget claimed by the downloads so far
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.max_pending = concurrency * 4
+        self._session: aiohttp.ClientSession | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._pending: set[asyncio.Task] = set()
+        self._blobs: dict[str, str] = {}  # sha256 -> path of the blob
+        self.failed: list[str] = []
+        self.skipped: list[dict] = []  # attachments over the size budgets, with their link
+        self.on_stored: list[Callable[[StoredAttachment], None]] = []  # called for every attachment as soon as it is stored
+
+    def add(self, message_id: int, attachment: discord.Attachment) -> asyncio.Task:
+        """Schedule the download of an attachment, the downloads run in the order they are added."""
+        task = asyncio.get_running_loop().create_task(self._download(message_id, attachment))
+        self._tasks.append(task)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def put(self, message_id: int, attachment: discord.Attachment) -> None:
+        """Like `add`, but waits while more than `max_pending` downloads are unfinished."""
+        while len(self._pending) >= self.max_pending:
+            await asyncio.wait(self._pending, return_when=asyncio.FIRST_COMPLETED)
+        self.add(message_id, attachment)
+
+    def _skip(self, message_id: int, attachment: discord.Attachment, reason: str) -> None:
+        logger.warning(f"Not storing attachment {attachment.filename} of message {message_id} ({attachment.size} bytes): {reason}")
+        self.skipped.append({"message_id": message_id, "filename": attachment.filename, "url": attachment.url, "size": attachment.size, "reason": reason})
+
+    async def _download(self, message_id: int, attachment: discord.Attachment) -> StoredAttachment | None:
+        # discord tells the size up front, the budgets are checked before anything is downloaded
+        if attachment.size > self.max_file_bytes:
+            self._skip(message_id, attachment, "file too big")
+            return None
+        if self.reserved + attachment.size > self.max_ticket_bytes:
+            self._skip(message_id, attachment, "ticket budget used up")
+            return None
+        self.reserved += attachment.size
+
+        async with self._semaphore:
+            try:
+                part, digest, size = await self._fetch(attachment)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                logger.error(f"Could not download attachment {attachment.filename} of message {message_id}: {type(e).__name__} {e}")
+                self.failed.append(attachment.filename)
+                self.reserved -= attachment.size
+                return None
+        stored = await self._store(message_id, attachment, part, digest, size)
+        for callback in self.on_stored:
+            callback(stored)
+        return stored
+
+    async def _fetch(self, attachment: discord.Attachment) -> tuple[str, str, int]:
+        """Stream an attachment into a temporary file in the blob store, returns its path, hash and size."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout))
+        await asyncio.to_thread(os.makedirs, self.blob_dir, exist_ok=True)
+        part = os.path.join(self.blob_dir, f"incoming-{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        f = await asyncio.to_thread(open, part, "wb")
+        try:
+            async with self._session.get(attachment.url) as response:
+                response.raise_for_status()
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise ValueError(f"the download is bigger than the limit of {self.max_file_bytes} bytes")
+                    buffer += chunk
+                    if len(buffer) >= ATTACHMENT_CHUNK_SIZE:
+                        await asyncio.to_thread(self._write_chunk, f, digest, bytes(buffer))
+                        buffer.clear()
+                await asyncio.to_thread(self._write_chunk, f, digest, bytes(buffer))
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.remove, part)
+            raise
+        await asyncio.to_thread(f.close)
+        return part, digest.hexdigest(), size
+
+    @staticmethod
+    def _write_chunk(f, digest, chunk: bytes) -> None:
+        digest.update(chunk)
+        f.write(chunk)
+
+    async def _store(self, message_id: int, attachment: discord.Attachment, part: str, digest: str, size: int) -> StoredAttachment:
+        blob = self._blobs.get(digest)
+        duplicate = blob is not None
+        if not duplicate:
+            # claim the hash first so a second copy that finishes meanwhile is seen as a duplicate
+            blob = self._blobs[digest] = blob_path(digest + os.path.splitext(attachment.filename)[1].lower(), self.blob_dir)
+        await asyncio.to_thread(self._move, part, blob)
+        return StoredAttachment(message_id, attachment.filename, blob, digest, size, attachment.content_type, duplicate)
+
+    @staticmethod
+    def _move(part: str, blob: str) -> None:
+        if os.path.exists(blob):
+            os.remove(part)
+            # stored already, the new mtime keeps the compaction from sweeping it before the manifest is written
+            os.utime(blob)
+            return
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(part, blob)  # the temporary file is complete, a blob is never seen half written
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        # write to a temporary name first, a half written file must never look like a complete one
+        part = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        with open(part, "wb") as f:
+            f.write(data)
+        os.replace(part, path)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def finish(self) -> list[StoredAttachment]:
+        """Wait for every download and write the manifest, returns the stored attachments in the order they were added."""
+        try:
+            results = await asyncio.gather(*self._tasks)
+        finally:
+            await self.close()
+        stored = [result for result in results if result is not None]
+        manifest = {
+            "attachments": [asdict(attachment) | {"blob": os.path.basename(attachment.blob)} for attachment in stored],
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+        await asyncio.to_thread(self._write, os.path.join(self.directory, MANIFEST_NAME), json.dumps(manifest, indent=4).encode("utf-8"))
+        logger.info(f"Stored {len(self._blobs)} unique file(s) for {len(stored)} attachment(s) in {self.directory}, {len(self.failed)} failed, {len(self.skipped)} skipped")
+        return stored
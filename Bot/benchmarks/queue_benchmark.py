@@ -0,0 +1,126 @@
+"""Compare the music queue with the lists it replaced on big queues.
+
+Run from the Bot folder:
+    python benchmarks/queue_benchmark.py --songs 10000
+
+The lists are used the way the music player used them before: every song is added by rebuilding the
+list, the next song is taken with `pop(0)` and the back button rebuilds the list with two songs in front.
+"""
+# python imports
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# local imports
+from musicQueue import MusicQueue
+
+
+def song_urls(count: int) -> list[str]:
+    random.seed(1)
+    alphabet = string.ascii_letters + string.digits + "-_"
+    return ["https://www.youtube.com/watch?v=" + "".join(random.choices(alphabet, k=11)) for _ in range(count)]
+
+
+def timed(function) -> float:
+    started = time.perf_counter()
+    function()
+    return (time.perf_counter() - started) * 1000
+
+
+def lists(urls: list[str], backs: int) -> dict[str, float]:
+    queue = {"played": [], "current": {}, "queue": []}
+    results = {}
+
+    def enqueue():
+        for url in urls:
+            queue["queue"] = [*queue["queue"], url]
+
+    def back():
+        for _ in range(backs):
+            queue["queue"] = [queue["played"][-1], queue["queue"][0], *queue["queue"]]
+
+    def play_all():
+        while queue["queue"]:
+            next_url = queue["queue"].pop(0)
+            if queue["current"]:
+                queue["played"].append(queue["current"]["original_url"])
+            queue["current"] = {"original_url": next_url}
+
+    results["enqueue one by one"] = timed(enqueue)
+    queue["played"].append(urls[0])
+    results[f"back x{backs}"] = timed(back)
+    results["shuffle"] = timed(lambda: random.shuffle(queue["queue"]))
+    results["play through"] = timed(play_all)
+    return results
+
+
+def music_queue(urls: list[str], backs: int) -> dict[str, float]:
+    queue = MusicQueue()
+    results = {}
+
+    def enqueue():
+        for url in urls:
+            queue.extend((url,))
+
+    def back():
+        for _ in range(backs):
+            queue.advance()
+            queue.back(replay_current=True)
+
+    def play_all():
+        while True:
+            next_url = queue.advance()
+            if next_url is None:
+                break
+            queue.current = {"original_url": next_url}
+
+    results["enqueue one by one"] = timed(enqueue)
+    queue.advance()
+    results[f"back x{backs}"] = timed(back)
+    results["shuffle"] = timed(queue.shuffle)
+    results["play through"] = timed(play_all)
+    return results
+
+
+def memory(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the music queue with plain lists.")
+    parser.add_argument("--songs", type=int, default=10000)
+    parser.add_argument("--backs", type=int, default=1000)
+    args = parser.parse_args()
+
+    urls = song_urls(args.songs)
+    old, new = lists(urls, args.backs), music_queue(urls, args.backs)
+    print(f"{'operation':>20}{'lists ms':>12}{'MusicQueue ms':>15}")
+    for name in old:
+        print(f"{name:>20}{old[name]:>12.1f}{new[name]:>15.1f}")
+
+    # both store copies of the urls, so the memory of the strings themselves is counted
+    def build_list():
+        return [url.encode().decode() for url in urls]
+
+    def build_queue():
+        queue = MusicQueue()
+        queue.extend(url.encode().decode() for url in urls)
+        return queue
+
+    print(f"{'memory of the queue':>20}{memory(build_list) / 1024:>10.0f}KiB{memory(build_queue) / 1024:>13.0f}KiB")
+
+
+if __name__ == "__main__":
+    main()
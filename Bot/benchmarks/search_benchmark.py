@@ -0,0 +1,90 @@
+"""Measure how fast the ticket search answers on a large set of transcripts.
+
+Run from the Bot folder:
+    python benchmarks/search_benchmark.py --transcripts 20000
+
+Writes synthetic transcripts to a temporary folder, indexes them with the backfill and runs the
+kinds of searches staff use: words, a username, a date range and a mix of those.
+"""
+# python imports
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# local imports
+from transcriptSearch import TranscriptIndex
+
+WORDS = ("role", "color", "icon", "report", "spam", "harassment", "bug", "music", "bot", "stuck", "journal", "delete", "post", "server",
+         "channel", "permission", "ban", "mute", "thanks", "please", "screenshot", "event", "team", "run", "candle", "wing", "light")
+VOCABULARY = WORDS + tuple(f"word{i}" for i in range(20000))
+# word frequencies in chat follow Zipf's law, a few words are in every ticket and most are rare
+CUMULATIVE_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def write_transcripts(directory: str, count: int, users: int) -> None:
+    random.seed(1)
+    now = time.time()
+    for i in range(count):
+        channel = f"ticket-{i}"
+        os.makedirs(os.path.join(directory, channel))
+        lines = [f"Transcript for {channel}:", "```"]
+        for _ in range(random.randint(5, 60)):
+            lines.append(f"user{random.randrange(users)}: " + " ".join(random.choices(VOCABULARY, cum_weights=CUMULATIVE_WEIGHTS, k=random.randint(3, 25))))
+        lines.append("```")
+        path = os.path.join(directory, channel, f"transcript-{channel}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        closed_at = now - random.uniform(0, 365 * 86400)  # spread over the last year
+        os.utime(path, (closed_at, closed_at))
+
+
+async def timed(index: TranscriptIndex, runs: int, **search) -> tuple[float, float, int]:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        hits = await index.search(**search)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], len(hits)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the latency of the ticket search.")
+    parser.add_argument("--transcripts", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_transcripts(directory, args.transcripts, args.users)
+        index = TranscriptIndex(os.path.join(directory, "search.sqlite3"))
+        started = time.perf_counter()
+        await index.backfill(directory)
+        print(f"indexed {args.transcripts} transcripts in {time.perf_counter() - started:.1f}s, {os.path.getsize(index.path) / 1024 / 1024:.1f} MiB")
+
+        month_ago = datetime.now(timezone.utc) - timedelta(days=30)
+        searches = {
+            "common word": {"text": "role"},
+            "rare word": {"text": "harassment"},
+            "two words": {"text": "candle screenshot"},
+            "user": {"user": "user42"},
+            "last month": {"since": month_ago},
+            "user + word + month": {"text": "role", "user": "user42", "since": month_ago},
+        }
+        print(f"{'search':>22}{'p50 ms':>10}{'p95 ms':>10}{'hits':>6}")
+        for name, search in searches.items():
+            p50, p95, hits = await timed(index, args.runs, **search)
+            print(f"{name:>22}{p50:>10.2f}{p95:>10.2f}{hits:>6}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
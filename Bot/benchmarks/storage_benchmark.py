@@ -0,0 +1,84 @@
+"""Compare the per operation latency of the storage backends.
+
+Run from the Bot folder:
+    python benchmarks/storage_benchmark.py --iterations 1000 --backends sqlite,mysql
+
+The SQLite backend runs on a temporary folder. The MySQL backend uses the databases from the .env file,
+it only writes rows with ids from BENCHMARK_ID_OFFSET upwards and removes them again afterwards.
+"""
+# python imports
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# local imports
+import migrations
+migrations.MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "dreamy-data", "SQL", "migrations")
+import functions
+from storage import MySQLBackend, SQLiteBackend, StorageBackend, use_storage
+
+BENCHMARK_ID_OFFSET: int = 9_000_000_000_000_000_000  # far above any real discord snowflake
+
+
+async def measure(name: str, iterations: int, operation) -> tuple[str, list[float]]:
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await operation(BENCHMARK_ID_OFFSET + i)
+        timings.append((time.perf_counter() - started) * 1000)
+    return name, timings
+
+
+async def run_backend(backend: StorageBackend, iterations: int) -> list[tuple[str, list[float]]]:
+    use_storage(backend)
+    backend.migrate()
+    channel_id = BENCHMARK_ID_OFFSET
+    await backend.insert("Servers", "INSERT IGNORE INTO guilds (server_id, owner_id, sancturary_keeper_role_id, sky_guardians_role_id, tech_oracle_role_id, event_luminary_role_id, assistaint_role_id, support_category_id, general_category_id, music_voice_id, bot_channel_id, music_channel_id, ticket_channel_id, ticket_log_channel_id) VALUES (%s, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)", (BENCHMARK_ID_OFFSET,))
+    results = [
+        await measure("get_guildSettings", iterations, lambda _: functions.get_guildSettings(BENCHMARK_ID_OFFSET)),
+        await measure("save_ticket_to_db", iterations, lambda i: functions.save_ticket_to_db(i, i)),
+        await measure("load_ticket_from_db", iterations, lambda i: functions.load_ticket_from_db(i)),
+        await measure("delete_ticket_from_db", iterations, lambda i: functions.delete_ticket_from_db(i)),
+        await measure("set_accepted_rules", iterations, lambda i: functions.set_accepted_rules(channel_id, i)),
+        await measure("get_accepted_rules", max(iterations // 10, 1), lambda _: functions.get_accepted_rules(channel_id)),
+    ]
+    # remove everything the benchmark wrote
+    await backend.delete("Server_data", "DELETE FROM rules_accepted WHERE channel_id = %s", (channel_id,))
+    await backend.delete("Servers", "DELETE FROM guilds WHERE server_id = %s", (BENCHMARK_ID_OFFSET,))
+    backend.close()
+    return results
+
+
+def report(backend_name: str, results: list[tuple[str, list[float]]]) -> None:
+    print(f"\n{backend_name}")
+    print(f"    {'operation':<24}{'n':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, timings in results:
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"    {name:<24}{len(timings):>7}{statistics.fmean(timings):>10.3f}{statistics.median(timings):>10.3f}{p95:>10.3f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the latency of the storage backends.")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--backends", default="sqlite", help="comma separated list of backends, mysql needs a reachable server")
+    args = parser.parse_args()
+
+    for backend_name in args.backends.split(","):
+        if backend_name == "sqlite":
+            with tempfile.TemporaryDirectory() as directory:
+                report("sqlite", await run_backend(SQLiteBackend(directory), args.iterations))
+        elif backend_name == "mysql":
+            report("mysql", await run_backend(MySQLBackend(), args.iterations))
+        else:
+            print(f"Unknown backend {backend_name}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
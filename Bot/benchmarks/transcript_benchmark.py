@@ -0,0 +1,89 @@
+"""Compare the old transcript builder with the streaming transcript writer.
+
+Run from the Bot folder:
+    python benchmarks/transcript_benchmark.py --sizes 100,1000,10000,100000
+
+The old builder prepends every message to one string, which gets slow quickly, so it only runs
+up to --legacy-max messages. The time per message of the streaming writer should stay flat.
+"""
+# python imports
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# local imports
+from transcript import write_transcript
+
+
+def synthetic_messages(count: int) -> list[SimpleNamespace]:
+    """Messages with a realistic mix of lengths, every tenth one has two attachments."""
+    messages = []
+    for i in range(count):
+        attachments = [SimpleNamespace(filename=f"screenshot_{i}_{n}.png") for n in range(2)] if i % 10 == 0 else []
+        messages.append(SimpleNamespace(author=SimpleNamespace(name=f"user{i % 7}"), content="Lorem ipsum dolor sit amet " * (1 + i % 5), attachments=attachments))
+    return messages
+
+
+async def history(messages: list[SimpleNamespace], page_size: int = 100):
+    # hand out the messages a page at a time, like channel.history does
+    for start in range(0, len(messages), page_size):
+        await asyncio.sleep(0)
+        for message in messages[start:start + page_size]:
+            yield message
+
+
+async def legacy(path: str, title: str, messages: list[SimpleNamespace]) -> None:
+    """The old save_transcript, it walked the history newest first and prepended to one string."""
+    ticket_logs = ""
+    with open(path, "w", encoding="utf-8", errors="replace") as f:
+        async for message in history(messages[::-1]):
+            if message.attachments:
+                for attachment in message.attachments:
+                    ticket_logs = f"       {attachment.filename}\n" + ticket_logs
+                ticket_logs = "    Attached attachment(s):\n" + ticket_logs
+            ticket_logs = f"{message.author.name}: {message.content}\n" + ticket_logs
+        ticket_logs = f"Transcript for {title}:\n" + "```\n" + ticket_logs + "```"
+        f.write(ticket_logs)
+
+
+async def streaming(path: str, title: str, messages: list[SimpleNamespace]) -> None:
+    await write_transcript(path, title, history(messages))
+
+
+async def measure(function, directory: str, messages: list[SimpleNamespace]) -> tuple[float, float]:
+    path = os.path.join(directory, f"{function.__name__}.txt")
+    tracemalloc.start()
+    started = time.perf_counter()
+    await function(path, "benchmark", messages)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the old and the streaming transcript writer.")
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="comma separated message counts")
+    parser.add_argument("--legacy-max", type=int, default=20000, help="skip the old builder above this many messages")
+    args = parser.parse_args()
+
+    print(f"{'messages':>10}{'writer':>12}{'total ms':>12}{'us/message':>12}{'peak MiB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(size) for size in args.sizes.split(",")):
+            messages = synthetic_messages(size)
+            for function in (legacy, streaming):
+                if function is legacy and size > args.legacy_max:
+                    continue
+                elapsed, peak = await measure(function, directory, messages)
+                print(f"{size:>10}{function.__name__:>12}{elapsed * 1000:>12.1f}{elapsed / size * 1e6:>12.2f}{peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
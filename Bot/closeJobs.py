@@ -0,0 +1,342 @@
+# discord imports
+from discord.ext import commands
+import discord
+
+# python imports
+from dataclasses import dataclass, field, asdict
+from dotenv import load_dotenv
+import resource
+import asyncio
+import json
+import time
+import os
+
+# local imports
+from functions import save_ticket, save_transcript, delete_ticket_from_db
+from attachments import StoredAttachment
+from ticketCapture import ticket_capture
+from guildConfig import guild_config
+from logger import logger
+
+load_dotenv()
+CLOSE_JOBS_DIR: str = os.getenv("CLOSE_JOBS_DIR", "/dreamy-data/tickets/close-jobs")
+CLOSE_JOB_WORKERS: int = int(os.getenv("CLOSE_JOB_WORKERS", 2))  # tickets that are closed at the same time
+CLOSE_JOB_ATTEMPTS: int = int(os.getenv("CLOSE_JOB_ATTEMPTS", 5))  # tries per step before the job is given up
+CLOSE_JOB_RETRY_DELAY: float = 10.0  # seconds before a failed step is tried again, times the number of the try
+MEMORY_SAMPLE_INTERVAL: float = 0.05  # seconds between two looks at the memory use while a ticket is saved
+
+# the steps of closing a ticket, in order, with the text shown in the status message
+STEPS: dict[str, str] = {
+    "save": "Saving the transcript and attachments",
+    "log": "Uploading to the ticket log channel",
+    "delete_channel": "Deleting the ticket channel",
+    "delete_db": "Removing the ticket from the database",
+    "notify": "Sending the transcript to the user",
+}
+
+
+def memory_in_use() -> int:
+    """The resident memory of the bot in bytes."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # not on Linux, the peak since the start is the closest there is
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryWatch(object):
+    """Samples the memory use in the background while a block runs, `peak` is the highest sample."""
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._task: asyncio.Task | None = None
+
+    async def _sample(self) -> None:
+        while True:
+            self.peak = max(self.peak, memory_in_use())
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "MemoryWatch":
+        self.start = self.peak = memory_in_use()
+        self._task = asyncio.create_task(self._sample())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._task.cancel()
+        self.peak = max(self.peak, memory_in_use())
+
+
+class JobFailed(Exception):
+    """A step that can never succeed, the job is stopped instead of tried again."""
+
+
+@dataclass
+class CloseJob:
+    """Everything needed to close a ticket, saved to disk after every step so a restart can pick it up."""
+    channel_id: int
+    guild_id: int
+    channel_name: str
+    header: str  # first lines of the status message, the same text the log message had before
+    notify_id: int | None  # the user that gets the transcript in their DMs
+    force: bool = False  # force closed tickets only save the transcript and stay in the database
+    status_channel_id: int | None = None
+    status_message_id: int | None = None
+    done: list[str] = field(default_factory=list)
+    transcript: str | None = None
+    archive: str | None = None
+    archive_name: str | None = None  # the name the archive is uploaded with, a single attachment is stored under its hash
+    attempts: int = 0
+    error: str | None = None
+    skipped: list[str] = field(default_factory=list)  # attachments over the size budgets, as `filename: link`
+    peak_memory: int = 0  # most memory the bot used while the ticket was saved, in bytes
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def steps(self) -> list[str]:
+        return [step for step in STEPS if not (self.force and step == "delete_db")]
+
+    def status(self, current: str | None = None) -> str:
+        lines = [self.header, ""]
+        for step in self.steps:
+            mark = "✅" if step in self.done else "⏳" if step == current else "▫️"
+            lines.append(f"{mark} {STEPS[step]}")
+        if self.skipped:
+            lines.append("\nToo big to archive, only linked (the links expire after a while):")
+            lines.extend(self.skipped[:5])
+            if len(self.skipped) > 5:
+                lines.append(f"... and {len(self.skipped) - 5} more in the manifest")
+        if self.error:
+            lines.append(f"\n❌ {self.error}")
+        return "\n".join(lines)[:2000]
+
+
+class CloseJobQueue(object):
+    """Closes tickets in the background with a fixed number of workers.
+
+    The interaction only has to submit a job and answer, the slow part (history, uploads, deleting
+    the channel, DMs) runs here. Every job is a JSON file in `CLOSE_JOBS_DIR` that is rewritten after
+    each step and removed when the job is finished. `start` picks up the files that are left after a
+    restart, the steps that were done already are skipped. One message in the ticket log channel is
+    edited to show how far the job is.
+    """
+
+    def __init__(self, directory: str = CLOSE_JOBS_DIR, workers: int = CLOSE_JOB_WORKERS) -> None:
+        self.directory = directory
+        self.workers = workers
+        self.client: commands.Bot | None = None
+        self._queue: asyncio.Queue[CloseJob] = asyncio.Queue()
+        self._jobs: dict[int, CloseJob] = {}  # channel id -> job, to refuse closing the same ticket twice
+        self._workers: list[asyncio.Task] = []
+        self.closed = 0
+        self.failed = 0
+        self.peak_memory = 0
+
+    def _path(self, job: CloseJob) -> str:
+        return os.path.join(self.directory, f"{job.channel_id}.json")
+
+    def _write(self, path: str, data: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + ".part", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+
+    async def _save(self, job: CloseJob) -> None:
+        await asyncio.to_thread(self._write, self._path(job), json.dumps(asdict(job)))
+
+    def _load(self) -> list[CloseJob]:
+        jobs = []
+        if not os.path.isdir(self.directory):
+            return jobs
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    jobs.append(CloseJob(**json.load(f)))
+            except (OSError, ValueError, TypeError) as e:
+                logger.error(f"Could not read the close job {name}: {e!r}")
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    async def start(self, client: commands.Bot) -> None:
+        """Start the workers and resume the jobs that were not finished before the last shutdown."""
+        if self._workers:
+            return
+        self.client = client
+        for job in await asyncio.to_thread(self._load):
+            if job.channel_id in self._jobs:
+                continue
+            job.attempts, job.error = 0, None  # a restart gives a job that gave up another chance
+            self._jobs[job.channel_id] = job
+            ticket_capture.stop(job.channel_id)
+            self._queue.put_nowait(job)
+            logger.info(f"Resuming the close job of ticket {job.channel_name}, done: {', '.join(job.done) or 'nothing'}")
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def is_closing(self, channel_id: int) -> bool:
+        return channel_id in self._jobs
+
+    async def submit(self, job: CloseJob) -> bool:
+        """Save the job and queue it, returns False when the ticket is already being closed."""
+        if job.channel_id in self._jobs:
+            return False
+        self._jobs[job.channel_id] = job
+        ticket_capture.stop(job.channel_id)
+        status_channel = self.client.get_channel(guild_config[job.guild_id].ticket_log_channel_id) if self.client else None
+        if status_channel:
+            try:
+                message = await status_channel.send(job.status())
+                job.status_channel_id, job.status_message_id = status_channel.id, message.id
+            except discord.HTTPException as e:
+                logger.warning(f"Could not send the status message of the close job of {job.channel_name}: {e}")
+        else:
+            logger.error("Ticket logs channel not found. Please provide a valid channel ID.")
+        await self._save(job)
+        self._queue.put_nowait(job)
+        return True
+
+    async def _status(self, job: CloseJob, current: str | None = None) -> None:
+        if not job.status_message_id or self.client is None:
+            return
+        channel = self.client.get_channel(job.status_channel_id)
+        if channel is None:
+            return
+        try:
+            await channel.get_partial_message(job.status_message_id).edit(content=job.status(current))
+        except discord.HTTPException as e:
+            logger.warning(f"Could not update the status message of the close job of {job.channel_name}: {e}")
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                # a bug in a step must not take the worker down with it
+                logger.critical(f"The close job of ticket {job.channel_name} crashed: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: CloseJob) -> None:
+        for step in job.steps:
+            if step in job.done:
+                continue
+            await self._status(job, step)
+            try:
+                await getattr(self, f"_step_{step}")(job)
+            except JobFailed as e:
+                await self._give_up(job, f"{STEPS[step]} failed: {e}")
+                return
+            except Exception as e:
+                job.attempts += 1
+                logger.error(f"Step {step} of the close job of ticket {job.channel_name} failed (try {job.attempts}): {e!r}")
+                if job.attempts >= CLOSE_JOB_ATTEMPTS:
+                    await self._give_up(job, f"{STEPS[step]} failed {job.attempts} times: {e}")
+                    return
+                await self._save(job)
+                asyncio.get_running_loop().call_later(CLOSE_JOB_RETRY_DELAY * job.attempts, self._queue.put_nowait, job)
+                return
+            job.done.append(step)
+            job.attempts = 0
+            await self._save(job)
+
+        await self._status(job)
+        await asyncio.to_thread(os.remove, self._path(job))
+        self._jobs.pop(job.channel_id, None)
+        ticket_capture.forget(job.channel_id)
+        self.closed += 1
+        logger.info(f"Ticket {job.channel_name} has been closed")
+
+    async def _give_up(self, job: CloseJob, error: str) -> None:
+        # the file stays, the next start tries the job again
+        job.error = error
+        await self._save(job)
+        await self._status(job)
+        self._jobs.pop(job.channel_id, None)
+        self.failed += 1
+        logger.critical(f"Gave up closing ticket {job.channel_name}: {error}")
+
+    async def _step_save(self, job: CloseJob) -> None:
+        channel = self.client.get_channel(job.channel_id)
+        if channel is None:
+            raise JobFailed("the ticket channel does not exist anymore")
+        async with MemoryWatch() as memory:
+            if job.force:
+                job.transcript = await save_transcript(channel, "")
+            else:
+                archive = await save_ticket(channel)
+                job.transcript = archive["transcript"]
+                if isinstance(archive["archive"], StoredAttachment):
+                    job.archive, job.archive_name = archive["archive"].blob, archive["archive"].filename
+                else:
+                    job.archive = archive["archive"]
+                job.skipped = [f"{item['filename']}: {item['url']}" for item in archive.get("skipped", [])]
+        # the memory of the whole bot, other jobs running at the same time show up in it too
+        job.peak_memory = memory.peak
+        self.peak_memory = max(self.peak_memory, memory.peak)
+        logger.info(f"Saved ticket {job.channel_name}, peak memory {memory.peak / 1024 / 1024:.0f} MiB ({(memory.peak - memory.start) / 1024 / 1024:+.0f} MiB)")
+
+    def _files(self, job: CloseJob) -> list[discord.File]:
+        files = ((job.transcript, None), (job.archive, job.archive_name))
+        return [discord.File(path, filename=name) for path, name in files if path and os.path.exists(path)]
+
+    async def _upload(self, job: CloseJob, send) -> discord.Message:
+        try:
+            return await send(job.status("log"), self._files(job))
+        except discord.HTTPException as e:
+            if e.status != 413:
+                raise
+            # the attachments are over the upload limit of the server, the transcript still goes up
+            logger.warning(f"The attachments of {job.channel_name} are too big to upload, only the transcript is sent")
+            job.archive = None
+            return await send(job.status("log"), self._files(job))
+
+    async def _step_log(self, job: CloseJob) -> None:
+        # the files go on the status message, so the log channel keeps one message per ticket
+        channel = self.client.get_channel(job.status_channel_id) if job.status_message_id else None
+        if channel is not None:
+            message = channel.get_partial_message(job.status_message_id)
+            try:
+                await self._upload(job, lambda content, files: message.edit(content=content, attachments=files))
+                return
+            except discord.NotFound:
+                logger.warning(f"The status message of the close job of {job.channel_name} was deleted, sending a new one")
+        # the status message never got sent or is gone, the files go on a new one in the log channel
+        settings = guild_config.get(job.guild_id)
+        channel = self.client.get_channel(settings.ticket_log_channel_id) if settings else None
+        if channel is None:
+            logger.warning(f"No ticket log channel found for guild {job.guild_id}, the transcript of {job.channel_name} is not posted")
+            return
+        message = await self._upload(job, lambda content, files: channel.send(content, files=files))
+        job.status_channel_id, job.status_message_id = channel.id, message.id
+
+    async def _step_delete_channel(self, job: CloseJob) -> None:
+        channel = self.client.get_channel(job.channel_id)
+        if channel is not None:
+            try:
+                await channel.delete()
+            except discord.NotFound:
+                pass  # deleted by hand while the job ran
+
+    async def _step_delete_db(self, job: CloseJob) -> None:
+        await delete_ticket_from_db(job.channel_id)
+
+    async def _step_notify(self, job: CloseJob) -> None:
+        if job.notify_id is None:
+            return
+        try:
+            user = await self.client.fetch_user(job.notify_id)
+            await user.send("Your ticket has been closed successfully. The Transcript of the ticket has been saved.")
+            await user.send(f"Transcript for {job.channel_name}:", files=self._files(job))
+        except (discord.NotFound, discord.Forbidden) as e:
+            # the user left or doesn't accept DMs, trying again won't change that
+            logger.warning(f"Could not send the transcript of {job.channel_name} to user {job.notify_id}: {e}")
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"running": len(self._jobs), "queued": self._queue.qsize(), "closed": self.closed, "failed": self.failed, "peak_memory_mib": self.peak_memory // (1024 * 1024)}
+
+
+close_jobs = CloseJobQueue()
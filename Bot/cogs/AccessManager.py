@@ -3,12 +3,15 @@ from discord import app_commands
 from discord.ext import commands
 from discord.ui import View, Select
 
-from functions import load_ids, create_connection, close_connection, get_accepted_rules, get_rule_channels, create_rule_channel, remove_rule_channel, set_accepted_rules, get_rule_channel
+from functions import get_accepted_rules, get_rule_channels, create_rule_channel, remove_rule_channel, set_accepted_rules, get_rule_channel, load_rule_gates
 
 # local imports
+from guildConfig import guild_config
 from logger import logger
+from cogs.utils.SafeView import SafeView
+from ruleIndex import rule_gates
+from storage import DatabaseUnavailable
 
-ids = load_ids()
 
 class AccessManager(commands.Cog):
     def __init__(self, client: commands.Bot) -> None:
@@ -17,7 +20,7 @@ class AccessManager(commands.Cog):
     # Check if the user is a runner or Tech Oracle or above
     def is_eventlumi() -> bool:
         async def predicate(interaction: discord.Interaction) -> bool:
-            allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+            allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
             if any(role.id in allowed_roles for role in interaction.user.roles):
                 logger.debug("User has the required role to use this command.", {"user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name, "guild_id": interaction.guild.id, "guild_name": interaction.guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel.name})
                 return True
@@ -41,19 +44,19 @@ class AccessManager(commands.Cog):
             await interaction.followup.send(content="The channel can't be a voice channel.", ephemeral=True)
             return
         
-        event_luminary_role = interaction.guild.get_role(ids[interaction.guild.id]["event_luminary_role_id"])
+        event_luminary_role = interaction.guild.get_role(guild_config[interaction.guild.id].event_luminary_role_id)
         if not event_luminary_role:
             logger.critical("Event Luminary role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mEvent Luminary role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        sky_guardians_role = interaction.guild.get_role(ids[interaction.guild.id]["sky_guardians_role_id"])
+        sky_guardians_role = interaction.guild.get_role(guild_config[interaction.guild.id].sky_guardians_role_id)
         if not sky_guardians_role:
             logger.critical("Sky Guardians role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mSky Guardians role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        tech_oracle_role = interaction.guild.get_role(ids[interaction.guild.id]["tech_oracle_role_id"])
+        tech_oracle_role = interaction.guild.get_role(guild_config[interaction.guild.id].tech_oracle_role_id)
         if not tech_oracle_role:
             logger.critical("Tech Oracle role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mTech Oracle role not found. Please provide a valid role ID.```", ephemeral=True)
@@ -61,14 +64,11 @@ class AccessManager(commands.Cog):
         
         current_channel = interaction.channel
         
-        connection = create_connection("Server_data")
-        if get_rule_channel(connection, channel.id):
-            close_connection(connection)
+        if await get_rule_channel(channel.id):
             logger.warning("The channel already has a rule gate set.")
             await interaction.followup.send("The channel already has a rule gate set.", ephemeral=True)
             return
-        create_rule_channel(connection, channel.id, interaction.user.id)
-        close_connection(connection)
+        await create_rule_channel(channel.id, interaction.user.id)
         
         # Set the permissions for the channel allow only the read_messages permission for the default role
         overwrites = {
@@ -100,19 +100,19 @@ class AccessManager(commands.Cog):
             await interaction.followup.send(content="The channel can't be a voice channel.", ephemeral=True)
             return
         
-        event_luminary_role = interaction.guild.get_role(ids[interaction.guild.id]["event_luminary_role_id"])
+        event_luminary_role = interaction.guild.get_role(guild_config[interaction.guild.id].event_luminary_role_id)
         if not event_luminary_role:
             logger.critical("Event Luminary role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mEvent Luminary role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        sky_guardians_role = interaction.guild.get_role(ids[interaction.guild.id]["sky_guardians_role_id"])
+        sky_guardians_role = interaction.guild.get_role(guild_config[interaction.guild.id].sky_guardians_role_id)
         if not sky_guardians_role:
             logger.critical("Sky Guardians role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mSky Guardians role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        tech_oracle_role = interaction.guild.get_role(ids[interaction.guild.id]["tech_oracle_role_id"])
+        tech_oracle_role = interaction.guild.get_role(guild_config[interaction.guild.id].tech_oracle_role_id)
         if not tech_oracle_role:
             logger.critical("Tech Oracle role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mTech Oracle role not found. Please provide a valid role ID.```", ephemeral=True)
@@ -120,14 +120,11 @@ class AccessManager(commands.Cog):
         
         current_channel = interaction.channel
         
-        connection = create_connection("Server_data")
-        if not get_rule_channel(connection, channel.id):
-            close_connection(connection)
+        if not await get_rule_channel(channel.id):
             logger.warning("The channel does not have a rule gate set.")
             await interaction.followup.send("The channel does not have a rule gate set.", ephemeral=True)
             return
-        remove_rule_channel(connection, channel.id)
-        close_connection(connection)
+        await remove_rule_channel(channel.id)
         
         # Set the permissions for the channel allow only the read_messages permission for the default role
         overwrites = {
@@ -158,32 +155,29 @@ class AccessManager(commands.Cog):
             await interaction.followup.send(content="The channel can't be a voice channel.", ephemeral=True)
             return
         
-        event_luminary_role = interaction.guild.get_role(ids[interaction.guild.id]["event_luminary_role_id"])
+        event_luminary_role = interaction.guild.get_role(guild_config[interaction.guild.id].event_luminary_role_id)
         if not event_luminary_role:
             logger.critical("Event Luminary role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mEvent Luminary role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        sky_guardians_role = interaction.guild.get_role(ids[interaction.guild.id]["sky_guardians_role_id"])
+        sky_guardians_role = interaction.guild.get_role(guild_config[interaction.guild.id].sky_guardians_role_id)
         if not sky_guardians_role:
             logger.critical("Sky Guardians role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mSky Guardians role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        tech_oracle_role = interaction.guild.get_role(ids[interaction.guild.id]["tech_oracle_role_id"])
+        tech_oracle_role = interaction.guild.get_role(guild_config[interaction.guild.id].tech_oracle_role_id)
         if not tech_oracle_role:
             logger.critical("Tech Oracle role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mTech Oracle role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        connection = create_connection("Server_data")
-        if not get_rule_channel(connection, channel.id):
-            close_connection(connection)
+        if not await get_rule_channel(channel.id):
             logger.warning("The channel does not have a rule gate set.")
             await interaction.followup.send("The channel does not have a rule gate set.", ephemeral=True)
             return
-        remove_rule_channel(connection, channel.id)
-        close_connection(connection)
+        await remove_rule_channel(channel.id)
         
         # Set the permissions for the channel allow only the read_messages permission for the default role
         overwrites = {
@@ -198,7 +192,7 @@ class AccessManager(commands.Cog):
         await interaction.followup.send("The rules have been removed from the channel.", ephemeral=True)
 
 
-class PersistentAcceptRulesView(discord.ui.View):
+class PersistentAcceptRulesView(SafeView):
     def __init__(self, client: commands.Bot, channel: discord.abc.GuildChannel) -> None:
         super().__init__(timeout=None)  
         self.add_item(discord.ui.Button(label="📜 I have read the rules", style=discord.ButtonStyle.blurple, custom_id=f"Accepted_rules_{channel.id}"))
@@ -214,34 +208,31 @@ class PersistentAcceptRulesView(discord.ui.View):
             logger.warning("Channel not found.")
             return
         
-        connection = create_connection("Server_data")
-        if not get_rule_channel(connection, self.channel.id):
-            close_connection(connection)
+        if not rule_gates.loaded:
+            await load_rule_gates()
+            if not rule_gates.loaded:
+                # without the index every channel looks ungated, SafeView tells the user the database is down
+                raise DatabaseUnavailable("The rule gates could not be loaded from the database")
+        
+        if not rule_gates.is_gated(self.channel.id):
             logger.warning("The channel does not have a rule gate set.")
             await interaction.followup.send("The rules are not currently enabled", ephemeral=True)
             return
-        close_connection(connection)
         
-        ignore_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+        ignore_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
         if any(role.id in ignore_roles for role in interaction.user.roles):
             logger.debug("User has the required role to use this command.", {"user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name, "guild_id": interaction.guild.id, "guild_name": interaction.guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel.name})
             await interaction.followup.send("You have already have full access to this channel", ephemeral=True)
             return
         
-        connection = create_connection("Server_data")
-        accepted_users = get_accepted_rules(connection, self.channel.id)
-        if not accepted_users:
-            accepted_users = []
-        for user in accepted_users:
-            if user["user_id"] == interaction.user.id:
-                logger.info("User has already accepted the rules.", {"user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name, "guild_id": interaction.guild.id, "guild_name": interaction.guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel.name})
-                await interaction.followup.send("You have already accepted the rules.", ephemeral=True)
-                return
+        # set_accepted_rules only writes when the user is not in the index yet, so double clicks are caught here as well
+        if rule_gates.has_accepted(self.channel.id, interaction.user.id) or not await set_accepted_rules(self.channel.id, interaction.user.id):
+            logger.info("User has already accepted the rules.", {"user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name, "guild_id": interaction.guild.id, "guild_name": interaction.guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel.name})
+            await interaction.followup.send("You have already accepted the rules.", ephemeral=True)
+            return
     
         logger.info("User has accepted the rules.", {"user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name, "guild_id": interaction.guild.id, "guild_name": interaction.guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel })
         
-        set_accepted_rules(connection, self.channel.id, interaction.user.id)
-        close_connection(connection)
         overwite = discord.PermissionOverwrite(read_messages=True, send_messages=True)
         
         await self.channel.set_permissions(interaction.user, overwrite=overwite)
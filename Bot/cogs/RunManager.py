@@ -2,13 +2,10 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
-from functions import load_ids
-
 # local imports
+from guildConfig import guild_config
 from logger import logger
 
-ids = load_ids()
-
 teams: dict[str, dict] = {}  # Dictionary to store the team data
 
 class RunManager(commands.Cog):
@@ -18,7 +15,7 @@ class RunManager(commands.Cog):
     # Check if the user is a runner or Tech Oracle or above
     def is_runner() -> bool:
         async def predicate(interaction: discord.Interaction) -> bool:
-            allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+            allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
             if interaction.user.id in [152948524458180609, 496387339388452864, 787737643630329896] or any(role.id in allowed_roles for role in interaction.user.roles): # Allow tech oracles and up to use the command and Odd and Eli
                 logger.debug(f"User {interaction.user.display_name} is allowed to use the command.", {"user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name, "guild_id": interaction.guild.id, "guild_name": interaction.guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel.name})
                 return True
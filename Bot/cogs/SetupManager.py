@@ -4,13 +4,12 @@ from discord import app_commands
 from discord.ext import commands
 from discord.ui import View, Select
 
-from functions import load_ids, create_connection, close_connection, get_accepted_rules, get_rule_channels, create_rule_channel, remove_rule_channel, set_accepted_rules, get_rule_channel
+from functions import get_accepted_rules, get_rule_channels, create_rule_channel, remove_rule_channel, set_accepted_rules, get_rule_channel, set_guildRoles
 
 # local imports
 from logger import logger
 from cogs.utils.BaseView import BaseView
 
-ids = load_ids()
 
 
 class SetupManager(commands.Cog):
@@ -44,16 +43,7 @@ class SetupManager(commands.Cog):
         
         logger.debug("Setting up the server roles...", {"guild_id": guild.id, "guild_name": guild.name, "channel_id": interaction.channel.id, "channel_name": interaction.channel.name})
         
-        connection = create_connection()
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT * FROM roles WHERE guild_id = {guild.id}")
-        result = cursor.fetchone()
-        if result:
-            cursor.execute(f"UPDATE roles SET owner_role_id = {ownerRole.id}, moderator_role_id = {moderatorRole.id}, tech_role_id = {techRole.id}, event_organiser_role_id = {eventOrganiserRole.id}, member_role_id = {memberRole.id} WHERE guild_id = {guild.id}")
-        else:
-            cursor.execute(f"INSERT INTO roles (guild_id, owner_role_id, moderator_role_id, tech_role_id, event_organiser_role_id, member_role_id) VALUES ({guild.id}, {ownerRole.id}, {moderatorRole.id}, {techRole.id}, {eventOrganiserRole.id}, {memberRole.id})")
-        connection.commit()
-        close_connection(connection)
+        await set_guildRoles(guild.id, ownerRole.id, moderatorRole.id, techRole.id, eventOrganiserRole.id, memberRole.id)
         await interaction.response.send_message("Server roles have been set up.", ephemeral=True) 
         
     
@@ -0,0 +1,81 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+# python imports
+from datetime import datetime, timedelta, timezone
+import asyncio
+import time
+import io
+import os
+
+# local imports
+from transcriptSearch import transcript_index
+from transcript import read_transcript
+from guildConfig import guild_config
+from logger import logger
+
+
+def _date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+class TicketSearch(commands.Cog):
+    def __init__(self, client: commands.Bot) -> None:
+        self.client = client
+
+    # Check if the user is the owner, a Sky Guardian or a Tech Oracle
+    def is_staff() -> bool:
+        async def predicate(interaction: discord.Interaction) -> bool:
+            config = guild_config[interaction.guild.id]
+            allowed_roles: list[int] = [config.sky_guardians_role_id, config.tech_oracle_role_id]
+            if interaction.user.id == config.owner_id or any(role.id in allowed_roles for role in interaction.user.roles):
+                return True
+            logger.info("User does not have the required role to search the tickets.", {"user_id": interaction.user.id, "username": interaction.user.name, "guild_id": interaction.guild.id})
+            await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+            return False
+        return app_commands.check(predicate)
+
+    @app_commands.command(name="search_tickets", description="Search the transcripts of closed tickets.")
+    @app_commands.describe(words="Words that have to be in the transcript", user="Username of someone that posted in the ticket", since="Closed on or after this date (YYYY-MM-DD)", until="Closed before this date (YYYY-MM-DD)")
+    @app_commands.guild_only()
+    @is_staff()
+    async def search_tickets(self, interaction: discord.Interaction, words: str | None = None, user: discord.User | None = None, since: str | None = None, until: str | None = None) -> None:
+        logger.command(interaction)
+        try:
+            since_date, until_date = _date(since), _date(until)
+        except ValueError:
+            await interaction.response.send_message("The dates have to look like 2024-12-31.", ephemeral=True)
+            return
+        if until_date:
+            until_date += timedelta(days=1)  # the whole day of `until` is included
+        await interaction.response.defer(ephemeral=True)
+
+        started = time.perf_counter()
+        # the backfilled transcripts could be from any server the bot is in, only the owner gets to see them
+        unassigned = interaction.user.id == guild_config[interaction.guild.id].owner_id
+        hits = await transcript_index.search(words, user.name if user else None, since_date, until_date, interaction.guild.id, unassigned)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not hits:
+            await interaction.followup.send("No transcripts found.", ephemeral=True)
+            return
+
+        lines = [f"**{len(hits)} transcript(s)** in {elapsed:.0f}ms"]
+        for hit in hits:
+            lines.append(f"`{hit.channel}` closed <t:{int(hit.closed_at.timestamp())}:d>")
+            if hit.snippet:
+                lines.append("> " + hit.snippet.replace("\n", " ")[:200])
+        report = "\n".join(lines)
+        if len(report) > 1900:
+            report = report[:1900] + "\n..."
+        # the best match is attached, so it can be read without going through the server files
+        try:
+            transcript = await asyncio.to_thread(read_transcript, hits[0].path)
+        except OSError as e:
+            logger.error(f"Could not read the transcript {hits[0].path}: {e!r}")
+            await interaction.followup.send(report, ephemeral=True)
+            return
+        file = discord.File(io.BytesIO(transcript.encode("utf-8")), filename=os.path.basename(hits[0].path))
+        await interaction.followup.send(report, file=file, ephemeral=True)
@@ -0,0 +1,10 @@
+import discord
+
+from functions import handle_interaction_error
+
+
+class SafeView(discord.ui.View):
+    """A view that answers the user when one of its callbacks fails, instead of leaving the interaction hanging."""
+
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item: discord.ui.Item) -> None:
+        await handle_interaction_error(interaction, error)
@@ -0,0 +1,402 @@
+# python imports
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+from typing import Any
+import asyncio
+import threading
+import time
+import os
+
+# 3rd party imports
+import mysql.connector
+from mysql.connector import Error, InterfaceError
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+# local imports
+from logger import logger
+
+load_dotenv()
+DATABASE_ENDPOINT = os.getenv("DATABASE_ENDPOINT")
+DATABASE_USER = os.getenv("DATABASE_USERNAME")
+DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
+DATABASE_PORT = os.getenv("DATABASE_PORT")
+CONNECT_TIMEOUT: int = int(os.getenv("DATABASE_CONNECT_TIMEOUT", 2))  # seconds, a dead server should not hold up an interaction
+
+# pool settings, these can be overwritten in the .env file
+POOL_MIN_SIZE: int = int(os.getenv("DATABASE_POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE: int = int(os.getenv("DATABASE_POOL_MAX_SIZE", 5))
+POOL_ACQUIRE_TIMEOUT: float = float(os.getenv("DATABASE_POOL_ACQUIRE_TIMEOUT", 2))
+POOL_IDLE_TIMEOUT: float = float(os.getenv("DATABASE_POOL_IDLE_TIMEOUT", 300))  # seconds before an idle connection is recycled
+POOL_HEALTH_CHECK_INTERVAL: float = float(os.getenv("DATABASE_POOL_HEALTH_CHECK_INTERVAL", 30))  # seconds of idle time before a connection gets pinged
+PREPARED_STATEMENTS: bool = os.getenv("DATABASE_PREPARED_STATEMENTS", "True") == "True"
+PREPARED_CACHE_SIZE: int = int(os.getenv("DATABASE_PREPARED_CACHE_SIZE", 64))  # prepared statements kept per connection
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be taken from the pool in time."""
+
+
+# Function to create MySQL database connection
+def connect(database_name: str | None = None) -> MySQLConnectionAbstract:
+    """Open a single connection outside of the pools, leave out the database name to connect to the server itself."""
+    logger.debug(f"Connecting to the database: {database_name}")
+    connection = mysql.connector.connect(
+        host=DATABASE_ENDPOINT,
+        user=DATABASE_USER,
+        password=DATABASE_PASSWORD,
+        database=database_name,
+        port=DATABASE_PORT,
+        autocommit=False,
+        connection_timeout=CONNECT_TIMEOUT
+    )
+    if not connection.is_connected():
+        logger.error("Failed to connect to the database.", extra={
+            "host": DATABASE_ENDPOINT,
+            "user": DATABASE_USER,
+            "database": database_name,
+            "port": DATABASE_PORT
+        })
+        raise InterfaceError(msg=f"Failed to connect to the database {database_name}")
+    return connection
+
+
+class _PooledConnection(object):
+    """A connection owned by the pool together with its bookkeeping."""
+    __slots__ = ("connection", "created_at", "last_used", "statements")
+
+    def __init__(self, connection: MySQLConnectionAbstract) -> None:
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # query -> (the query object it was prepared with, the prepared cursor), least recently used first
+        self.statements: OrderedDict[str, tuple[str, Any]] = OrderedDict()
+
+    def prepared_cursor(self, query: str, cache_size: int) -> tuple[str, Any, bool]:
+        """Get the prepared cursor for a query, the statement is prepared on the server the first time it's used.
+
+        The cursor only skips preparing when it gets the exact same query object again,
+        so the query is returned as well and must be the one that is executed.
+
+        Returns:
+            tuple[str, Any, bool]: The query to execute, the cursor and whether it came from the cache
+        """
+        cached = self.statements.get(query)
+        if cached is not None:
+            self.statements.move_to_end(query)
+            return cached[0], cached[1], True
+        cursor = self.connection.cursor(prepared=True)
+        self.statements[query] = (query, cursor)
+        while len(self.statements) > cache_size:
+            _, (_, oldest) = self.statements.popitem(last=False)
+            oldest.close()  # deallocates the statement on the server
+        return query, cursor, False
+
+    def forget(self, query: str) -> None:
+        cached = self.statements.pop(query, None)
+        if cached is not None:
+            try:
+                cached[1].close()
+            except Error:
+                pass
+
+    def close(self) -> None:
+        for query in list(self.statements):
+            self.forget(query)
+        self.connection.close()
+
+
+class ConnectionPool(object):
+    def __init__(self, database_name: str, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE, acquire_timeout: float = POOL_ACQUIRE_TIMEOUT, idle_timeout: float = POOL_IDLE_TIMEOUT, health_check_interval: float = POOL_HEALTH_CHECK_INTERVAL) -> None:
+        """Create a bounded pool of connections to one database.
+
+        Args:
+            database_name (str): The name of the database the connections are made to
+            min_size (int, optional): The amount of connections that are kept open, even when idle.
+            max_size (int, optional): The maximum amount of connections that can be open at the same time.
+            acquire_timeout (float, optional): How long to wait for a free connection before giving up.
+            idle_timeout (float, optional): How long a connection above `min_size` may stay idle before it is closed.
+            health_check_interval (float, optional): How long a connection may stay idle before it gets pinged on checkout.
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size, min_size={min_size} max_size={max_size}")
+        self.database_name = database_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+
+        self._idle: deque[_PooledConnection] = deque()
+        self._size: int = 0  # idle + checked out connections
+        self._condition = threading.Condition()
+        self._closed = False
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        # the queries run in their own threads so they never block the event loop,
+        # one thread per connection is enough as a query always holds a connection
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix=f"db-{database_name}")
+
+    # Function to open a new connection for the pool
+    def _connect(self) -> _PooledConnection:
+        return _PooledConnection(connect(self.database_name))
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        try:
+            pooled.close()
+        except Error as e:
+            logger.debug(f"The error '{e}' occurred while closing a pooled connection")
+
+    # Function to check that an idle connection is still usable
+    def _is_healthy(self, pooled: _PooledConnection) -> bool:
+        if time.monotonic() - pooled.last_used < self.health_check_interval:
+            return True
+        try:
+            pooled.connection.ping(reconnect=False)
+            return True
+        except Error as e:
+            logger.warning(f"Dropping unhealthy connection to {self.database_name}: {e}")
+            return False
+
+    def acquire(self) -> _PooledConnection:
+        """Take a connection from the pool, this blocks the calling thread until one is free."""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeout(f"The pool for {self.database_name} is closed")
+                if self._idle:
+                    pooled = self._idle.pop()  # most recently used first, so old ones can expire
+                    break
+                if self._size < self.max_size:
+                    self._size += 1  # reserve the slot before connecting outside the lock
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free connection to {self.database_name} within {self.acquire_timeout}s")
+                self._condition.wait(remaining)
+
+        if pooled is not None and self._is_healthy(pooled):
+            return pooled
+        if pooled is not None:
+            self._discard(pooled)
+        try:
+            pooled = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        return pooled
+
+    def release(self, pooled: _PooledConnection, broken: bool = False) -> None:
+        """Give a connection back to the pool."""
+        pooled.last_used = time.monotonic()
+        if not broken:
+            try:
+                pooled.connection.rollback()  # never hand out a connection with an open transaction
+            except Error:
+                broken = True
+        with self._condition:
+            if broken or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append(pooled)
+            self._condition.notify()
+        if broken or self._closed:
+            self._discard(pooled)
+
+    def recycle_idle(self) -> int:
+        """Close the connections that have been idle for too long, but keep at least `min_size` open.
+
+        Returns:
+            int: The amount of connections that have been closed
+        """
+        now = time.monotonic()
+        expired: list[_PooledConnection] = []
+        with self._condition:
+            # the oldest idle connections are on the left of the deque
+            while self._idle and self._size > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+                expired.append(self._idle.popleft())
+                self._size -= 1
+        for pooled in expired:
+            self._discard(pooled)
+        if expired:
+            logger.debug(f"Recycled {len(expired)} idle connection(s) to {self.database_name}")
+        return len(expired)
+
+    def fill(self) -> None:
+        """Open connections until the pool holds at least `min_size` of them."""
+        while True:
+            with self._condition:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                raise
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+
+    def close(self) -> None:
+        """Close every idle connection and refuse any new checkouts."""
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+        self._executor.shutdown(wait=False)
+        logger.debug(f"Closed the connection pool for {self.database_name}")
+
+    # Function that runs a single query on a pooled connection
+    def execute(self, query: str, values: Any = None, fetch: bool = False, timings: dict[str, float] | None = None) -> list[dict] | int | None:
+        """Run a query on a pooled connection in the calling thread.
+
+        Args:
+            query (str): The query to run
+            values (Any, optional): The values for the placeholders in the query.
+            fetch (bool, optional): When True the rows are returned, otherwise the change is committed and the rowcount is returned.
+            timings (dict, optional): When given, the seconds spent on getting a connection, executing and fetching are stored in it.
+        """
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        pooled = self.acquire()
+        connection = pooled.connection
+        timings["connect"] = time.perf_counter() - started
+        broken = False
+        # queries with placeholders are prepared once per connection and reused after that,
+        # their cursors stay open in the connection's cache until they are evicted or the connection closes
+        prepared = PREPARED_STATEMENTS and values is not None
+        try:
+            if prepared:
+                query, cursor, cached = pooled.prepared_cursor(query, PREPARED_CACHE_SIZE)
+                if cached:
+                    self.prepared_hits += 1
+                else:
+                    self.prepared_misses += 1
+            else:
+                cursor = connection.cursor(dictionary=fetch)
+            try:
+                started = time.perf_counter()
+                cursor.execute(query, values)
+                timings["execute"] = time.perf_counter() - started
+                started = time.perf_counter()
+                if fetch:
+                    result = cursor.fetchall()
+                    if prepared:
+                        columns = cursor.column_names
+                        result = [dict(zip(columns, row)) for row in result]
+                    timings["rows"] = len(result)
+                else:
+                    connection.commit()
+                    result = cursor.rowcount
+                    timings["rows"] = max(result, 0)
+                timings["fetch"] = time.perf_counter() - started
+                return result
+            except Error:
+                if prepared:
+                    pooled.forget(query)  # the statement might be half done, prepare it again next time
+                raise
+            finally:
+                if not prepared:
+                    cursor.close()  # release the cursor right away, also when the query failed
+        except Error as e:
+            broken = not connection.is_connected()
+            raise e
+        finally:
+            self.release(pooled, broken=broken)
+
+    def execute_batch(self, statements: list[tuple[str, Any]], timings: dict[str, float] | None = None) -> int:
+        """Run several changing queries in one transaction, either all of them are committed or none.
+
+        Returns:
+            int: The total amount of affected rows
+        """
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        pooled = self.acquire()
+        connection = pooled.connection
+        timings["connect"] = time.perf_counter() - started
+        broken = False
+        try:
+            # the batches differ in size every time, so preparing them would only fill the statement cache
+            cursor = connection.cursor()
+            try:
+                started = time.perf_counter()
+                rowcount = 0
+                for query, values in statements:
+                    cursor.execute(query, values)
+                    rowcount += max(cursor.rowcount, 0)
+                timings["execute"] = time.perf_counter() - started
+                started = time.perf_counter()
+                connection.commit()
+                timings["fetch"] = time.perf_counter() - started
+                timings["rows"] = rowcount
+                return rowcount
+            finally:
+                cursor.close()
+        except Error as e:
+            broken = not connection.is_connected()
+            raise e
+        finally:
+            self.release(pooled, broken=broken)
+
+    async def run(self, query: str, values: Any = None, fetch: bool = False, timings: dict[str, float] | None = None) -> list[dict] | int | None:
+        """Run a query in the pool's own threads so the event loop never waits on MySQL."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.execute, query, values, fetch, timings)
+
+    async def run_batch(self, statements: list[tuple[str, Any]], timings: dict[str, float] | None = None) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.execute_batch, statements, timings)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._condition:
+            return {"size": self._size, "idle": len(self._idle), "in_use": self._size - len(self._idle), "prepared_hits": self.prepared_hits, "prepared_misses": self.prepared_misses}
+
+
+# one pool per database, shared by the whole process
+pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database_name: str) -> ConnectionPool:
+    """Get the shared pool for a database, the pool is created on first use."""
+    pool = pools.get(database_name)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        if database_name not in pools:
+            logger.debug(f"Creating a connection pool for {database_name}", {"min_size": POOL_MIN_SIZE, "max_size": POOL_MAX_SIZE})
+            pools[database_name] = ConnectionPool(database_name)
+        return pools[database_name]
+
+
+async def maintain_pools(interval: float = 60) -> None:
+    """Background task that recycles idle connections and keeps the pools at their minimum size."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        for pool in list(pools.values()):
+            try:
+                await loop.run_in_executor(pool._executor, pool.recycle_idle)
+                await loop.run_in_executor(pool._executor, pool.fill)
+            except Exception as e:
+                logger.error(f"An error occurred while maintaining the pool for {pool.database_name}: {e}")
+
+
+def close_pools() -> None:
+    """Close all the pools, used when the bot shuts down."""
+    with _pools_lock:
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
@@ -0,0 +1,169 @@
+# python imports
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv
+from typing import Any
+import threading
+import asyncio
+import json
+import time
+import re
+import os
+
+# local imports
+from trackResolver import stream_expiry, STREAM_EXPIRY_MARGIN
+from logger import logger
+
+load_dotenv()
+MUSIC_CACHE_SIZE: int = int(os.getenv("MUSIC_CACHE_SIZE", 5000))  # songs that are remembered, the least recently played go first
+MUSIC_CACHE_PATH: str = os.getenv("MUSIC_CACHE_PATH", "/dreamy-data/music/extract_cache.json")  # empty to keep the cache in memory only
+MUSIC_CACHE_SAVE_INTERVAL: float = 300.0  # seconds between two saves of the cache, only when something changed
+METADATA_TTL: float = 30 * 86400.0  # seconds the title and duration of a song are kept
+
+# the parts of the yt_dlp info that the player uses, the rest (formats, thumbnails, subtitles...) is dropped
+METADATA_KEYS: tuple[str, ...] = ("id", "title", "duration", "uploader", "original_url", "webpage_url")
+STREAM_KEYS: tuple[str, ...] = ("url",)
+_VIDEO_ID = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([\w-]{11})")
+
+
+def video_id(url: str) -> str:
+    """The YouTube video id of a url, urls of other sites are their own key."""
+    match = _VIDEO_ID.search(url)
+    return match.group(1) if match else url
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    metadata: dict[str, Any]
+    metadata_expires: float
+    stream: dict[str, Any] | None
+    stream_expires: float
+
+    def stream_fresh(self, now: float) -> bool:
+        return self.stream is not None and self.stream_expires - now >= STREAM_EXPIRY_MARGIN
+
+
+class ExtractCache(object):
+    """An LRU cache of what yt_dlp extracted per video id.
+
+    The title and duration of a song hardly change and are kept for `METADATA_TTL`, the stream URL is
+    signed and only kept until it expires. The extraction runs in executor threads, so the cache has a lock.
+    """
+
+    def __init__(self, path: str = MUSIC_CACHE_PATH, max_entries: int = MUSIC_CACHE_SIZE) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0  # the song could be played from the cache
+        self.expired = 0  # the song was known but its stream URL expired
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, url: str) -> dict[str, Any] | None:
+        """The info of a song with a stream URL that still works, None when it has to be extracted."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id(url))
+            if entry is None or entry.metadata_expires < now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id(url))
+            if not entry.stream_fresh(now):
+                self.expired += 1
+                return None
+            self.hits += 1
+            return {**entry.metadata, **entry.stream}
+
+    def metadata(self, url: str) -> dict[str, Any] | None:
+        """The title, duration... of a song without looking at its stream URL and without counting as a hit."""
+        with self._lock:
+            entry = self._entries.get(video_id(url))
+            return dict(entry.metadata) if entry is not None and entry.metadata_expires >= time.time() else None
+
+    def put(self, url: str, data: dict[str, Any]) -> dict[str, Any]:
+        """Remember what yt_dlp extracted for `url`, returns the part of it that is kept."""
+        now = time.time()
+        metadata = {key: data[key] for key in METADATA_KEYS if key in data}
+        stream = {key: data[key] for key in STREAM_KEYS if key in data} or None
+        entry = CacheEntry(metadata, now + METADATA_TTL, stream, stream_expiry(data, now) if stream else 0.0)
+        with self._lock:
+            key = video_id(url)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+        return {**metadata, **(stream or {})}
+
+    def _save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = {key: asdict(entry) for key, entry in self._entries.items()}
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary = self.path + ".part"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(temporary, self.path)  # a crash while saving leaves the previous file
+        except OSError:
+            self._dirty = True  # tried again next time
+            raise
+
+    async def save(self) -> None:
+        if self.path:
+            await asyncio.to_thread(self._save)
+
+    def _load(self) -> int:
+        with open(self.path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        now = time.time()
+        # saved from the least to the most recently used, the songs played since the start are more recent still
+        loaded = OrderedDict((key, CacheEntry(**entry)) for key, entry in entries.items() if entry["metadata_expires"] >= now)
+        with self._lock:
+            for key, entry in self._entries.items():
+                loaded.pop(key, None)
+                loaded[key] = entry
+            while len(loaded) > self.max_entries:
+                loaded.popitem(last=False)
+            self._entries = loaded
+            return len(loaded)
+
+    async def load(self) -> None:
+        """Read the cache of the previous run, a missing or broken file starts an empty cache."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            count = await asyncio.to_thread(self._load)
+            logger.info(f"Loaded {count} song(s) into the music cache")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Could not load the music cache from {self.path}: {e!r}")
+
+    async def maintain(self, interval: float = MUSIC_CACHE_SAVE_INTERVAL) -> None:
+        """Load the cache and save it every `interval` seconds, for as long as the bot runs."""
+        await self.load()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save()
+            except OSError as e:
+                logger.error(f"Could not save the music cache to {self.path}: {e!r}")
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.expired + self.misses
+        return {
+            "songs": len(self._entries),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "hits": self.hits,
+            "expired": self.expired,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+extract_cache = ExtractCache()
@@ -0,0 +1,157 @@
+# python imports
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from typing import Any, Callable
+import asyncio
+import time
+import os
+
+# local imports
+from logger import logger
+
+load_dotenv()
+MUSIC_EXTRACT_WORKERS: int = int(os.getenv("MUSIC_EXTRACT_WORKERS", 3))  # yt_dlp extractions that run at the same time
+WAIT_WINDOW: int = 200  # the amount of recent jobs the wait percentiles are based on
+
+# lower runs first: the song that has to play now goes before the songs that are resolved ahead of time,
+# those go before the rest of a playlist that is still being read
+NOW_PLAYING: int = 0
+LOOKAHEAD: int = 1
+PLAYLIST: int = 2
+PRIORITY_NAMES: tuple[str, ...] = ("now_playing", "lookahead", "playlist")
+
+
+@dataclass(slots=True)
+class ExtractJob:
+    guild_id: int
+    priority: int
+    function: Callable[..., Any]
+    args: tuple
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.perf_counter)
+
+
+class ExtractPool(object):
+    """A fixed number of threads for the yt_dlp extractions of the music player.
+
+    Every guild has its own queue per priority and the workers take turns between the guilds, so a
+    guild that queues a big playlist can't keep the others waiting. `submit` returns a future that
+    can be cancelled: a job that didn't start yet is dropped, the result of a running one is thrown away.
+    """
+
+    def __init__(self, workers: int = MUSIC_EXTRACT_WORKERS) -> None:
+        self.workers = workers
+        self._queues: list[OrderedDict[int, deque[ExtractJob]]] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._queued: dict[asyncio.Future, ExtractJob] = {}
+        self._wakeup: asyncio.Semaphore | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="music-extract")
+        self._waits: list[deque[float]] = [deque(maxlen=WAIT_WINDOW) for _ in PRIORITY_NAMES]
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _start(self) -> None:
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Semaphore(0)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def _enqueue(self, job: ExtractJob) -> None:
+        self._queues[job.priority].setdefault(job.guild_id, deque()).append(job)
+        self._queued[job.future] = job
+        self._wakeup.release()
+
+    def submit(self, guild_id: int, function: Callable[..., Any], *args, priority: int = LOOKAHEAD) -> asyncio.Future:
+        """Run `function(*args)` on one of the threads, in turn with the other guilds."""
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._forget)
+        self._enqueue(ExtractJob(guild_id, priority, function, args, future))
+        return future
+
+    def _forget(self, future: asyncio.Future) -> None:
+        self._queued.pop(future, None)
+        if future.cancelled():
+            self.cancelled += 1
+
+    def promote(self, future: asyncio.Future, priority: int = NOW_PLAYING) -> None:
+        """Move a job that is still waiting to a more urgent priority, for when a look-ahead song is up now."""
+        job = self._queued.get(future)
+        if job is None or job.priority <= priority:
+            return
+        guilds = self._queues[job.priority]
+        guilds[job.guild_id].remove(job)
+        if not guilds[job.guild_id]:
+            del guilds[job.guild_id]
+        job.priority = priority
+        self._queues[priority].setdefault(job.guild_id, deque()).appendleft(job)
+
+    def _next(self) -> ExtractJob | None:
+        """The first job of the most urgent priority, from the guild whose turn it is."""
+        for guilds in self._queues:
+            while guilds:
+                guild_id, jobs = next(iter(guilds.items()))
+                job = jobs.popleft()
+                if jobs:
+                    guilds.move_to_end(guild_id)  # the other guilds go first next time
+                else:
+                    del guilds[guild_id]
+                if not job.future.done():  # cancelled jobs are only skipped here
+                    return job
+        return None
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.acquire()
+            job = self._next()
+            if job is None:
+                continue
+            self._queued.pop(job.future, None)
+            self._waits[job.priority].append(time.perf_counter() - job.queued_at)
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self._executor, job.function, *job.args)
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.completed += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.running -= 1
+
+    def cancel(self, guild_id: int) -> int:
+        """Cancel every job of a guild that didn't start yet, returns how many."""
+        count = 0
+        for guilds in self._queues:
+            for job in guilds.pop(guild_id, ()):
+                count += job.future.cancel()
+        if count:
+            logger.debug(f"Cancelled {count} queued extraction(s) for guild {guild_id}")
+        return count
+
+    def percentile(self, priority: int, fraction: float) -> float:
+        waits = sorted(self._waits[priority])
+        if not waits:
+            return 0.0
+        return waits[min(len(waits) - 1, int(len(waits) * fraction))]
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {"workers": self.workers, "running": self.running}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats[f"{name}_queued"] = sum(not job.future.done() for jobs in self._queues[priority].values() for job in jobs)
+            stats[f"{name}_wait_p50_ms"] = round(self.percentile(priority, 0.5) * 1000)
+            stats[f"{name}_wait_p95_ms"] = round(self.percentile(priority, 0.95) * 1000)
+        stats.update(completed=self.completed, failed=self.failed, cancelled=self.cancelled)
+        return stats
+
+
+extract_pool = ExtractPool()
@@ -4,56 +4,28 @@ from discord.ext import commands
 
 # python imports
 from dotenv import load_dotenv
+from typing import Callable
 import os
 import re
 
 # 3rd party imports
-import mysql.connector
-from mysql.connector import Error
-from mysql.connector.abstracts import MySQLConnectionAbstract
-from mysql.connector.pooling import PooledMySQLConnection
 import yt_dlp
-import zipfile
 
 # local imports
+from storage import get_storage, DatabaseUnavailable, StorageError
+from queryStats import named_query
 from logger import logger
+from ruleIndex import rule_gates
+from ticketIndex import open_tickets
+from guildConfig import guild_config
+from attachments import StoredAttachment
+from ticketArchive import archive_ticket, archive_attachments
+from ticketCapture import ticket_capture
+from transcriptSearch import transcript_index, TRANSCRIPT_SEARCH
+from writeBehind import write_behind
 
 load_dotenv()
-DATABASE_ENDPOINT = os.getenv("DATABASE_ENDPOINT")
-DATABASE_USER = os.getenv("DATABASE_USERNAME")
-DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
-DATABASE_PORT = os.getenv("DATABASE_PORT")
-
-
-def load_ids() -> dict[int, dict[str, int]]:
-    logger.debug("Loading IDs from the database.")
-    # load the ids from the database
-    connection = create_connection("Servers")
-    query = "SELECT * FROM guilds"
-    result = select_query(connection, query, [])
-    if result:
-        ids = {}
-        for guild in result:
-            server_id = guild["server_id"]
-            ids[server_id] = {
-                "owner_id": guild["owner_id"],
-                "sancturary_keeper_role_id": guild["sancturary_keeper_role_id"],
-                "sky_guardians_role_id": guild["sky_guardians_role_id"],
-                "tech_oracle_role_id": guild["tech_oracle_role_id"],
-                "event_luminary_role_id": guild["event_luminary_role_id"],
-                "assistaint_role_id": guild["assistaint_role_id"],
-                "support_category_id": guild["support_category_id"],
-                "general_category_id": guild["general_category_id"],
-                "music_voice_id": guild["music_voice_id"],
-                "bot_channel_id": guild["bot_channel_id"],
-                "music_channel_id": guild["music_channel_id"],
-                "ticket_channel_id": guild["ticket_channel_id"],
-                "ticket_log_channel_id": guild["ticket_log_channel_id"]
-            }
-        close_connection(connection)
-        return ids
-    logger.error("No IDs found in the database.")
-    raise Exception("No IDs found in the database.")
+
 
 # Function to send the response
 async def send_message_to_user(client: commands.Bot, user_id: int, message: str) -> None:
@@ -70,250 +42,285 @@ async def send_message_to_user(client: commands.Bot, user_id: int, message: str)
         logger.error(f"An error occurred while trying to send an message: {e}")
 
 
+# Function to answer an interaction that failed
+async def handle_interaction_error(interaction: discord.Interaction, error: Exception) -> None:
+    """Tell the user something went wrong, with a friendly message when the database is unavailable."""
+    original = getattr(error, "original", error)  # app command errors wrap the real error
+    if isinstance(original, DatabaseUnavailable):
+        logger.warning(f"Interaction in {interaction.channel} failed because the database is unavailable: {original}")
+        message = "I can't reach my database right now, please try again in a minute."
+    else:
+        logger.error(f"An error occurred while processing an interaction in {interaction.channel}: {error}")
+        message = "Something went wrong while processing this, please try again later."
+    try:
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+    except discord.HTTPException as e:
+        logger.error(f"Could not tell the user about the error: {e}")
+
+
 # Function to save the transcript of a ticket
 async def save_transcript(channel: discord.TextChannel, ticket_logs: str) -> str:
     logger.info(f"Saving transcript for ticket {channel.name}")
-    _dir = "/dreamy-data"
-    path = f"{_dir}/tickets/{channel.name}/transcript-{channel.name}.txt"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-
-    try:
-        # Open the file with UTF-8 encoding and handle any encoding errors gracefully
-        with open(path, "w", encoding="utf-8", errors="replace") as f:
-            logger.info(f"Writing transcript for ticket {channel.name}")
-            async for message in channel.history(limit=None):
-                # Append the message with the author's name to the logs
-                if message.attachments:
-                    for attachment in message.attachments:
-                        ticket_logs = f"       {attachment.filename}\n" + ticket_logs
-                    ticket_logs = "    Attached attachment(s):\n"  + ticket_logs
-                ticket_logs = f"{message.author.name}: {message.content}\n" + ticket_logs
-            ticket_logs = f"Transcript for {channel.name}:\n" + "```\n" + ticket_logs + "```"
-            f.write(ticket_logs)
-        return path
-    except Exception as e:
-        logger.critical(f"Error saving transcript for {channel.name}: {e}")
+    if ticket_capture.has_log(channel.id):
+        path, _ = await ticket_capture.finalize(channel, _transcript_path(channel), ticket_logs)
+    else:
+        archive = await archive_ticket(channel, _ticket_dir(channel), attachments=False, footer=ticket_logs)
+        path = archive["transcript"]
+    await _index_transcript(channel, path)
+    return path
 
 
-async def save_attachments(channel: discord.TextChannel) -> str:
+async def save_attachments(channel: discord.TextChannel) -> list[StoredAttachment] | None:
     logger.info(f"Saving attachments for ticket {channel.name}")
-    _dir = "/dreamy-data"
-    path = f"{_dir}/tickets/{channel.name}/"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+    archive = await archive_ticket(channel, _ticket_dir(channel), transcript=False)
+    return archive["attachments"]  # the attachments and the files they are stored in
 
-    attachments = [] # List to store the file paths of the attachments
-    try:
-        async for message in channel.history(limit=None):
-            for attachment in message.attachments:
-                file_path = f"{path}/{attachment.filename}"
-                while os.path.exists(file_path): # If the file already exists, add a number to the file name
-                    if file_path[:-4].endswith(")"): # If the file name already has a number in brackets (this only works on files with 3 character extensions)
-                        extension = file_path[-4:]
-                        file_path = file_path[:-5] # Remove the number and brackets
-                        number = int(file_path[-1])
-                        number += 1
-                        file_path = file_path[:-1]
-                        file_path = f"{file_path}{number}){extension}"
-                    else:
-                        file_path = f"{file_path[:-4]} (1){file_path[-4:]}"
-                await attachment.save(file_path)
-                attachments.append(file_path)
-        return attachments # Return the list of file paths
-    except Exception as e: 
-        logger.critical(f"Error saving attachments for {channel.name}: {e}")
-
-
-async def zip_files(channel: discord.TextChannel) -> str:
+
+async def zip_files(channel: discord.TextChannel) -> str | StoredAttachment | None:
     logger.info(f"Zipping files for ticket {channel.name}")
+    archive = await archive_ticket(channel, _ticket_dir(channel), transcript=False)
+    return archive["archive"]
+
+
+# Function to save everything of a ticket, the history is only walked once
+async def save_ticket(channel: discord.TextChannel, ticket_logs: str = "") -> dict:
+    """Save the transcript, attachments and attachment zip of a ticket.
+
+    Returns:
+        dict: The paths under `transcript` and `archive`, the stored files under `attachments` and the ticket numbers under `stats`
+    """
+    logger.info(f"Saving ticket {channel.name}")
+    if not ticket_capture.has_log(channel.id):
+        archive = await archive_ticket(channel, _ticket_dir(channel), footer=ticket_logs)
+    else:
+        # the messages and their attachment links were captured while the ticket was open, the history isn't read at all
+        path, attachments = await ticket_capture.finalize(channel, _transcript_path(channel), ticket_logs)
+        if attachments is None:
+            archive = await archive_ticket(channel, _ticket_dir(channel), transcript=False)  # captured before the links were
+        elif attachments:
+            attachments = await ticket_capture.refresh_links(channel, attachments)
+            archive = await archive_attachments(_ticket_dir(channel), channel.name, attachments)
+        else:
+            archive = {"attachments": [], "archive": None, "skipped": [], "stats": {}}
+        archive["transcript"] = path
+    await _index_transcript(channel, archive["transcript"])
+    return archive
+
+
+def _ticket_dir(channel: discord.TextChannel) -> str:
     _dir = "/dreamy-data"
-    path = f"{_dir}/tickets/{channel.name}/"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    filepaths = await save_attachments(channel)
-    try:
-        if not filepaths: # If there are no attachments
-            return None
-        if len(filepaths) == 0: # if there are no attachments
-            return None
-        if len(filepaths) == 1: # If there is only one attachment, send only the attachment
-            return filepaths[0]
-        
-        # Zip the files
-        zip_path = f"{path}/attachments-{channel.name}.zip"
-        with zipfile.ZipFile(zip_path, "w") as zipf:
-            for file in filepaths:
-                zipf.write(file, os.path.basename(file))
-
-        return zip_path
-    except Exception as e:
-        logger.critical(f"Error zipping files for {channel.name}: {e}")
-    
+    # ticket names come back for every new ticket of a user, the id keeps the archive of every ticket apart
+    return f"{_dir}/tickets/{channel.name}-{channel.id}"
 
-# Function to create MySQL database connection
-def create_connection(database_name: str) -> mysql.connector.connection.MySQLConnection:
-    logger.debug(f"Connecting to the database: {database_name}")
-    connection = None
-    try:
-        connection: PooledMySQLConnection | MySQLConnectionAbstract = mysql.connector.connect(
-            host=DATABASE_ENDPOINT,
-            user=DATABASE_USER,
-            password=DATABASE_PASSWORD,
-            database=database_name,
-            port=DATABASE_PORT
-        )
-        if not connection.is_connected():
-            logger.error("Failed to connect to the database.", extra={
-                "host": DATABASE_ENDPOINT,
-                "user": DATABASE_USER,
-                "database": database_name,
-                "port": DATABASE_PORT
-            })
-    except Error as e:
-        logger.error(f"The error '{e}' occurred")
-    return connection
-
-
-# Insert query function
-def insert_query(connection: PooledMySQLConnection | MySQLConnectionAbstract, query, values):
-    logger.debug(f"Inserting data into the database: {values}")
-    cursor = connection.cursor()
-    try:
-        cursor.execute(query, values)
-        connection.commit()
-    except Error as e:
-        logger.error(f"The error '{e}' occurred")
 
+def _transcript_path(channel: discord.TextChannel) -> str:
+    return os.path.join(_ticket_dir(channel), f"transcript-{channel.name}.txt")
 
-# Select query function
-def select_query(connection: PooledMySQLConnection | MySQLConnectionAbstract, query, values=None):
-    logger.debug(f"Selecting data from the database: {query}")
-    cursor = connection.cursor(dictionary=True)
-    try:
-        cursor.execute(query, values)
-        result = cursor.fetchall()
-        return result
-    except Error as e:
-        logger.error(f"The error '{e}' occurred")
 
+async def _index_transcript(channel: discord.TextChannel, path: str | None) -> None:
+    if TRANSCRIPT_SEARCH and path:
+        await transcript_index.add(path, channel.guild.id)
+
+
+# Write helpers for the Server_data tables, when the write-behind queue is enabled the write is batched with others
+# Returns False when the insert failed, insert() logs the error instead of raising it
+async def _write_insert(table: str, columns: tuple[str, ...], values: tuple, ignore: bool = False, on_dropped: Callable[[], None] | None = None) -> bool:
+    if write_behind.accepting:
+        write_behind.insert("Server_data", table, columns, values, on_dropped=on_dropped)
+        return True
+    query = f"INSERT {'IGNORE ' if ignore else ''}INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    return await get_storage().insert("Server_data", query, values) is not None
 
-# Update query function
-def update_query(connection: PooledMySQLConnection | MySQLConnectionAbstract, query, values):
-    logger.debug(f"Updating data in the database: {values}")
-    cursor = connection.cursor()
-    try:
-        cursor.execute(query, values)
-        connection.commit()
-    except Error as e:
-        logger.error(f"The error '{e}' occurred")
-
-# Delete query function
-def delete_query(connection: PooledMySQLConnection | MySQLConnectionAbstract, query, values):
-    logger.debug(f"Deleting data from the database: {values}")
-    cursor = connection.cursor()
-    try:
-        cursor.execute(query, values)
-        connection.commit()
-    except Error as e:
-        logger.error(f"The error '{e}' occurred")
-
-
-# Close MySQL connection
-def close_connection(connection: PooledMySQLConnection | MySQLConnectionAbstract):
-    if connection.is_connected():
-        logger.debug("Closing the database connection.")
-        connection.close()
-    if connection.is_connected():
-        logger.error("Failed to close the database connection.")
-    else:
-        logger.debug("Database connection closed.")
+
+async def _write_delete(table: str, column: str, value: int) -> None:
+    if write_behind.accepting:
+        write_behind.delete("Server_data", table, column, value)
+        return
+    query = f"DELETE FROM {table} WHERE {column} = %s"
+    await get_storage().delete("Server_data", query, (value,))
+
+
+# Make sure the pending writes of a table are in the database before reading from it
+async def _read_after_write(table: str) -> None:
+    if write_behind.enabled and write_behind.pending:
+        await write_behind.flush("Server_data", table)
 
 
-def get_guildSettings(connection: PooledMySQLConnection | MySQLConnectionAbstract, guild_id: int):
+@named_query
+async def get_guildSettings(guild_id: int) -> dict | None:
     logger.debug(f"Getting guild settings from the database: {guild_id}")
     query = "SELECT * FROM guilds WHERE server_id = %s"
-    result = select_query(connection, query, (guild_id,))
+    result = await get_storage().select("Servers", query, (guild_id,))
     if result:
         return result[0]
     logger.warning(f"No guild settings found in the database for guild {guild_id}")
     return None
 
 
-def set_guildSettings(connection: PooledMySQLConnection | MySQLConnectionAbstract, guild_id: int, owner_id: int, sancturary_keeper_role_id: int, sky_guardians_role_id: int, tech_oracle_role_id: int, event_luminary_role_id: int, assistaint_role_id: int, support_category_id: int, general_category_id: int, music_voice_id: int, bot_channel_id: int, music_channel_id: int, ticket_channel_id: int, ticket_log_channel_id: int):
+@named_query
+async def set_guildSettings(guild_id: int, owner_id: int, sancturary_keeper_role_id: int, sky_guardians_role_id: int, tech_oracle_role_id: int, event_luminary_role_id: int, assistaint_role_id: int, support_category_id: int, general_category_id: int, music_voice_id: int, bot_channel_id: int, music_channel_id: int, ticket_channel_id: int, ticket_log_channel_id: int) -> None:
     logger.info(f"Setting guild settings in the database: {guild_id}")
     query = "INSERT INTO guilds (server_id, owner_id, sancturary_keeper_role_id, sky_guardians_role_id, tech_oracle_role_id, event_luminary_role_id, assistaint_role_id, support_category_id, general_category_id, music_voice_id, bot_channel_id, music_channel_id, ticket_channel_id, ticket_log_channel_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
     values = (guild_id, owner_id, sancturary_keeper_role_id, sky_guardians_role_id, tech_oracle_role_id, event_luminary_role_id, assistaint_role_id, support_category_id, general_category_id, music_voice_id, bot_channel_id, music_channel_id, ticket_channel_id, ticket_log_channel_id)
-    insert_query(connection, query, values)
-    
+    await get_storage().insert("Servers", query, values)
+    guild_config.invalidate(guild_id)
+
 
+@named_query
+async def set_guildRoles(guild_id: int, owner_role_id: int, moderator_role_id: int, tech_role_id: int, event_organiser_role_id: int, member_role_id: int) -> None:
+    logger.info(f"Setting guild roles in the database: {guild_id}")
+    query = "INSERT INTO roles (guild_id, owner_role_id, moderator_role_id, tech_role_id, event_organiser_role_id, member_role_id) VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE owner_role_id = VALUES(owner_role_id), moderator_role_id = VALUES(moderator_role_id), tech_role_id = VALUES(tech_role_id), event_organiser_role_id = VALUES(event_organiser_role_id), member_role_id = VALUES(member_role_id)"
+    values = (guild_id, owner_role_id, moderator_role_id, tech_role_id, event_organiser_role_id, member_role_id)
+    await get_storage().insert("Servers", query, values)
 
-def save_ticket_to_db(connection: PooledMySQLConnection | MySQLConnectionAbstract, user_id: int, channel_id: int):
+
+@named_query
+async def save_ticket_to_db(user_id: int, channel_id: int) -> None:
     logger.info(f"Saving ticket to the database: {user_id}, {channel_id}")
-    query = "INSERT INTO open_tickets (user_id, channel_id) VALUES (%s, %s)"
-    values = (user_id, channel_id)
-    insert_query(connection, query, values)
+    await _write_insert("open_tickets", ("user_id", "channel_id"), (user_id, channel_id))
+    open_tickets.add(channel_id, user_id)
 
 
-def load_ticket_from_db(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int):
+@named_query
+async def load_ticket_from_db(channel_id: int) -> dict | None:
     logger.debug(f"Loading ticket from the database: {channel_id}")
+    if open_tickets.loaded:
+        user_id = open_tickets.get(channel_id)
+        if user_id is not None:
+            return {"user_id": user_id}
+    await _read_after_write("open_tickets")
     query = "SELECT user_id FROM open_tickets WHERE channel_id = %s"
-    result = select_query(connection, query, (channel_id,))
+    result = await get_storage().select("Server_data", query, (channel_id,))
     if result:
         return result[0]  # Return the first matching ticket record
     logger.warning(f"No ticket found in the database for channel {channel_id}")
     return None
 
 
-def delete_ticket_from_db(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int):
+@named_query
+async def delete_ticket_from_db(channel_id: int) -> None:
     logger.debug(f"Deleting ticket from the database: {channel_id}")
-    query = "DELETE FROM open_tickets WHERE channel_id = %s"
-    delete_query(connection, query, (channel_id,))
+    open_tickets.remove(channel_id)
+    await _write_delete("open_tickets", "channel_id", channel_id)
 
 
-def get_rule_channels(connection: PooledMySQLConnection | MySQLConnectionAbstract):
+@named_query
+async def get_rule_channels() -> list[dict] | None:
     logger.debug("Getting rule channels from the database.")
+    await _read_after_write("rule_channels")
     query = "SELECT * FROM rule_channels"
-    result = select_query(connection, query)
+    result = await get_storage().select("Server_data", query)
     if result:
         return result
     logger.info("No rule channels found in the database.")
     return None
 
-def get_rule_channel(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int):
+@named_query
+async def get_rule_channel(channel_id: int) -> list[dict] | None:
     logger.debug(f"Getting rule channel from the database: {channel_id}")
+    await _read_after_write("rule_channels")
     query = "SELECT * FROM rule_channels WHERE channel_id = %s"
-    result = select_query(connection, query, (channel_id,))
+    result = await get_storage().select("Server_data", query, (channel_id,))
     if result:
         return result
     logger.info(f"No rule channel found in the database for channel {channel_id}")
     return None
 
-def create_rule_channel(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int,  creator_id: int):
+@named_query
+async def create_rule_channel(channel_id: int,  creator_id: int) -> None:
     logger.info(f"Creating rule channel in the database: {channel_id}, {creator_id}")
-    query = "INSERT INTO rule_channels (channel_id, creator_id) VALUES (%s, %s)"
-    values = (channel_id, creator_id)
-    insert_query(connection, query, values)
+    await _write_insert("rule_channels", ("channel_id", "creator_id"), (channel_id, creator_id))
+    rule_gates.add_channel(channel_id)
 
-def remove_rule_channel(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int):
+@named_query
+async def remove_rule_channel(channel_id: int) -> None:
     logger.info(f"Removing rule channel from the database: {channel_id}")
-    query = "DELETE FROM rule_channels WHERE channel_id = %s"
-    delete_query(connection, query, (channel_id,))
-    query = "DELETE FROM rules_accepted WHERE channel_id = %s"
-    delete_query(connection, query, (channel_id,))
-
-def set_accepted_rules(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int, user_id: int):
+    rule_gates.remove_channel(channel_id)
+    await _write_delete("rule_channels", "channel_id", channel_id)
+    await _write_delete("rules_accepted", "channel_id", channel_id)
+
+@named_query
+async def set_accepted_rules(channel_id: int, user_id: int) -> bool:
+    """Save that a user accepted the rules of a channel.
+
+    Returns:
+        bool: False when the user had already accepted the rules, in that case nothing is written
+
+    Raises:
+        StorageError: when the acceptance could not be saved, the user is not marked as accepted then
+    """
+    # the user goes in the index before the write, so a double click doesn't write twice
+    added = rule_gates.loaded and rule_gates.add_member(channel_id, user_id)
+    if rule_gates.loaded and not added:
+        logger.debug(f"Rules were already accepted: {channel_id}, {user_id}")
+        return False
     logger.info(f"Setting accepted rules in the database: {channel_id}, {user_id}")
-    query = "INSERT INTO rules_accepted (channel_id, user_id) VALUES (%s, %s)"
-    values = (channel_id, user_id)
-    insert_query(connection, query, values)
-
-def get_accepted_rules(connection: PooledMySQLConnection | MySQLConnectionAbstract, channel_id: int):
+    try:
+        # when the write-behind queue gives up on the row, the index has to forget the user as well
+        written = await _write_insert("rules_accepted", ("channel_id", "user_id"), (channel_id, user_id), ignore=True,
+                                      on_dropped=lambda: rule_gates.remove_member(channel_id, user_id))
+    except BaseException:
+        if added:
+            rule_gates.remove_member(channel_id, user_id)  # so the user can click accept again
+        raise
+    if not written:
+        if added:
+            rule_gates.remove_member(channel_id, user_id)
+        raise StorageError(f"Could not save that user {user_id} accepted the rules of channel {channel_id}")
+    return True
+
+@named_query
+async def get_accepted_rules(channel_id: int) -> list[dict] | None:
     logger.debug(f"Getting accepted rules from the database: {channel_id}")
+    await _read_after_write("rules_accepted")
     query = "SELECT * FROM rules_accepted WHERE channel_id = %s"
-    result = select_query(connection, query, (channel_id,))
+    result = await get_storage().select("Server_data", query, (channel_id,))
     if result:
         return result
     logger.info(f"No accepted rules found in the database for channel {channel_id}")
     return None
 
+@named_query
+async def load_rule_gates() -> None:
+    """Fill the in memory rule gate index with two queries, this only happens once."""
+    async with rule_gates.lock:
+        if rule_gates.loaded:
+            return
+        logger.debug("Loading the rule gates from the database.")
+        await _read_after_write("rule_channels")
+        await _read_after_write("rules_accepted")
+        try:
+            rule_channels = await get_storage().select("Server_data", "SELECT channel_id FROM rule_channels")
+            accepted_rules = await get_storage().select("Server_data", "SELECT channel_id, user_id FROM rules_accepted")
+        except DatabaseUnavailable as e:
+            logger.error(f"The error '{e}' occurred")
+            rule_channels = accepted_rules = None
+        if rule_channels is None or accepted_rules is None:
+            logger.error("Failed to load the rule gates from the database.")
+            return
+        rule_gates.load(rule_channels, accepted_rules)
+
+@named_query
+async def load_open_tickets() -> None:
+    """Fill the in memory open ticket index with one query, this only happens once."""
+    async with open_tickets.lock:
+        if open_tickets.loaded:
+            return
+        logger.debug("Loading the open tickets from the database.")
+        await _read_after_write("open_tickets")
+        try:
+            result = await get_storage().select("Server_data", "SELECT channel_id, user_id FROM open_tickets")
+        except DatabaseUnavailable as e:
+            logger.error(f"The error '{e}' occurred")
+            result = None
+        if result is None:
+            logger.error("Failed to load the open tickets from the database.")
+            return
+        open_tickets.load(result)
+
 
 # Function to get the video URLs from a playlist
 def get_video_urls_from_playlist(playlist_url):
@@ -334,28 +341,41 @@ def get_video_urls_from_playlist(playlist_url):
             return []
 
 
-# Main function
-def get_video_urls(url: str) -> list|str:
-    logger.debug(f"Getting video URLs from the URL: {url}")
+# Function to tell what kind of YouTube URL was given: "playlist", "radio", "video" or None
+def url_kind(url: str) -> str | None:
     playlist_pattern = r'(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=[\w-]+'
     radio_pattern = r"^https?:\/\/(www\.)?youtube\.com\/.*[?&]list=(RD|RDEM)[^&]+.*"
     video_pattern = r'(?:https?://)?(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/)[\w-]+'
 
     if re.match(playlist_pattern, url):
+        return "playlist"
+    elif re.match(radio_pattern, url):
+        logger.debug("The provided URL is a radio URL.")
+        return "radio"
+    elif re.match(video_pattern, url):
+        logger.debug("The provided URL is a video URL.")
+        return "video"
+    logger.debug("The provided URL is not a valid YouTube URL.")
+    return None
+
+
+# Main function, blocks while a playlist is read. The music player streams playlists with playlistStream instead
+def get_video_urls(url: str) -> list|str:
+    logger.debug(f"Getting video URLs from the URL: {url}")
+    kind = url_kind(url)
+
+    if kind == "playlist":
         video_urls, _ = get_video_urls_from_playlist(url)
         if not video_urls:
             logger.warning("No video URLs found in the playlist.")
             return []
         return video_urls
 
-    elif re.match(radio_pattern, url):
-        logger.debug("The provided URL is a radio URL.")
+    elif kind == "radio":
         return "radio"
 
-    elif re.match(video_pattern, url):
-        logger.debug("The provided URL is a video URL.")
+    elif kind == "video":
         return [url]
 
     else:
-        logger.debug("The provided URL is not a valid YouTube URL.")
         return []
\ No newline at end of file
@@ -0,0 +1,169 @@
+# python imports
+from dataclasses import dataclass, fields
+from dotenv import load_dotenv
+import asyncio
+import time
+import os
+
+# local imports
+from storage import get_storage, StorageError
+from queryStats import named_query
+from logger import logger
+
+load_dotenv()
+GUILD_CONFIG_TTL: float = float(os.getenv("GUILD_CONFIG_TTL", 300))  # seconds before a guild gets refreshed in the background
+
+
+@dataclass(slots=True, frozen=True)
+class GuildSettings:
+    """The settings of one guild, as stored in the `guilds` table."""
+    server_id: int
+    owner_id: int
+    sancturary_keeper_role_id: int
+    sky_guardians_role_id: int
+    tech_oracle_role_id: int
+    event_luminary_role_id: int
+    assistaint_role_id: int
+    support_category_id: int
+    general_category_id: int
+    music_voice_id: int
+    bot_channel_id: int
+    music_channel_id: int
+    ticket_channel_id: int
+    ticket_log_channel_id: int
+
+    @classmethod
+    def from_row(cls, row: dict) -> "GuildSettings":
+        return cls(**{field.name: row[field.name] for field in fields(cls)})
+
+
+class GuildConfig(object):
+    _instance: "GuildConfig | None" = None
+    query_all = "SELECT * FROM guilds"
+    query_one = "SELECT * FROM guilds WHERE server_id = %s"
+
+    def __new__(cls, *args, **kwargs) -> "GuildConfig":
+        # there is only one registry per process, every module shares the same settings
+        if cls._instance is None:
+            cls._instance = super(GuildConfig, cls).__new__(cls)
+            cls._instance._setup(*args, **kwargs)
+        return cls._instance
+
+    def _setup(self, ttl: float = GUILD_CONFIG_TTL) -> None:
+        self.ttl = ttl
+        self._settings: dict[int, GuildSettings] = {}
+        self._loaded_at: dict[int, float] = {}
+        self._refreshing: dict[int, asyncio.Task] = {}
+        self._loaded = False
+        self._load_lock: asyncio.Lock | None = None
+        self._loading: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _store(self, rows: list[dict]) -> None:
+        now = time.monotonic()
+        for row in rows:
+            settings = GuildSettings.from_row(row)
+            self._settings[settings.server_id] = settings
+            self._loaded_at[settings.server_id] = now
+
+    @named_query
+    async def load(self) -> None:
+        """Load every guild once, calling this again after the first load does nothing."""
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self._loaded:
+                return
+            logger.debug("Loading the guild settings from the database.")
+            try:
+                rows = await get_storage().select("Servers", self.query_all)
+            except StorageError as e:
+                logger.error(f"The error '{e}' occurred while loading the guild settings")
+                return
+            if not rows:
+                logger.error("No guild settings found in the database.")
+                return
+            self._store(rows)
+            self._loaded = True
+            logger.info(f"Loaded the settings of {len(self._settings)} guild(s).")
+
+    def _schedule_load(self) -> None:
+        # a lookup before `load` succeeded never waits on the database, it misses and the load runs in the background
+        if self._loading is not None and not self._loading.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop yet, the next lookup inside the loop will try again
+        logger.warning("The guild settings were requested before they were loaded, loading them in the background.")
+        self._loading = loop.create_task(self.load())
+
+    @named_query
+    async def refresh(self, guild_id: int) -> GuildSettings | None:
+        """Reload the settings of a single guild from the database."""
+        self.refreshes += 1
+        try:
+            rows = await get_storage().select("Servers", self.query_one, (guild_id,))
+        except StorageError as e:
+            logger.warning(f"The error '{e}' occurred while refreshing guild {guild_id}, keeping the old settings")
+            rows = None
+        if rows is None:
+            # the query failed, keep the old settings for now
+            return self._settings.get(guild_id)
+        if not rows:
+            logger.warning(f"No guild settings found in the database for guild {guild_id}")
+            self._settings.pop(guild_id, None)
+            self._loaded_at.pop(guild_id, None)
+            return None
+        self._store(rows)
+        logger.debug(f"Refreshed the settings of guild {guild_id}")
+        return self._settings[guild_id]
+
+    def _schedule_refresh(self, guild_id: int) -> None:
+        if guild_id in self._refreshing:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop yet, the next lookup inside the loop will try again
+        task = loop.create_task(self.refresh(guild_id))
+        self._refreshing[guild_id] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(guild_id, None))
+
+    def invalidate(self, guild_id: int) -> None:
+        """Mark a guild as stale, it will be reloaded in the background."""
+        self._loaded_at[guild_id] = float("-inf")
+        self._schedule_refresh(guild_id)
+
+    def get(self, guild_id: int) -> GuildSettings | None:
+        if not self._loaded:
+            self._schedule_load()
+        settings = self._settings.get(guild_id)
+        if settings is None:
+            self.misses += 1
+            self._schedule_refresh(guild_id)  # the guild might have been added since the last load
+            return None
+        self.hits += 1
+        if time.monotonic() - self._loaded_at[guild_id] > self.ttl:
+            self._schedule_refresh(guild_id)  # serve the current settings while the new ones load
+        return settings
+
+    def __getitem__(self, guild_id: int) -> GuildSettings:
+        settings = self.get(guild_id)
+        if settings is None:
+            raise KeyError(guild_id)
+        return settings
+
+    def __contains__(self, guild_id: int) -> bool:
+        return self.get(guild_id) is not None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"guilds": len(self._settings), "hits": self.hits, "misses": self.misses, "refreshes": self.refreshes}
+
+
+guild_config = GuildConfig()
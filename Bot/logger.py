@@ -26,6 +26,7 @@ class Logger(object):
         lg.add("/dreamy-data/logs/debug.log", level="DEBUG", format=log_format, retention="4 days")
         lg.add("/dreamy-data/logs/info.log", level="INFO", format=log_format, retention="7 days")
         lg.add("/dreamy-data/logs/error.log", level="ERROR", format=log_format, retention="14 days")
+        lg.add("/dreamy-data/logs/slow_queries.log", level="WARNING", format=log_format, retention="14 days", filter=lambda record: record["extra"].get("slow_query", False))
         lg.level("PRINT", no=9999, color="<green><b>")
 
 
@@ -131,6 +132,15 @@ class Logger(object):
         """
         self.log("CRITICAL", message, extra, depth=2)
         
+    def slow_query(self, message: str, extra: dict[str: any] = None) -> None:
+        """The function to log slow database queries, they also end up in slow_queries.log.
+
+        Args:
+            message (str): The message to log
+            extra (dict, optional): Optional extra dict with whatever contect in needed.
+        """
+        lg.bind(slow_query=True, **(extra or {})).opt(depth=1).warning(message)
+
     def print(self, message: str, extra: dict[str: any] = None) -> None:
         """The function to log print messages.
 
@@ -16,12 +16,26 @@ import json
 
 
 # local imports
-from functions import load_ids, save_transcript, get_rule_channels, create_connection, close_connection
+from functions import handle_interaction_error
+from closeJobs import close_jobs, CloseJob
+from archiveStore import archive_store
+from extractCache import extract_cache
+from extractPool import extract_pool
+from warmup import warm_up
+from storage import get_storage
+from database import pools
+from queryStats import query_recorder
+from writeBehind import write_behind
+from guildConfig import guild_config
+from ticketCapture import ticket_capture
 from ticketMenu import PersistentTicketView, PersistentCloseTicketView
-from musicMenu import PersistentMusicView
+from musicMenu import PersistentMusicView, track_resolver
 from cogs.RunManager import RunManager
-from cogs.AccessManager import AccessManager, PersistentAcceptRulesView
+from cogs.AccessManager import AccessManager
+from cogs.TicketSearch import TicketSearch
+from transcriptSearch import transcript_index, TRANSCRIPT_SEARCH
 from logger import logger
+from cogs.utils.SafeView import SafeView
 
 
 # Load the environment variables
@@ -29,9 +43,7 @@ load_dotenv()
 TOKEN: Final[str] = os.getenv("DISCORD_TOKEN")
 TESTING: Final[str] = os.getenv("TESTING")
 bot_prefix: Final[str] = os.getenv("PREFIX")
-
-# Load the IDs from the database
-ids = load_ids()
+MIGRATE_ON_STARTUP: Final[str] = os.getenv("DATABASE_MIGRATE_ON_STARTUP", "True")
 
 # team settings
 max_teams: int = 4
@@ -47,7 +59,15 @@ reaction_tracker: dict = {}
 intents: discord.Intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-client = commands.Bot(command_prefix="!", intents=intents)
+class DreamyBot(commands.Bot):
+    async def close(self) -> None:
+        # write everything that is still queued before the connection pools go away
+        await write_behind.close()
+        await extract_cache.save()  # maintain() only saves every few minutes
+        await super().close()
+
+client = DreamyBot(command_prefix="!", intents=intents)
+ticket_capture.listen(client)
 
 
 # load the command whitelist
@@ -59,23 +79,41 @@ with open(f"{dir}/whitelist.json", "r") as file:
 # Startup of the bot
 @client.event
 async def on_ready() -> None:    
+    # Load the guild settings, rule gates and open tickets and register the accept buttons of the rule channels
+    client.warmup_timings = await warm_up(client)
+    
     client.add_view(PersistentTicketView(client))
     client.add_view(PersistentCloseTicketView(client))
     client.add_view(PersistentMusicView(client))
     
-    connection = create_connection("Server_data")
-    rule_channels = get_rule_channels(connection)
-    if rule_channels:
-        for rule_channel in rule_channels:
-            channel = await client.fetch_channel(rule_channel["channel_id"])
-            client.add_view(PersistentAcceptRulesView(client, channel))
-    else:
-        logger.debug("No rule channels found in the database.")
-    close_connection(connection)
+    # Finish closing the tickets that were being closed when the bot stopped
+    await close_jobs.start(client)
+    
+    # Capture what was posted in the open tickets while the bot was offline
+    if not hasattr(client, "capture_reconcile"):
+        client.capture_reconcile = client.loop.create_task(ticket_capture.reconcile(client))
+    
+    # Keep the database connections healthy in the background
+    if not hasattr(client, "pool_maintenance"):
+        client.pool_maintenance = client.loop.create_task(get_storage().maintain())
+    
+    # Compress and clean up the ticket archive in the background
+    if not hasattr(client, "archive_maintenance"):
+        client.archive_maintenance = client.loop.create_task(archive_store.maintain())
+    
+    # Load the songs yt_dlp extracted before the restart and save the new ones now and then
+    if not hasattr(client, "music_cache_maintenance"):
+        client.music_cache_maintenance = client.loop.create_task(extract_cache.maintain())
+    
+    # Add the transcripts that are not in the ticket search yet
+    if TRANSCRIPT_SEARCH and not hasattr(client, "transcript_backfill"):
+        client.transcript_backfill = client.loop.create_task(transcript_index.backfill())
     
     # Load the cogs
     await client.add_cog(RunManager(client))
     await client.add_cog(AccessManager(client))
+    if TRANSCRIPT_SEARCH:
+        await client.add_cog(TicketSearch(client))
     
     # Set Rich Presence (Streaming)
     if TESTING == "True":
@@ -119,7 +157,7 @@ async def ping(interaction: discord.Interaction) -> None:
 async def ticket(interaction: discord.Interaction) -> None:
     logger.command(interaction)
     await interaction.response.defer()
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("```ansi\n[2;31mYou do not have permission to create a ticket menu.```", ephemeral=True)
         return
@@ -132,26 +170,26 @@ async def ticket(interaction: discord.Interaction) -> None:
 async def force_close_ticket(interaction: discord.Interaction) -> None:
     logger.command(interaction)
     logger.warning(f"User {interaction.user.name} requested to force close a ticket.")
-    sky_guardians_role = interaction.guild.get_role(ids[interaction.guild.id]["sky_guardians_role_id"])
+    sky_guardians_role = interaction.guild.get_role(guild_config[interaction.guild.id].sky_guardians_role_id)
     if not sky_guardians_role:
         logger.error("Sky Guardians role not found. Please provide a valid role ID.")
         await interaction.followup.send("```ansi\n[2;31mSky Guardians role not found. Please provide a valid role ID.```", ephemeral=True)
         return
     
-    tech_oracle_role = interaction.guild.get_role(ids[interaction.guild.id]["tech_oracle_role_id"])
+    tech_oracle_role = interaction.guild.get_role(guild_config[interaction.guild.id].tech_oracle_role_id)
     if not tech_oracle_role:
         logger.error("Tech Oracle role not found. Please provide a valid role ID.")
         await interaction.followup.send("```ansi\n[2;31mTech Oracle role not found. Please provide a valid role ID.```", ephemeral=True)
         return
     
-    if interaction.user.id != ids[interaction.guild.id]["owner_id"] or sky_guardians_role in interaction.user.roles or tech_oracle_role in interaction.user.roles:
+    if interaction.user.id != guild_config[interaction.guild.id].owner_id or sky_guardians_role in interaction.user.roles or tech_oracle_role in interaction.user.roles:
         select = Select(options=[
             discord.SelectOption(label="Yes, close this ticket", value="01", emoji="☑️", description="This closes the ticket and will mark it as solved"),
             discord.SelectOption(label="No, keep this ticket open", value="02", emoji="✖️", description="This will keep the ticket open and allow you to continue the conversation"),
         ])
         
         select.callback = ticket_select_callback
-        view = View(timeout=60)
+        view = SafeView(timeout=60)
         view.add_item(select)
         await interaction.response.send_message("Do you really want to close the ticket?", view=view, ephemeral=True, delete_after=60)
     
@@ -165,20 +203,19 @@ async def ticket_select_callback(interaction: discord.Interaction):
     await interaction.response.defer()
     if interaction.data["values"][0] == "01": # Yes, close this ticket
         logger.warning(f"User {interaction.user.name} requested to force close a ticket.", extra={"command": "force_close_ticket", "sub_command": "close_select_callback", "user_id": interaction.user.id, "username": interaction.user.name, "display_name": interaction.user.display_name})
+        job = CloseJob(
+            channel_id=interaction.channel.id,
+            guild_id=interaction.guild.id,
+            channel_name=interaction.channel.name,
+            header=f"Transcript for {interaction.channel.name}:\nThe ticket channel {interaction.channel.name} has been **force** closed by {interaction.user.name} a.k.a {interaction.user.display_name}",
+            notify_id=interaction.user.id,
+            force=True,
+        )
+        if not await close_jobs.submit(job):
+            await interaction.followup.send("This ticket is already being closed.")
+            return
         await interaction.followup.send("Ticket will be force closed.")
-
-        ticket_logs = ""
-        path = await save_transcript(interaction.channel, ticket_logs)
-
-        ticket_logs_channel = client.get_channel(ids[interaction.guild.id]["ticket_log_channel_id"])
-        if ticket_logs_channel:
-            await ticket_logs_channel.send(f"Transcript for {interaction.channel.name}:\nThe ticket channel {interaction.channel.name} has been **force** closed by {interaction.user.name} a.k.a {interaction.user.display_name}", file=discord.File(path))
-        else:
-            logger.error("Ticket logs channel not found. Please provide a valid channel ID.")
         logger.info(f"Ticket {interaction.channel.name} has been force closed by {interaction.user.name} a.k.a {interaction.user.display_name}")
-        await interaction.channel.delete()
-        await interaction.user.send("Your ticket has been closed successfully. The Transcript of the ticket has been saved.")
-        await interaction.user.send(f"Transcript for {interaction.channel.name}:", file=discord.File(path))
     elif interaction.data["values"][0] == "02": # No, keep this ticket open
         await interaction.followup.send("This ticket will remain open.", ephemeral=True)
     
@@ -200,7 +237,7 @@ async def timers(interaction: discord.Interaction) -> None:
 async def createteam(interaction: discord.Interaction, member: discord.Member, emoji: str, max_size: int = 8) -> None:
     logger.command(interaction)
     await interaction.response.defer(ephemeral=True)  # Defer the response to get more time
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("You do not have permission to create a team.", ephemeral=True)
         return
@@ -255,7 +292,7 @@ async def createteam(interaction: discord.Interaction, member: discord.Member, e
 async def closeteam(interaction: discord.Interaction, member: discord.Member) -> None:
     logger.command(interaction)
     await interaction.response.defer(ephemeral=True)  # Defer the response to get more time
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("You do not have permission to close a team.", ephemeral=True)
         return
@@ -289,7 +326,7 @@ async def force_close_team(interaction: discord.Interaction, member: discord.Mem
     logger.command(interaction)
     logger.warning(f"User {interaction.user.name} requested to force close a team.")
     await interaction.response.defer(ephemeral=True)  # Defer the response to get more time
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("You do not have permission to force close a team.", ephemeral=True)
         return
@@ -312,7 +349,7 @@ async def force_close_team(interaction: discord.Interaction, member: discord.Mem
 async def lockteam(interaction: discord.Interaction, member: discord.Member) -> None:
     logger.command(interaction)
     await interaction.response.defer(ephemeral=True)  # Defer the response to get more time
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("You do not have permission to lock a team.", ephemeral=True)
         return
@@ -350,7 +387,7 @@ async def lockteam(interaction: discord.Interaction, member: discord.Member) ->
 async def unlockteam(interaction: discord.Interaction, member: discord.Member) -> None:
     logger.command(interaction)
     await interaction.response.defer(ephemeral=True)  # Defer the response to get more time
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["event_luminary_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].event_luminary_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("You do not have permission to unlock a team.", ephemeral=True)
         return
@@ -426,7 +463,7 @@ async def unlockteam(interaction: discord.Interaction, member: discord.Member) -
 async def music_menu(interaction: discord.Interaction) -> None:
     logger.command(interaction)
     await interaction.response.defer()
-    allowed_roles: list[int] = [ids[interaction.guild.id]["sancturary_keeper_role_id"], ids[interaction.guild.id]["sky_guardians_role_id"], ids[interaction.guild.id]["tech_oracle_role_id"], ids[interaction.guild.id]["event_luminary_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].sancturary_keeper_role_id, guild_config[interaction.guild.id].sky_guardians_role_id, guild_config[interaction.guild.id].tech_oracle_role_id, guild_config[interaction.guild.id].event_luminary_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("```ansi\n[2;31mYou do not have permission to create a music menu.```")
         return
@@ -443,6 +480,8 @@ async def music_menu(interaction: discord.Interaction) -> None:
     embed.add_field(name="<:Queue:1306675077798039705> Queue", value="Add a new song or playlist to the queue via a YouTube URL.", inline=False)
     embed.add_field(name="<:Clear_Queue:1306675068931149915> Clear Queue", value="Remove all songs from the queue.", inline=False)
     embed.add_field(name="<:Close:1306675070848204820> Stop", value="Stop the music, clear the queue, and disconnect the bot from the music channel", inline=False)
+    embed.add_field(name="🔁 Loop", value="Loop the whole queue, the current song, or stop looping.", inline=False)
+    embed.add_field(name="🔀 Shuffle", value="Shuffle the songs in the queue.", inline=False)
 
     embed.set_footer(text="Enjoy your tunes! 🎶")
     
@@ -453,7 +492,7 @@ async def music_menu(interaction: discord.Interaction) -> None:
 async def takeover(interaction: discord.Interaction, channel: discord.TextChannel) -> None:
     logger.command(interaction)
     await interaction.response.defer(ephemeral=True)
-    allowed_roles: list[int] = [ids[interaction.guild.id]["tech_oracle_role_id"]]
+    allowed_roles: list[int] = [guild_config[interaction.guild.id].tech_oracle_role_id]
     if not any(role.id in allowed_roles for role in interaction.user.roles):
         await interaction.followup.send("You do not have permission to use this command.", ephemeral=True)
         return
@@ -475,6 +514,33 @@ async def takeover(interaction: discord.Interaction, channel: discord.TextChanne
     await channel.set_permissions(interaction.user, overwrite=overwite) # Give the Tech Oracle role full permissions
     await interaction.followup.send(f"Tech Oracle has taken over {channel.mention}.", ephemeral=True)
 
+
+@client.tree.command(name="db_stats", description="Show the latency of the database queries.")
+async def db_stats(interaction: discord.Interaction) -> None:
+    logger.command(interaction)
+    if interaction.user.id != guild_config[interaction.guild.id].owner_id:
+        await interaction.response.send_message("Only the owner of the server can use this command.", ephemeral=True)
+        return
+
+    lines = query_recorder.summary() or ["No queries recorded yet."]
+    lines.append("")
+    for name, pool in pools.items():
+        lines.append(f"pool {name}: {pool.stats}")
+    lines.append(f"write-behind: {write_behind.stats}")
+    lines.append(f"close jobs: {close_jobs.stats}")
+    lines.append(f"ticket archive: {archive_store.stats}")
+    lines.append(f"music track switches: {track_resolver.stats}")
+    lines.append(f"music cache: {extract_cache.stats}")
+    lines.append(f"music extraction: {extract_pool.stats}")
+    lines.append(f"guild config: {guild_config.stats}")
+    lines.append(f"database health: {get_storage().health}")
+    if hasattr(client, "warmup_timings"):
+        lines.append("warm-up: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in client.warmup_timings.items()))
+    report = "\n".join(lines)
+    if len(report) > 1900:
+        report = report[:1900] + "\n..."
+    await interaction.response.send_message(f"```\n{report}\n```", ephemeral=True)
+
 # Reaction handling for team creation
 @client.event
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent) -> None:
@@ -631,6 +697,14 @@ async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent) -> Non
                 logger.error(f"An error occurred while updating the message: {e}")
 
 
+# Error handling for the slash commands, answers the user instead of leaving the interaction hanging
+@client.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:
+    if isinstance(error, app_commands.CheckFailure):
+        return  # the check already answered the user
+    await handle_interaction_error(interaction, error)
+
+
 # Error handling for command not found
 @client.event
 async def on_command_error(ctx: commands.Context, error):
@@ -650,7 +724,12 @@ async def on_command_error(ctx: commands.Context, error):
 
 
 def main() -> None:
-    client.run(TOKEN)
+    if MIGRATE_ON_STARTUP == "True":
+        get_storage().migrate()  # bring the database schema up to date before anything reads from it
+    try:
+        client.run(TOKEN)
+    finally:
+        get_storage().close()
 
 
 if __name__ == "__main__":
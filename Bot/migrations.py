@@ -0,0 +1,221 @@
+# python imports
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import argparse
+import sqlite3
+import os
+import re
+
+# 3rd party imports
+from mysql.connector import Error
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+# local imports
+from database import connect
+from logger import logger
+
+load_dotenv()
+MIGRATIONS_DIR: str = os.getenv("DATABASE_MIGRATIONS_DIR", "/dreamy-data/SQL/migrations")
+DATABASES: tuple[str, ...] = ("Servers", "Server_data")
+LOCK_TIMEOUT: int = 30  # seconds to wait when another instance is running the migrations
+
+# the queries of the helpers in functions.py that run the most, the dry run shows how MySQL executes them
+HOT_QUERIES: list[tuple[str, str, str]] = [
+    ("Servers", "get_guildSettings", "SELECT * FROM guilds WHERE server_id = %s"),
+    ("Server_data", "load_ticket_from_db", "SELECT user_id FROM open_tickets WHERE channel_id = %s"),
+    ("Server_data", "delete_ticket_from_db", "DELETE FROM open_tickets WHERE channel_id = %s"),
+    ("Server_data", "get_rule_channel", "SELECT * FROM rule_channels WHERE channel_id = %s"),
+    ("Server_data", "get_accepted_rules", "SELECT * FROM rules_accepted WHERE channel_id = %s"),
+    ("Server_data", "remove_rule_channel", "DELETE FROM rules_accepted WHERE channel_id = %s"),
+]
+
+# <version>_<name>.sql runs on MySQL, <version>_<name>.sqlite.sql is the same migration for the SQLite backend
+_file_pattern = re.compile(r"^(\d+)_(\w+?)(\.sqlite)?\.sql$")
+# MySQL has no IF NOT EXISTS for indexes, these statements are skipped when the index is there already
+_add_index_pattern = re.compile(r"^ALTER\s+TABLE\s+`?(\w+)`?\s+ADD\s+(?:UNIQUE\s+)?INDEX\s+`?(\w+)`?", re.IGNORECASE)
+
+
+@dataclass(slots=True, frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: str
+
+    def statements(self) -> list[str]:
+        """Split the migration file into its statements, lines starting with `--` are comments."""
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if not line.lstrip().startswith("--")]
+        return [statement.strip() for statement in "".join(lines).split(";") if statement.strip()]
+
+
+def discover(database_name: str, dialect: str = "mysql") -> list[Migration]:
+    """Find the migrations of a database for the given dialect, they are sorted by their version number."""
+    path = os.path.join(MIGRATIONS_DIR, database_name)
+    if not os.path.isdir(path):
+        logger.warning(f"No migrations found for {database_name} in {path}")
+        return []
+    migrations = []
+    for filename in os.listdir(path):
+        match = _file_pattern.match(filename)
+        if match and (match.group(3) is not None) == (dialect == "sqlite"):
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(path, filename)))
+    migrations.sort(key=lambda migration: migration.version)
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions found for {database_name}: {versions}")
+    return migrations
+
+
+def ensure_database(database_name: str) -> None:
+    connection = connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database_name}`")  # names come from DATABASES, not from users
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def applied_versions(connection: MySQLConnectionAbstract, create: bool = True) -> set[int]:
+    """Get the versions that are recorded in the schema_migrations table, the table is created when `create` is set."""
+    cursor = connection.cursor()
+    try:
+        if create:
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, name VARCHAR(255) NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+        else:
+            cursor.execute("SHOW TABLES LIKE 'schema_migrations'")
+            if not cursor.fetchall():
+                return set()
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def index_exists(cursor, database_name: str, table: str, index: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics WHERE table_schema = %s AND table_name = %s AND index_name = %s LIMIT 1",
+        (database_name, table, index),
+    )
+    return bool(cursor.fetchall())
+
+
+def migrate(database_name: str, dry_run: bool = False) -> list[Migration]:
+    """Apply the pending migrations of one database.
+
+    Args:
+        database_name (str): The database to migrate
+        dry_run (bool, optional): Only report the pending migrations without applying them.
+
+    Returns:
+        list[Migration]: The migrations that were (or in a dry run, would be) applied
+    """
+    if not dry_run:
+        ensure_database(database_name)
+    connection = connect(database_name)
+    cursor = connection.cursor()
+    try:
+        # make sure two bot instances never run the same migration at once
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (f"dreamy_migrations_{database_name}", LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise Error(msg=f"Could not get the migration lock for {database_name}")
+        applied = applied_versions(connection, create=not dry_run)
+        pending = [migration for migration in discover(database_name) if migration.version not in applied]
+        for migration in pending:
+            if dry_run:
+                logger.info(f"Pending migration for {database_name}: {migration.version:03d}_{migration.name}")
+                continue
+            logger.info(f"Applying migration {migration.version:03d}_{migration.name} to {database_name}")
+            # MySQL commits DDL statements right away, so the version is only recorded once every statement succeeded
+            # a migration that failed halfway is run again from the top, so the indexes it added already are skipped
+            for statement in migration.statements():
+                match = _add_index_pattern.match(statement)
+                if match and index_exists(cursor, database_name, match.group(1), match.group(2)):
+                    logger.info(f"Skipping the index {match.group(2)} on {match.group(1)}, it exists already")
+                    continue
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (migration.version, migration.name))
+            connection.commit()
+        if not pending:
+            logger.debug(f"The database {database_name} is up to date.")
+        return pending
+    finally:
+        # the lock goes away with the connection anyway, a failing release must not hide why the migration failed
+        try:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (f"dreamy_migrations_{database_name}",))
+            cursor.fetchall()
+        except Error as e:
+            logger.warning(f"Releasing the migration lock of {database_name} failed: {e}")
+        finally:
+            cursor.close()
+            connection.close()
+
+
+def migrate_sqlite(connection: sqlite3.Connection, database_name: str) -> list[Migration]:
+    """Apply the pending SQLite migrations of one database, every migration runs in its own transaction."""
+    connection.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    applied = {row[0] for row in connection.execute("SELECT version FROM schema_migrations")}
+    pending = [migration for migration in discover(database_name, dialect="sqlite") if migration.version not in applied]
+    for migration in pending:
+        logger.info(f"Applying migration {migration.version:03d}_{migration.name} to the SQLite database {database_name}")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in migration.statements():
+                connection.execute(statement)
+            connection.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (migration.version, migration.name))
+            connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            connection.execute("ROLLBACK")
+            logger.critical(f"Migrating the SQLite database {database_name} failed: {e}")
+            raise
+    return pending
+
+
+def apply_migrations(dry_run: bool = False) -> None:
+    """Bring every database up to date, this runs on startup before the bot connects."""
+    for database_name in DATABASES:
+        try:
+            migrate(database_name, dry_run=dry_run)
+        except (Error, OSError, ValueError) as e:
+            logger.critical(f"Migrating {database_name} failed: {e}")
+            raise
+
+
+def explain_queries() -> list[tuple[str, list[dict]]]:
+    """Run EXPLAIN on the hot helper queries and return the plans."""
+    plans = []
+    for database_name, name, query in HOT_QUERIES:
+        connection = connect(database_name)
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute(f"EXPLAIN {query}", (0,) * query.count("%s"))
+            plans.append((name, cursor.fetchall()))
+            cursor.close()
+        finally:
+            connection.close()
+    return plans
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply the database migrations of the bot.")
+    parser.add_argument("--dry-run", action="store_true", help="show the pending migrations and the query plans of the helper queries without changing anything")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        apply_migrations()
+        return
+
+    for database_name in DATABASES:
+        pending = migrate(database_name, dry_run=True)
+        print(f"{database_name}: {len(pending)} pending migration(s)")
+        for migration in pending:
+            print(f"    {migration.version:03d}_{migration.name}")
+    print()
+    for name, plan in explain_queries():
+        print(f"{name}:")
+        for row in plan:
+            print(f"    table={row.get('table')} type={row.get('type')} key={row.get('key')} rows={row.get('rows')} extra={row.get('Extra')}")
+
+
+if __name__ == "__main__":
+    main()
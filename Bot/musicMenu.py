@@ -8,12 +8,19 @@ from discord.ext import commands
 import typing
 import asyncio
 import traceback
+import time
 from dotenv import load_dotenv
 import os
 
 # local imports
 from cogs.utils.BaseModal import BaseModal
-from functions import load_ids, get_video_urls
+from functions import url_kind
+from guildConfig import guild_config
+from trackResolver import TrackResolver
+from musicQueue import MusicQueue, LOOP_OFF, LOOP_ALL, LOOP_ONE, MUSIC_MAX_FAILURES
+from extractCache import extract_cache
+from extractPool import extract_pool
+from playlistStream import stream_video_urls, PROGRESS_INTERVAL
 from logger import logger
 
 # 3rd party imports
@@ -24,10 +31,9 @@ load_dotenv()
 
 
 voice_clients: dict[int, discord.VoiceChannel] = {}
-queues: dict[int, dict[str, str]] = {}
+queues: dict[int, MusicQueue] = {}
 
 
-ids = load_ids()
 
 # music settings
 yt_dlp_options: dict[str, str] = {"username": "oauth2 ", "password ": '', "format": "bestaudio/best", 'noplaylist': False, "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "192"}]}
@@ -40,6 +46,18 @@ youtube_watch_url: str = youtube_base_url + 'watch?v='
 ytdl: yt_dlp.YoutubeDL = yt_dlp.YoutubeDL(yt_dlp_options)
 
 
+def extract_song(url: str) -> dict:
+    """The info of a song from the cache, or from yt_dlp when its stream URL isn't cached or expired. Blocks, run it in an executor."""
+    data = extract_cache.get(url)
+    if data is None:
+        data = extract_cache.put(url, ytdl.extract_info(url, download=False))
+    return data
+
+
+# resolves the next songs of the queue while the current one plays, so the switch doesn't wait for yt_dlp
+track_resolver: TrackResolver = TrackResolver(extract_song, extract_pool)
+
+
 class PersistentMusicView(discord.ui.View):
     def __init__(self, client: commands.Bot):
         super().__init__(timeout=None)  
@@ -55,9 +73,9 @@ class PersistentMusicView(discord.ui.View):
         self.children[-1].callback = self.clear_queue_callback
         self.add_item(discord.ui.Button(emoji="<:Close:1306675070848204820>", style=discord.ButtonStyle.danger, custom_id="stop", row=2))
         self.children[-1].callback = self.stop_callback
-        self.add_item(discord.ui.Button(emoji="<:Close:1306675070848204820>", style=discord.ButtonStyle.secondary, disabled=True, custom_id="loop", row=3))
+        self.add_item(discord.ui.Button(emoji="🔁", style=discord.ButtonStyle.secondary, custom_id="loop", row=3))
         self.children[-1].callback = self.loop_callback
-        self.add_item(discord.ui.Button(emoji="<:Close:1306675070848204820>", style=discord.ButtonStyle.secondary, disabled=True, custom_id="shuffle", row=3))
+        self.add_item(discord.ui.Button(emoji="🔀", style=discord.ButtonStyle.secondary, custom_id="shuffle", row=3))
         self.children[-1].callback = self.shuffle_callback
         self.add_item(discord.ui.Button(emoji="<:Close:1306675070848204820>", style=discord.ButtonStyle.secondary, disabled=True, custom_id="volume_up", row=3))
         self.children[-1].callback = self.volume_up_callback
@@ -72,29 +90,12 @@ class PersistentMusicView(discord.ui.View):
         # Get the voice client for the guild
         voice_client = discord.utils.get(self.client.voice_clients, guild=interaction.guild)
         try:
-            if voice_client and voice_client.is_playing():
-                current_song = queues[guild_id]["current"]["original_url"] if queues[guild_id]["current"] else None
-                previous_url = queues[guild_id]["played"].pop(-1) if queues[guild_id]["played"] else None
-                if not current_song and previous_url:
-                    queues[guild_id]["queue"] = [previous_url, *queues[guild_id]["queue"]]
-                if previous_url and current_song:
-                    queues[guild_id]["queue"] = [previous_url, current_song, *queues[guild_id]["queue"]]
-                else:
-                    await interaction.response.send_message(f"{interaction.user.mention} No previous song found.", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
-                    return
-                # Stop the current song
+            # When a song plays it is queued again after the previous one
+            if voice_client and guild_id in queues and queues[guild_id].back(replay_current=voice_client.is_playing()):
                 voice_client.stop() # This will trigger the after callback to play the next song in the queue
-
-                # Inform the user that the song was skipped
                 await interaction.response.send_message(f"{interaction.user.mention} Playing previous song.", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
             else:
-                previous_url = queues[guild_id]["played"].pop(-1) if queues[guild_id]["played"] else None
-                if previous_url:
-                    queues[guild_id]["queue"] = [previous_url, *queues[guild_id]["queue"]]
-                    voice_client.stop() # This will trigger the after callback to play the next song in the queue
-                    await interaction.response.send_message(f"{interaction.user.mention} Playing previous song.", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
-                else:
-                    await interaction.response.send_message(f"{interaction.user.mention} No previous song found.", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+                await interaction.response.send_message(f"{interaction.user.mention} No previous song found.", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
         
         except Exception as e:
             logger.error(f"Error skipping the song: {e}")
@@ -125,12 +126,14 @@ class PersistentMusicView(discord.ui.View):
         voice_client = discord.utils.get(self.client.voice_clients, guild=interaction.guild)
         try:
             if voice_client and voice_client.is_playing():
-                # Stop the current song
+                # Stop the current song, also when it loops
+                if guild_id in queues:
+                    queues[guild_id].skip()
                 voice_client.stop() # This will trigger the after callback to play the next song in the queue
 
                 await interaction.response.send_message(f"{interaction.user.mention} Skipped the song.", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
             else:
-                if queues[guild_id]["queue"] and not voice_client.is_playing():
+                if queues[guild_id] and not voice_client.is_playing():
                     await self.play_next(interaction)
                     await interaction.response.send_message(f"{interaction.user.mention} Skipped the song.", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
                 else:
@@ -154,21 +157,25 @@ class PersistentMusicView(discord.ui.View):
 
         # Specify the channel ID or name you want the bot to join
         # You can use the channel ID directly for accuracy, or fetch it by name
-        music_channel = discord.utils.get(interaction.guild.voice_channels, id=ids[guild_id]["music_voice_id"])
+        music_channel = discord.utils.get(interaction.guild.voice_channels, id=guild_config[guild_id].music_voice_id)
 
         if music_channel is None:
             await interaction.response.send_message("```ansi\n[2;31mThe specified voice channel does not exist. please update the channel ID.```", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
             return
         
-        # Get video or playlist URLs
-        video_urls = get_video_urls(url)
-        if video_urls == []:
-            await interaction.response.send_message("```ansi\n[2;31mInvalid URL or no video(s) were found.```", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+        # Check what kind of URL it is, the songs of a playlist are read after the interaction is answered
+        kind = url_kind(url)
+        if kind is None:
+            await interaction.response.send_message("```ansi\n[2;31mInvalid URL or no video(s) were found.```", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
             return
-        if video_urls == "radio":
-            await interaction.response.send_message("```ansi\n[2;31mThis is a radio URL and cannot be processed.", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+        if kind == "radio":
+            await interaction.response.send_message("```ansi\n[2;31mThis is a radio URL and cannot be processed.", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
             return
         
+        # Answer right away, a big playlist takes longer to read than the 3 seconds an interaction has. This message shows the progress
+        await interaction.response.send_message(f"{interaction.user.mention} Loading the song(s)...", silent=True, allowed_mentions=discord.AllowedMentions.none())
+        message = await interaction.original_response()
+        
         if self.client.voice_clients and guild_id in voice_clients:
             voice_client = voice_clients[guild_id]
         else:
@@ -178,32 +185,65 @@ class PersistentMusicView(discord.ui.View):
                 voice_clients[guild_id] = voice_client
             except TypeError as e:
                 logger.error(f"Error connecting to the voice channel: {e}")
-                await interaction.response.send_message("```ansi\n[2;31mAn error occurred while trying to connect to the voice channel.```", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+                await self.edit_progress(message, "```ansi\n[2;31mAn error occurred while trying to connect to the voice channel.```", delete_after=20)
                 return
 
         # If there's no queue for this guild, create one
         if guild_id not in queues:
-            queues[guild_id] = {"played":[], "current": {}, "queue":[]}
+            queues[guild_id] = MusicQueue()
+        queue = queues[guild_id]
 
-        # If the bot is not already playing music, play the first song in the queue
-        if not voice_clients[guild_id].is_playing():
-            # Add video URLs to the queue
-            queues[guild_id]["queue"] = [*queues[guild_id]["queue"], *video_urls]
-            if len(video_urls) > 1:
-                await interaction.response.send_message(f"{interaction.user.mention} Playing the queue and added {len(video_urls)-1} song(s) to the queue.", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
-            else:
-                await interaction.response.send_message(f"{interaction.user.mention} Playing the song", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
-            await self.play_next(interaction)
+        # Add the songs to the queue while they are read, the first one plays as soon as it is known
+        added, playing, stopped, failed = 0, None, False, False
+        last_edit = time.perf_counter()
+        try:
+            async for video_urls in stream_video_urls(url, kind, guild_id, extract_pool):
+                if queues.get(guild_id) is not queue:
+                    stopped = True  # the queue was cleared or the bot was stopped while the playlist was read
+                    break
+                queue.extend(video_urls)
+                added += len(video_urls)
+                if playing is None:
+                    # If the bot is not already playing music, play the first song in the queue
+                    playing = not voice_clients[guild_id].is_playing()
+                    if playing:
+                        await self.play_next(interaction)
+                        continue
+                track_resolver.prefetch(guild_id, queue.upcoming(track_resolver.lookahead))
+                if time.perf_counter() - last_edit >= PROGRESS_INTERVAL:
+                    last_edit = time.perf_counter()
+                    await self.edit_progress(message, f"{interaction.user.mention} Loading the playlist, added {added} song(s) to the queue so far...")
+        except Exception as e:
+            logger.error(f"An error occurred while trying to fetch the video URLs: {e}")
+            failed = True
+
+        if added == 0:
+            await self.edit_progress(message, "```ansi\n[2;31mInvalid URL or no video(s) were found.```", delete_after=20)
+            return
+        if stopped:
+            text = f"{interaction.user.mention} Stopped loading the playlist after {added} song(s)."
+        elif playing and added > 1:
+            text = f"{interaction.user.mention} Playing the queue and added {added-1} song(s) to the queue."
+        elif playing:
+            text = f"{interaction.user.mention} Playing the song"
         else:
-            # Add video URLs to the queue
-            queues[guild_id]["queue"] = [*queues[guild_id]["queue"], *video_urls]
-            await interaction.response.send_message(f"{interaction.user.mention} Added {len(video_urls)} song(s) to the queue.", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+            text = f"{interaction.user.mention} Added {added} song(s) to the queue."
+        if failed:
+            text += " The rest of the playlist could not be loaded."
+        await self.edit_progress(message, text, delete_after=20)
+    
+    async def edit_progress(self, message: discord.InteractionMessage, content: str, delete_after: float | None = None) -> None:
+        try:
+            await message.edit(content=content, delete_after=delete_after, allowed_mentions=discord.AllowedMentions.none())
+        except discord.HTTPException as e:
+            logger.debug(f"Could not edit the queue message: {e}")  # deleted by someone, the songs are queued anyway
     
     async def clear_queue_callback(self, interaction: discord.Interaction) -> None:
         logger.command(interaction, {"command": "clear_queue"})
         guild_id = interaction.guild_id
         if guild_id in queues:
             queues.pop(guild_id)
+            track_resolver.cancel(guild_id)
             await interaction.response.send_message(f"{interaction.user.mention} Queue and history cleared!", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
         else:
             await interaction.response.send_message(f"{interaction.user.mention} There is no queue or history to clear", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
@@ -215,6 +255,7 @@ class PersistentMusicView(discord.ui.View):
             if guild_id in voice_clients:
                 voice_client = voice_clients[guild_id]
                 queues.pop(guild_id)
+                track_resolver.cancel(guild_id)
                 voice_client.stop()
                 await voice_client.disconnect()
                 voice_clients.pop(guild_id)
@@ -224,6 +265,7 @@ class PersistentMusicView(discord.ui.View):
         except KeyError as e:
             guild_id = interaction.guild_id
             if guild_id in voice_clients:
+                track_resolver.cancel(guild_id)
                 voice_client = voice_clients[guild_id]
                 voice_client.stop()
                 await voice_client.disconnect()
@@ -234,10 +276,26 @@ class PersistentMusicView(discord.ui.View):
             await interaction.response.send_message(f"```ansi\n[2;31mI'm unable to stop the song at the moment```", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
     
     async def loop_callback(self, interaction: discord.Interaction) -> None:
-        pass
-    
+        logger.command(interaction, {"command": "loop"})
+        guild_id = interaction.guild_id
+        if guild_id not in queues:
+            await interaction.response.send_message(f"{interaction.user.mention} There is no queue to loop", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+            return
+        # off -> the whole queue -> the current song -> off
+        loop = queues[guild_id].cycle_loop()
+        messages = {LOOP_OFF: "Stopped looping.", LOOP_ALL: "Looping the whole queue.", LOOP_ONE: "Looping the current song."}
+        await interaction.response.send_message(f"{interaction.user.mention} {messages[loop]}", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+
     async def shuffle_callback(self, interaction: discord.Interaction) -> None:
-        pass
+        logger.command(interaction, {"command": "shuffle"})
+        guild_id = interaction.guild_id
+        if guild_id not in queues or len(queues[guild_id]) < 2:
+            await interaction.response.send_message(f"{interaction.user.mention} There are not enough songs in the queue to shuffle", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
+            return
+        queues[guild_id].shuffle()
+        # other songs are up next now, the look-ahead moves along with them
+        track_resolver.prefetch(guild_id, queues[guild_id].upcoming(track_resolver.lookahead))
+        await interaction.response.send_message(f"{interaction.user.mention} Shuffled {len(queues[guild_id])} song(s).", delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
     
     async def volume_mute_callback(self, interaction: discord.Interaction) -> None:
         pass
@@ -249,29 +307,43 @@ class PersistentMusicView(discord.ui.View):
         pass
     
     # player functions for music
+    async def _play_after_failure(self, interaction: discord.Interaction) -> None:
+        guild_id = interaction.guild.id
+        if guild_id not in queues:
+            return
+        queues[guild_id].fail()  # a song that loops would fail again, so it is dropped from the queue
+        if queues[guild_id].failed_in_a_row >= MUSIC_MAX_FAILURES:
+            # YouTube is probably blocking the bot, trying the rest of the queue would fail the same way
+            music_spam_channel = self.client.get_channel(guild_config[guild_id].music_channel_id)
+            await music_spam_channel.send(f"```ansi\n[2;31m{MUSIC_MAX_FAILURES} songs in a row could not be played, press skip to try the next one.```", delete_after=60)
+            return
+        await self.play_next(interaction)
+
     async def play_next(self, interaction: discord.Interaction) -> None:
+        started = time.perf_counter()
         guild_id = interaction.guild.id
-        music_spam_channel = self.client.get_channel(ids[guild_id]["music_channel_id"])
+        music_spam_channel = self.client.get_channel(guild_config[guild_id].music_channel_id)
         # Check if there are songs in the queue
-        if guild_id in queues and queues[guild_id]["queue"]:
-            next_url = queues[guild_id]["queue"].pop(0)  # Get the next song from the queue
-            previous_url = queues[guild_id]["current"]["original_url"] if queues[guild_id]["current"] else None
-            if previous_url:
-                queues[guild_id]["played"].append(previous_url)  # Add the song to the played list
-            loop = asyncio.get_event_loop()
+        next_url = queues[guild_id].advance() if guild_id in queues else None  # Get the next song, the one that ended goes to the played list
+        if next_url:
+            # start on the songs after this one, so they are ready when this one ends
+            track_resolver.prefetch(guild_id, queues[guild_id].upcoming(track_resolver.lookahead))
 
             try:
-                # Extract song info
-                data = await loop.run_in_executor(None, lambda: ytdl.extract_info(next_url, download=False))
-                queues[guild_id]["current"] = data  # Set the current song to the next song
-                logger.debug(f"Playing: {queues[guild_id]['current']['title']}\ncurrent first 10 queue items: {queues[guild_id]['queue'][0:10]}\nplayed: {queues[guild_id]['played']}")
+                # Extract song info, this is instant when the look-ahead resolved it already
+                track = await track_resolver.resolve(guild_id, next_url)
+                if track is None or guild_id not in queues:
+                    return  # the queue was cleared or the bot was stopped in the meantime
+                data = track.data
+                queues[guild_id].current = data  # Set the current song to the next song
+                logger.debug(f"Playing: {data['title']}\ncurrent first 10 queue items: {queues[guild_id].upcoming(10)}\nplayed: {queues[guild_id].played[-10:]}")
                 song_url = data['url']
                 
                 player = discord.FFmpegOpusAudio(song_url, **ffmpeg_options)
 
                 # Play the song and set the after callback to play the next song in the queue
                 if not voice_clients[guild_id].is_connected():
-                    music_channel = discord.utils.get(interaction.guild.voice_channels, id=ids[guild_id]["music_voice_id"])
+                    music_channel = discord.utils.get(interaction.guild.voice_channels, id=guild_config[guild_id].music_voice_id)
 
                     if music_channel is None:
                         await interaction.response.send_message("```ansi\n[2;31mThe specified voice channel does not exist. please update the channel ID.```", ephemeral=True, delete_after=20, silent=True, allowed_mentions=discord.AllowedMentions.none())
@@ -286,6 +358,7 @@ class PersistentMusicView(discord.ui.View):
                         return
                 try:
                     voice_clients[guild_id].play(player, after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(interaction), self.client.loop))
+                    track_resolver.record_switch(time.perf_counter() - started)
                 except discord.errors.ClientException:
                     pass
                 await music_spam_channel.send(f"Now playing: **{data['title']}**", delete_after=20*60) # Delete after 20 minutes to keep channel a bit clean
@@ -293,13 +366,13 @@ class PersistentMusicView(discord.ui.View):
                 logger.error(f"Error downloading the song: {e}")
                 await music_spam_channel.send(f"```ansi\n[2;31mAn error occurred while trying to download the song. Skipping to the next song.```", delete_after=10)
                 # voice_client.stop()
-                await self.play_next(interaction)  # Automatically attempt to play the next song
+                await self._play_after_failure(interaction)  # Automatically attempt to play the next song
             except Exception as e:
                 logger.error(f"Error playing the song: {e}")
                 await music_spam_channel.send(f"```ansi\n[2;31mAn error occurred while trying to play the song. Skipping to the next song.```", delete_after=10)
 
                 # If an error occurs, skip to the next song
-                await self.play_next(interaction)  # Automatically attempt to play the next song
+                await self._play_after_failure(interaction)
         else:
             # No more songs in the queue
             await music_spam_channel.send("The queue is empty, no more songs to play.", delete_after=10)
\ No newline at end of file
@@ -0,0 +1,127 @@
+# python imports
+from collections import deque
+from dotenv import load_dotenv
+from typing import Any, Iterable
+import itertools
+import random
+import re
+import os
+
+# local imports
+from extractCache import video_id
+
+load_dotenv()
+MUSIC_HISTORY_SIZE: int = int(os.getenv("MUSIC_HISTORY_SIZE", 100))  # played songs the back button can go back to
+MUSIC_MAX_FAILURES: int = int(os.getenv("MUSIC_MAX_FAILURES", 10))  # songs in a row that may fail before the player stops trying
+
+WATCH_URL: str = "https://www.youtube.com/watch?v="
+_VIDEO_ID = re.compile(r"[\w-]{11}")
+
+# loop modes, the loop button goes through them in this order
+LOOP_OFF: str = "off"
+LOOP_ALL: str = "all"
+LOOP_ONE: str = "one"
+LOOP_MODES: tuple[str, ...] = (LOOP_OFF, LOOP_ALL, LOOP_ONE)
+
+
+def compact(url: str) -> str:
+    """What the queue stores for a song: the video id of a YouTube url, other urls as they are."""
+    return video_id(url)
+
+
+def expand(song: str) -> str:
+    """The url of a song the way the queue stored it."""
+    return WATCH_URL + song if _VIDEO_ID.fullmatch(song) else song
+
+
+class MusicQueue(object):
+    """The songs of one guild: the ones that are up next, the one that plays and the last few that played.
+
+    Both ends of the queue are a deque, so adding songs, taking the next one and putting songs back in
+    front don't depend on the length of the queue. The history only keeps the last `history_size` songs.
+    """
+
+    def __init__(self, history_size: int = MUSIC_HISTORY_SIZE) -> None:
+        self._upcoming: deque[str] = deque()
+        self._played: deque[str] = deque(maxlen=history_size)
+        self.current: dict[str, Any] = {}  # what yt_dlp extracted for the song that plays, empty when there is none
+        self._playing: str | None = None  # the song `advance` handed out last, as the queue stores it
+        self.loop: str = LOOP_OFF
+        self.failed_in_a_row: int = 0
+        self._skipping = False
+        self._failed = False
+
+    def __len__(self) -> int:
+        return len(self._upcoming)
+
+    def extend(self, urls: Iterable[str]) -> None:
+        """Add songs to the end of the queue."""
+        self._upcoming.extend(map(compact, urls))
+
+    def upcoming(self, count: int) -> list[str]:
+        """The urls of the next `count` songs."""
+        return [expand(song) for song in itertools.islice(self._upcoming, count)]
+
+    @property
+    def played(self) -> list[str]:
+        return [expand(song) for song in self._played]
+
+    def skip(self) -> None:
+        """The song that plays is stopped on purpose, so the next `advance` moves on even when it loops one song."""
+        self._skipping = True
+
+    def fail(self) -> None:
+        """The song that plays could not be played, the next `advance` drops it instead of playing or queueing it again."""
+        self._failed = True
+        self.failed_in_a_row += 1
+
+    def advance(self) -> str | None:
+        """The url of the song to play now the current one ended, None when there is nothing left to play.
+
+        The song that ended goes to the history, also when it was the last one. It is played again when one
+        song loops, or added to the end of the queue when the whole queue loops. A song that failed is
+        dropped, so a loop of songs that can't be played runs out instead of going on forever.
+        """
+        skipping, self._skipping = self._skipping, False
+        failed, self._failed = self._failed, False
+        song = self._playing
+        if song is not None and not failed:
+            self.failed_in_a_row = 0
+        if song is not None and self.loop == LOOP_ONE and not skipping and not failed:
+            return expand(song)
+        if song is not None and not failed:
+            self._played.append(song)
+            if self.loop == LOOP_ALL:
+                self._upcoming.append(song)
+        self._playing = self._upcoming.popleft() if self._upcoming else None
+        if self._playing is None:
+            self.current = {}
+            return None
+        return expand(self._playing)
+
+    def back(self, replay_current: bool) -> bool:
+        """Put the previous song in front of the queue, followed by the current one when `replay_current`. False without a previous song."""
+        if not self._played:
+            return False
+        previous = self._played.pop()
+        if replay_current and self._playing is not None:
+            self._upcoming.extendleft((self._playing, previous))
+        else:
+            if self._playing is not None:
+                self._played.append(self._playing)  # a paused song counts as played, like one that ended
+            self._upcoming.appendleft(previous)
+        self._playing = None  # it is in the queue or the history now, so it isn't added once more
+        self.skip()
+        return True
+
+    def shuffle(self) -> None:
+        """Shuffle the songs that are up next, the history and the current song stay as they are."""
+        songs = list(self._upcoming)  # shuffling the deque itself would index into its middle for every swap
+        random.shuffle(songs)
+        self._upcoming.clear()
+        self._upcoming.extend(songs)
+
+    def cycle_loop(self) -> str:
+        """Switch to the next loop mode, returns the new one."""
+        self.loop = LOOP_MODES[(LOOP_MODES.index(self.loop) + 1) % len(LOOP_MODES)]
+        return self.loop
@@ -0,0 +1,75 @@
+# python imports
+from dotenv import load_dotenv
+from typing import Any, AsyncIterator, Iterable, Iterator
+import itertools
+import os
+
+# 3rd party imports
+import yt_dlp
+from yt_dlp.utils import PagedList
+
+# local imports
+from extractPool import ExtractPool, NOW_PLAYING, PLAYLIST
+
+load_dotenv()
+PLAYLIST_PAGE_SIZE: int = 100  # songs that are added to the queue at once, YouTube sends playlists in pages of 100 too
+PLAYLIST_MAX_SONGS: int = int(os.getenv("PLAYLIST_MAX_SONGS", 5000))  # the rest of a bigger playlist is left out
+PROGRESS_INTERVAL: float = 2.0  # seconds between two edits of the "loading the playlist" message
+FLAT_OPTIONS: dict[str, Any] = {"extract_flat": True, "quiet": True, "lazy_playlist": True}
+
+
+def _entries(entries: Iterable | PagedList) -> Iterator[dict[str, Any]]:
+    if isinstance(entries, PagedList):
+        # some sites hand out pages that have to be asked for one by one
+        for start in itertools.count(0, PLAYLIST_PAGE_SIZE):
+            page = entries.getslice(start, start + PLAYLIST_PAGE_SIZE)
+            if not page:
+                return
+            yield from page
+    else:
+        yield from entries
+
+
+class PlaylistReader(object):
+    """Reads the song urls of a playlist a page at a time, yt_dlp only fetches the next page from YouTube when it is asked for.
+
+    `page` blocks and continues where the previous call stopped, so the calls have to run one after the other.
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.title: str | None = None
+        self._urls: Iterator[str] | None = None
+
+    def page(self, size: int) -> list[str]:
+        if self._urls is None:
+            # without processing, the entries of the playlist are a generator instead of a list of every song
+            info = yt_dlp.YoutubeDL(FLAT_OPTIONS).extract_info(self.url, download=False, process=False)
+            self.title = info.get("title")
+            self._urls = (entry["url"] for entry in _entries(info.get("entries") or ()) if isinstance(entry, dict) and entry.get("url"))
+        return list(itertools.islice(self._urls, size))
+
+
+async def stream_video_urls(url: str, kind: str, guild_id: int, pool: ExtractPool) -> AsyncIterator[list[str]]:
+    """Yields the song urls of a video or playlist url page by page, read on the threads of `pool`.
+
+    The first page is a single song that is read as urgently as a song that has to play now, the rest of
+    the playlist waits behind the songs of the other guilds.
+    """
+    if kind == "video":
+        yield [url]
+        return
+
+    reader = PlaylistReader(url)
+    size, priority, total = 1, NOW_PLAYING, 0
+    while total < PLAYLIST_MAX_SONGS:
+        future = pool.submit(guild_id, reader.page, min(size, PLAYLIST_MAX_SONGS - total), priority=priority)
+        try:
+            urls = await future
+        finally:
+            future.cancel()  # does nothing when the page was read, drops it when the caller gave up waiting
+        if not urls:
+            return
+        total += len(urls)
+        yield urls
+        size, priority = PLAYLIST_PAGE_SIZE, PLAYLIST
@@ -0,0 +1,107 @@
+# python imports
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+import functools
+import os
+
+# local imports
+from logger import logger
+
+load_dotenv()
+SLOW_QUERY_MS: float = float(os.getenv("DATABASE_SLOW_QUERY_MS", 200))  # queries slower than this end up in the slow query log
+WINDOW_SIZE: int = 512  # the amount of recent samples the histograms and percentiles are based on
+BUCKETS_MS: tuple[float, ...] = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+
+# the name of the helper that is running the current query, set by the `named_query` decorator
+current_query: ContextVar[str] = ContextVar("current_query", default="unnamed")
+
+
+def named_query(func):
+    """Decorator for the database helpers, every query the helper runs is recorded under its name."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_query.set(func.__qualname__)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_query.reset(token)
+    return wrapper
+
+
+@dataclass(slots=True)
+class QueryStats:
+    count: int = 0
+    errors: int = 0
+    rows: int = 0
+    slow: int = 0
+    # (connect, execute, fetch) in milliseconds of the most recent queries
+    window: deque = field(default_factory=lambda: deque(maxlen=WINDOW_SIZE))
+
+    def totals(self) -> list[float]:
+        return sorted(sum(sample) for sample in self.window)
+
+    def percentile(self, fraction: float) -> float:
+        totals = self.totals()
+        if not totals:
+            return 0.0
+        return totals[min(len(totals) - 1, int(len(totals) * fraction))]
+
+    def histogram(self) -> dict[float, int]:
+        """Count the recent queries per latency bucket, the key is the upper bound of the bucket in ms."""
+        histogram = {bucket: 0 for bucket in BUCKETS_MS}
+        for total in self.totals():
+            for bucket in BUCKETS_MS:
+                if total <= bucket:
+                    histogram[bucket] += 1
+                    break
+        return histogram
+
+    def average(self, phase: int) -> float:
+        if not self.window:
+            return 0.0
+        return sum(sample[phase] for sample in self.window) / len(self.window)
+
+
+class QueryRecorder(object):
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.queries: dict[str, QueryStats] = {}
+
+    def record(self, name: str, database_name: str, query: str, timings: dict[str, float], error: Exception | None = None) -> None:
+        """Store the timings of one query, the timings are in seconds as filled in by the backends."""
+        stats = self.queries.setdefault(name, QueryStats())
+        stats.count += 1
+        sample = (timings.get("connect", 0.0) * 1000, timings.get("execute", 0.0) * 1000, timings.get("fetch", 0.0) * 1000)
+        stats.window.append(sample)
+        stats.rows += int(timings.get("rows", 0))
+        if error is not None:
+            stats.errors += 1
+        total = sum(sample)
+        if total >= self.slow_query_ms:
+            stats.slow += 1
+            logger.slow_query(f"Slow query {name} on {database_name} took {total:.1f}ms: {query}", {
+                "name": name,
+                "database": database_name,
+                "connect_ms": round(sample[0], 2),
+                "execute_ms": round(sample[1], 2),
+                "fetch_ms": round(sample[2], 2),
+                "rows": int(timings.get("rows", 0)),
+                "error": str(error) if error else None
+            })
+
+    def summary(self, limit: int = 15) -> list[str]:
+        """One line per query name, the slowest queries (by p95) first."""
+        lines = []
+        ordered = sorted(self.queries.items(), key=lambda item: item[1].percentile(0.95), reverse=True)
+        for name, stats in ordered[:limit]:
+            lines.append(
+                f"{name}: n={stats.count} err={stats.errors} slow={stats.slow} rows={stats.rows} "
+                f"p50={stats.percentile(0.5):.1f}ms p95={stats.percentile(0.95):.1f}ms max={stats.percentile(1):.1f}ms "
+                f"(connect {stats.average(0):.1f} / exec {stats.average(1):.1f} / fetch {stats.average(2):.1f})"
+            )
+        return lines
+
+
+query_recorder = QueryRecorder()
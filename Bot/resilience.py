@@ -0,0 +1,60 @@
+# python imports
+from dotenv import load_dotenv
+import random
+import time
+import os
+
+# local imports
+from logger import logger
+
+load_dotenv()
+DATABASE_RETRY_ATTEMPTS: int = int(os.getenv("DATABASE_RETRY_ATTEMPTS", 3))  # tries per query, including the first one
+DATABASE_RETRY_BASE_DELAY: float = float(os.getenv("DATABASE_RETRY_BASE_DELAY", 0.05))  # seconds, doubled after every failed try
+DATABASE_REQUEST_BUDGET: float = float(os.getenv("DATABASE_REQUEST_BUDGET", 2.0))  # seconds a query may take including its retries, discord wants an answer within 3
+DATABASE_BREAKER_THRESHOLD: int = int(os.getenv("DATABASE_BREAKER_THRESHOLD", 5))  # failed queries in a row before the breaker opens
+DATABASE_PROBE_INTERVAL: float = float(os.getenv("DATABASE_PROBE_INTERVAL", 5))  # seconds between the health probes while the breaker is open
+
+
+def backoff_delay(attempt: int, base_delay: float = DATABASE_RETRY_BASE_DELAY) -> float:
+    """The time to wait before the next try, exponential with full jitter so the retries of many requests spread out."""
+    return random.uniform(0, base_delay * (2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """Keeps track of the health of one database.
+
+    After `threshold` transient failures in a row the breaker opens and every query fails right away,
+    instead of each interaction waiting on a database that is down. The storage backend probes the
+    database in the background while the breaker is open and closes it again after a probe succeeds.
+    """
+
+    def __init__(self, name: str, threshold: int = DATABASE_BREAKER_THRESHOLD) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.times_opened = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.success(f"The database {self.name} is reachable again after {time.monotonic() - self.opened_at:.1f}s, closing the circuit breaker.")
+            self.opened_at = None
+
+    def record_failure(self) -> bool:
+        """Count a transient failure, returns True when this failure opened the breaker."""
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            logger.critical(f"The database {self.name} failed {self.failures} time(s) in a row, opening the circuit breaker.")
+            return True
+        return False
+
+    @property
+    def stats(self) -> dict[str, int | bool]:
+        return {"open": self.is_open, "failures": self.failures, "times_opened": self.times_opened}
@@ -0,0 +1,115 @@
+# python imports
+from array import array
+from bisect import bisect_left, insort
+import asyncio
+
+# local imports
+from logger import logger
+
+COMPACT_THRESHOLD: int = 4096  # channels with more members than this are stored as a sorted array
+
+
+class MemberSet(object):
+    """The ids of the users that accepted the rules of one channel.
+
+    Small channels use a plain set, once a channel grows past `COMPACT_THRESHOLD` members
+    the ids are moved to a sorted array of unsigned 64 bit ints, which is about 8 bytes per member
+    instead of the ~60 bytes a set entry costs. Lookups on the array are a binary search.
+    """
+    __slots__ = ("_set", "_array")
+
+    def __init__(self, user_ids: list[int] | None = None) -> None:
+        self._set: set[int] | None = set()
+        self._array: array | None = None
+        for user_id in user_ids or []:
+            self._set.add(user_id)
+        if len(self._set) > COMPACT_THRESHOLD:
+            self._compact()
+
+    def _compact(self) -> None:
+        self._array = array("Q", sorted(self._set))
+        self._set = None
+
+    def __contains__(self, user_id: int) -> bool:
+        if self._set is not None:
+            return user_id in self._set
+        index = bisect_left(self._array, user_id)
+        return index < len(self._array) and self._array[index] == user_id
+
+    def add(self, user_id: int) -> bool:
+        """Add a user, returns False when the user was already in the set."""
+        if user_id in self:
+            return False
+        if self._set is not None:
+            self._set.add(user_id)
+            if len(self._set) > COMPACT_THRESHOLD:
+                self._compact()
+        else:
+            insort(self._array, user_id)
+        return True
+
+    def discard(self, user_id: int) -> None:
+        if self._set is not None:
+            self._set.discard(user_id)
+            return
+        index = bisect_left(self._array, user_id)
+        if index < len(self._array) and self._array[index] == user_id:
+            del self._array[index]
+
+    def __len__(self) -> int:
+        return len(self._set) if self._set is not None else len(self._array)
+
+
+class RuleGateIndex(object):
+    """In memory copy of the `rule_channels` and `rules_accepted` tables.
+
+    The index gets filled once with `load` and is kept up to date by the helpers in functions.py
+    that write to those tables, so checking a click on an accept button never needs the database.
+    """
+
+    def __init__(self) -> None:
+        self._channels: dict[int, MemberSet] = {}
+        self.loaded = False
+        self.lock = asyncio.Lock()
+
+    def load(self, rule_channels: list[dict], accepted_rules: list[dict]) -> None:
+        members: dict[int, list[int]] = {rule_channel["channel_id"]: [] for rule_channel in rule_channels}
+        for accepted in accepted_rules:
+            if accepted["channel_id"] in members:
+                members[accepted["channel_id"]].append(accepted["user_id"])
+        self._channels = {channel_id: MemberSet(user_ids) for channel_id, user_ids in members.items()}
+        self.loaded = True
+        logger.info(f"Loaded {len(self._channels)} rule gate(s) with {len(accepted_rules)} acceptance(s).")
+
+    def is_gated(self, channel_id: int) -> bool:
+        return channel_id in self._channels
+
+    def has_accepted(self, channel_id: int, user_id: int) -> bool:
+        members = self._channels.get(channel_id)
+        return members is not None and user_id in members
+
+    def add_channel(self, channel_id: int) -> None:
+        self._channels.setdefault(channel_id, MemberSet())
+
+    def remove_channel(self, channel_id: int) -> None:
+        self._channels.pop(channel_id, None)
+
+    def add_member(self, channel_id: int, user_id: int) -> bool:
+        """Mark a user as accepted, returns False when they already were."""
+        members = self._channels.get(channel_id)
+        if members is None:
+            return False
+        return members.add(user_id)
+
+    def remove_member(self, channel_id: int, user_id: int) -> None:
+        """Forget that a user accepted, for when saving the acceptance failed."""
+        members = self._channels.get(channel_id)
+        if members is not None:
+            members.discard(user_id)
+
+    @property
+    def channel_ids(self) -> list[int]:
+        return list(self._channels)
+
+
+rule_gates = RuleGateIndex()
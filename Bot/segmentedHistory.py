@@ -0,0 +1,100 @@
+# discord imports
+import discord
+
+# python imports
+from dotenv import load_dotenv
+from typing import AsyncIterator
+import asyncio
+import os
+
+# local imports
+from logger import logger
+
+load_dotenv()
+HISTORY_SEGMENTS: int = int(os.getenv("HISTORY_SEGMENTS", 8))  # time windows the history of a channel is split in
+HISTORY_CONCURRENCY: int = int(os.getenv("HISTORY_CONCURRENCY", 4))  # windows that are fetched at the same time
+HISTORY_WINDOW_BUFFER: int = int(os.getenv("HISTORY_WINDOW_BUFFER", 5000))  # messages a window may fetch ahead of the window that is being read
+_DONE = object()
+
+
+def split_range(start: int, end: int, segments: int) -> list[tuple[int, int]]:
+    """Split the snowflakes between `start` and `end` in windows that span the same amount of time.
+
+    Snowflakes start with their timestamp, so equal slices of the number range are equal slices
+    of time. Every window is `(after, before)`, both exclusive like `channel.history` uses them.
+    """
+    segments = max(1, min(segments, end - start))
+    bounds = [start + (end - start) * i // segments for i in range(segments + 1)]
+    return [(bounds[i] - (i > 0), bounds[i + 1]) for i in range(segments)]
+
+
+class SegmentedHistory(object):
+    """Reads the history of a channel in several time windows at the same time, oldest message first.
+
+    `channel.history` pages 100 messages per request and every request waits on the one before it.
+    This splits the lifetime of the channel in `segments` windows and walks `concurrency` of them at
+    once, the messages still come out in order. discord.py waits out the rate limits of the shared
+    message bucket, so a 429 slows the windows down instead of failing them.
+    """
+
+    def __init__(self, channel: discord.abc.Messageable, after: int | None = None, segments: int = HISTORY_SEGMENTS, concurrency: int = HISTORY_CONCURRENCY) -> None:
+        self.channel = channel
+        self.after = after if after is not None else channel.id - 1  # the id of a channel is the moment it was created
+        self.segments = segments
+        self.concurrency = concurrency
+
+    async def _walk(self, after: int, before: int, queue: asyncio.Queue, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            # history doesn't stop at `before` when `after` is given, so leave the walk at the end of the window
+            async for message in self.channel.history(limit=None, after=discord.Object(after), oldest_first=True):
+                if message.id >= before:
+                    break
+                await queue.put(message)
+
+    async def _window(self, after: int, before: int, queue: asyncio.Queue, semaphore: asyncio.Semaphore) -> None:
+        # the end marker is left out when the window gets cancelled, nobody reads the queue anymore then
+        try:
+            await self._walk(after, before, queue, semaphore)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await queue.put(_DONE)
+            raise
+        await queue.put(_DONE)
+
+    async def __aiter__(self) -> AsyncIterator[discord.Message]:
+        if self.segments <= 1 or self.concurrency <= 1:
+            async for message in self.channel.history(limit=None, after=discord.Object(self.after), oldest_first=True):
+                yield message
+            return
+
+        # the newest page tells if splitting is worth it, most tickets fit in one page and are done after one request
+        newest = [message async for message in self.channel.history(limit=100, after=discord.Object(self.after), oldest_first=False)]
+        if len(newest) < 100:
+            for message in reversed(newest):
+                yield message
+            return
+
+        windows = split_range(self.after, newest[-1].id, self.segments)
+        semaphore = asyncio.Semaphore(self.concurrency)  # the windows get their turn in order, so the one being read is never starved
+        queues = [asyncio.Queue(maxsize=HISTORY_WINDOW_BUFFER) for _ in windows]
+        tasks = [asyncio.create_task(self._window(start, end, queue, semaphore)) for (start, end), queue in zip(windows, queues)]
+        count = len(newest)
+        try:
+            for task, queue in zip(tasks, queues):
+                while (message := await queue.get()) is not _DONE:
+                    count += 1
+                    yield message
+                await task  # raise the error of a window that failed
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for message in reversed(newest):
+            yield message
+        logger.debug(f"Read {count} message(s) of {getattr(self.channel, 'name', self.channel.id)} in {len(windows)} windows")
+
+
+def segmented_history(channel: discord.abc.Messageable, after: int | None = None, segments: int = HISTORY_SEGMENTS, concurrency: int = HISTORY_CONCURRENCY) -> AsyncIterator[discord.Message]:
+    """The history of a channel oldest first, optionally only the messages after the snowflake `after`."""
+    return SegmentedHistory(channel, after, segments, concurrency).__aiter__()
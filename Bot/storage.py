@@ -0,0 +1,390 @@
+# python imports
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from typing import Any
+import asyncio
+import sqlite3
+import threading
+import time
+import re
+import os
+
+# 3rd party imports
+from mysql.connector import Error, errors
+
+# local imports
+from database import get_pool, maintain_pools, close_pools, PoolTimeout
+from queryStats import query_recorder, current_query
+from resilience import CircuitBreaker, backoff_delay, DATABASE_REQUEST_BUDGET, DATABASE_RETRY_ATTEMPTS, DATABASE_PROBE_INTERVAL
+from logger import logger
+import migrations
+
+load_dotenv()
+DATABASE_BACKEND: str = os.getenv("DATABASE_BACKEND", "mysql").lower()  # "mysql" or "sqlite"
+SQLITE_DIR: str = os.getenv("SQLITE_DIR", "/dreamy-data/sqlite")
+_MYSQL_VALUES_FUNCTION = re.compile(r"\bVALUES\((\w+)\)")  # `VALUES(column)` in an upsert, `excluded.column` in SQLite
+
+
+class StorageError(Exception):
+    """Raised by the backends when a query could not be run.
+
+    `transient` is True for errors that can go away on their own, like a lost connection or a
+    locked database, those are retried and count towards the circuit breaker.
+    """
+
+    def __init__(self, message: str, transient: bool = False) -> None:
+        super().__init__(message)
+        self.transient = transient
+
+
+class DatabaseUnavailable(StorageError):
+    """Raised when the database can't be reached in time, or while its circuit breaker is open.
+
+    Unlike other storage errors the query helpers don't swallow this one, the interaction handlers
+    answer it with a friendly message instead (see `handle_interaction_error` in functions.py).
+    """
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message, transient=True)
+
+
+class StorageBackend(object):
+    """The interface the helpers in functions.py talk to.
+
+    The queries are written for MySQL (`%s` placeholders, `INSERT IGNORE`), backends for other
+    databases translate them. The `select`, `insert`, `update` and `delete` functions log errors and
+    return None, just like the pool functions they replace.
+
+    Backends implement `_run` and `_run_batch`, the public functions wrap them to record
+    the timings of every query under the name of the helper that ran it (see queryStats.py), retry
+    transient errors within the request budget and keep a circuit breaker per database.
+    """
+    name: str = "base"
+
+    def __init__(self) -> None:
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._probes: dict[str, asyncio.Task] = {}
+
+    def _breaker(self, database_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(database_name)
+        if breaker is None:
+            breaker = self._breakers[database_name] = CircuitBreaker(database_name)
+        return breaker
+
+    def _check_breaker(self, database_name: str) -> CircuitBreaker:
+        breaker = self._breaker(database_name)
+        if breaker.is_open:
+            raise DatabaseUnavailable(f"The database {database_name} is unavailable, its circuit breaker is open")
+        return breaker
+
+    def _record(self, database_name: str, query: str, timings: dict[str, float], started: float, error: Exception | None) -> None:
+        if "execute" not in timings:
+            # the backend failed before it could split the time up, count all of it as executing
+            timings["execute"] = time.perf_counter() - started - timings.get("connect", 0.0)
+        query_recorder.record(current_query.get(), database_name, query, timings, error)
+
+    async def _attempt(self, database_name: str, label: str, call, idempotent: bool) -> Any:
+        """Run `call(timings)` with retries until it works, fails for good or the request budget is spent.
+
+        A query that is not idempotent is only retried when it failed before it reached the database,
+        otherwise a retry could apply a change twice.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DATABASE_REQUEST_BUDGET
+        attempt = 0
+        while True:
+            breaker = self._check_breaker(database_name)
+            timings: dict[str, float] = {}
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(call(timings), timeout=max(deadline - loop.time(), 0))
+            except (StorageError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    error = StorageError(f"The query on {database_name} did not finish within {DATABASE_REQUEST_BUDGET}s", transient=True)
+                    reached_database = True  # it might still be running
+                else:
+                    error = e
+                    reached_database = "execute" in timings
+                self._record(database_name, label, timings, started, error)
+                if not error.transient:
+                    breaker.record_success()  # the database answered, the query itself was wrong
+                    raise error
+                attempt += 1
+                if breaker.record_failure():
+                    self._start_probe(database_name)
+                    raise DatabaseUnavailable(f"The database {database_name} is unavailable, its circuit breaker opened: {error}") from error
+                delay = backoff_delay(attempt)
+                if attempt >= DATABASE_RETRY_ATTEMPTS or (reached_database and not idempotent) or loop.time() + delay >= deadline:
+                    raise DatabaseUnavailable(f"The database {database_name} could not be reached after {attempt} attempt(s): {error}") from error
+                logger.warning(f"The error '{error}' occurred on {database_name}, retrying in {delay * 1000:.0f}ms")
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            self._record(database_name, label, timings, started, None)
+            return result
+
+    async def run(self, database_name: str, query: str, values: Any = None, fetch: bool = False) -> list[dict] | int | None:
+        return await self._attempt(database_name, query, lambda timings: self._run(database_name, query, values, fetch, timings), idempotent=fetch)
+
+    async def run_batch(self, database_name: str, statements: list[tuple[str, Any]], idempotent: bool = False) -> int:
+        """Run several changing queries in one transaction, raises StorageError when it fails.
+
+        Pass `idempotent=True` when running the batch twice does no harm, so it may be retried after it reached the database.
+        """
+        label = f"{len(statements)} statement(s): {statements[0][0] if statements else ''}"
+        return await self._attempt(database_name, label, lambda timings: self._run_batch(database_name, statements, timings), idempotent=idempotent)
+
+    def _start_probe(self, database_name: str) -> None:
+        probe = self._probes.get(database_name)
+        if probe is None or probe.done():
+            self._probes[database_name] = asyncio.get_running_loop().create_task(self._probe(database_name))
+
+    async def _probe(self, database_name: str) -> None:
+        """Health probe that runs while the breaker of a database is open, a successful probe closes it."""
+        breaker = self._breaker(database_name)
+        while breaker.is_open:
+            await asyncio.sleep(DATABASE_PROBE_INTERVAL)
+            try:
+                await asyncio.wait_for(self._run(database_name, "SELECT 1", None, True, {}), timeout=DATABASE_REQUEST_BUDGET)
+            except (StorageError, asyncio.TimeoutError) as e:
+                logger.debug(f"The health probe of {database_name} failed: {e}")
+                continue
+            breaker.record_success()
+
+    @property
+    def health(self) -> dict[str, dict]:
+        return {database_name: breaker.stats for database_name, breaker in self._breakers.items()}
+
+    async def _run(self, database_name: str, query: str, values: Any, fetch: bool, timings: dict[str, float]) -> list[dict] | int | None:
+        raise NotImplementedError
+
+    async def _run_batch(self, database_name: str, statements: list[tuple[str, Any]], timings: dict[str, float]) -> int:
+        raise NotImplementedError
+
+    def migrate(self) -> None:
+        raise NotImplementedError
+
+    async def maintain(self) -> None:
+        """Background upkeep of the backend, backends that don't need it return right away."""
+        return
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    async def select(self, database_name: str, query: str, values: Any = None) -> list[dict] | None:
+        logger.debug(f"Selecting data from the database: {query}")
+        try:
+            return await self.run(database_name, query, values, fetch=True)
+        except DatabaseUnavailable:
+            raise
+        except StorageError as e:
+            logger.error(f"The error '{e}' occurred")
+
+    async def insert(self, database_name: str, query: str, values: Any) -> int | None:
+        logger.debug(f"Inserting data into the database: {values}")
+        try:
+            return await self.run(database_name, query, values)
+        except DatabaseUnavailable:
+            raise
+        except StorageError as e:
+            logger.error(f"The error '{e}' occurred")
+
+    async def update(self, database_name: str, query: str, values: Any) -> int | None:
+        logger.debug(f"Updating data in the database: {values}")
+        try:
+            return await self.run(database_name, query, values)
+        except DatabaseUnavailable:
+            raise
+        except StorageError as e:
+            logger.error(f"The error '{e}' occurred")
+
+    async def delete(self, database_name: str, query: str, values: Any) -> int | None:
+        logger.debug(f"Deleting data from the database: {values}")
+        try:
+            return await self.run(database_name, query, values)
+        except DatabaseUnavailable:
+            raise
+        except StorageError as e:
+            logger.error(f"The error '{e}' occurred")
+
+
+class MySQLBackend(StorageBackend):
+    """Stores everything on the MySQL server through the shared connection pools."""
+    name = "mysql"
+    # lost or refused connections, lock wait timeouts and deadlocks
+    transient_errnos: frozenset[int] = frozenset({1205, 1213, 2003, 2006, 2013, 2055})
+
+    @classmethod
+    def _error(cls, e: Exception) -> StorageError:
+        transient = isinstance(e, (PoolTimeout, errors.InterfaceError, errors.OperationalError)) or getattr(e, "errno", None) in cls.transient_errnos
+        return StorageError(str(e), transient=transient)
+
+    async def _run(self, database_name: str, query: str, values: Any, fetch: bool, timings: dict[str, float]) -> list[dict] | int | None:
+        try:
+            return await get_pool(database_name).run(query, values, fetch, timings)
+        except (Error, PoolTimeout) as e:
+            raise self._error(e) from e
+
+    async def _run_batch(self, database_name: str, statements: list[tuple[str, Any]], timings: dict[str, float]) -> int:
+        try:
+            return await get_pool(database_name).run_batch(statements, timings)
+        except (Error, PoolTimeout) as e:
+            raise self._error(e) from e
+
+    def migrate(self) -> None:
+        migrations.apply_migrations()
+
+    async def maintain(self) -> None:
+        await maintain_pools()
+
+    def close(self) -> None:
+        close_pools()
+
+
+class SQLiteBackend(StorageBackend):
+    """Stores every database in its own SQLite file, for small deployments and offline benchmarks.
+
+    Each file has one connection in WAL mode, the queries on it are run one at a time in a
+    dedicated thread so the event loop never waits on the disk.
+    """
+    name = "sqlite"
+    _translations: dict[str, str] = {}
+
+    def __init__(self, directory: str = SQLITE_DIR) -> None:
+        super().__init__()
+        self.directory = directory
+        self._connections: dict[str, sqlite3.Connection] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._open_lock = threading.Lock()
+
+    @staticmethod
+    def _error(e: sqlite3.Error) -> StorageError:
+        # another connection holding the write lock for longer than the busy timeout
+        transient = isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e))
+        return StorageError(str(e), transient=transient)
+
+    @classmethod
+    def translate(cls, query: str) -> str:
+        """Rewrite a MySQL style query for SQLite, the result is cached as the helpers reuse the same queries."""
+        translated = cls._translations.get(query)
+        if translated is None:
+            translated = query.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE")
+            # upserts, SQLite only allows leaving out the conflict target on the last ON CONFLICT clause, which is the only one here
+            translated = translated.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+            translated = _MYSQL_VALUES_FUNCTION.sub(r"excluded.\1", translated)
+            cls._translations[query] = translated
+        return translated
+
+    def _connection(self, database_name: str) -> sqlite3.Connection:
+        connection = self._connections.get(database_name)
+        if connection is not None:
+            return connection
+        with self._open_lock:
+            if database_name not in self._connections:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{database_name}.sqlite3")
+                logger.debug(f"Opening the SQLite database: {path}")
+                connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                connection.row_factory = sqlite3.Row
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute("PRAGMA busy_timeout=5000")
+                self._locks[database_name] = threading.Lock()
+                self._executors[database_name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{database_name}")
+                self._connections[database_name] = connection
+            return self._connections[database_name]
+
+    def _execute(self, database_name: str, query: str, values: Any, fetch: bool, timings: dict[str, float]) -> list[dict] | int | None:
+        connection = self._connection(database_name)
+        started = time.perf_counter()
+        with self._locks[database_name]:
+            # waiting for the lock is the SQLite version of waiting for a pooled connection
+            timings["connect"] = time.perf_counter() - started
+            try:
+                started = time.perf_counter()
+                cursor = connection.execute(self.translate(query), values or ())
+                timings["execute"] = time.perf_counter() - started
+                try:
+                    started = time.perf_counter()
+                    if fetch:
+                        result = [dict(row) for row in cursor.fetchall()]
+                        timings["rows"] = len(result)
+                    else:
+                        result = cursor.rowcount
+                        timings["rows"] = max(result, 0)
+                    timings["fetch"] = time.perf_counter() - started
+                    return result
+                finally:
+                    cursor.close()
+            except sqlite3.Error as e:
+                raise self._error(e) from e
+
+    def _execute_batch(self, database_name: str, statements: list[tuple[str, Any]], timings: dict[str, float]) -> int:
+        connection = self._connection(database_name)
+        started = time.perf_counter()
+        with self._locks[database_name]:
+            timings["connect"] = time.perf_counter() - started
+            try:
+                started = time.perf_counter()
+                connection.execute("BEGIN IMMEDIATE")
+                rowcount = 0
+                for query, values in statements:
+                    rowcount += max(connection.execute(self.translate(query), values or ()).rowcount, 0)
+                timings["execute"] = time.perf_counter() - started
+                started = time.perf_counter()
+                connection.execute("COMMIT")
+                timings["fetch"] = time.perf_counter() - started
+                timings["rows"] = rowcount
+                return rowcount
+            except sqlite3.Error as e:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise self._error(e) from e
+
+    async def _run(self, database_name: str, query: str, values: Any, fetch: bool, timings: dict[str, float]) -> list[dict] | int | None:
+        self._connection(database_name)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executors[database_name], self._execute, database_name, query, values, fetch, timings)
+
+    async def _run_batch(self, database_name: str, statements: list[tuple[str, Any]], timings: dict[str, float]) -> int:
+        self._connection(database_name)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executors[database_name], self._execute_batch, database_name, statements, timings)
+
+    def migrate(self) -> None:
+        for database_name in migrations.DATABASES:
+            connection = self._connection(database_name)
+            with self._locks[database_name]:
+                migrations.migrate_sqlite(connection, database_name)
+
+    def close(self) -> None:
+        with self._open_lock:
+            for database_name, connection in self._connections.items():
+                with self._locks[database_name]:
+                    connection.close()
+                self._executors[database_name].shutdown(wait=False)
+            self._connections.clear()
+
+
+_storage: StorageBackend | None = None
+
+
+def get_storage() -> StorageBackend:
+    """Get the backend that is selected with DATABASE_BACKEND in the .env file."""
+    global _storage
+    if _storage is None:
+        if DATABASE_BACKEND == "sqlite":
+            _storage = SQLiteBackend()
+        elif DATABASE_BACKEND == "mysql":
+            _storage = MySQLBackend()
+        else:
+            raise ValueError(f"Unknown DATABASE_BACKEND '{DATABASE_BACKEND}', use 'mysql' or 'sqlite'")
+        logger.info(f"Using the {_storage.name} storage backend.")
+    return _storage
+
+
+def use_storage(backend: StorageBackend) -> None:
+    """Replace the selected backend, used by the benchmarks to compare the backends."""
+    global _storage
+    _storage = backend
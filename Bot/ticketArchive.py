@@ -0,0 +1,255 @@
+# discord imports
+import discord
+
+# python imports
+from typing import Any, AsyncIterable, BinaryIO
+import asyncio
+import os
+
+# local imports
+from attachments import AttachmentDownloader, StoredAttachment
+from zipStream import ZipStreamWriter
+from transcript import TranscriptWriter
+from segmentedHistory import segmented_history
+from logger import logger
+
+PIPELINE_QUEUE_SIZE: int = 200  # messages a consumer may fall behind before the history walk waits for it
+_DONE = object()
+
+
+class HistoryConsumer(object):
+    """Gets every message of a ticket once, oldest first, from a `TicketPipeline`."""
+    name: str = "consumer"
+
+    async def start(self) -> None:
+        return
+
+    async def consume(self, message: discord.Message) -> None:
+        raise NotImplementedError
+
+    async def finish(self) -> Any:
+        """Called after the last message, the return value ends up in the results of the pipeline."""
+        return None
+
+    async def abort(self) -> None:
+        """Called instead of `finish` when the consumer failed."""
+        return
+
+
+class TranscriptConsumer(HistoryConsumer):
+    name = "transcript"
+
+    def __init__(self, path: str, title: str, footer: str = "") -> None:
+        self.writer = TranscriptWriter(path, title)
+        self.footer = footer
+
+    async def start(self) -> None:
+        await self.writer.open()
+
+    async def consume(self, message: discord.Message) -> None:
+        await self.writer.add_message(message)
+
+    async def finish(self) -> str:
+        return await self.writer.close(self.footer)
+
+    async def abort(self) -> None:
+        await self.writer.abort()
+
+
+class AttachmentConsumer(HistoryConsumer):
+    name = "attachments"
+
+    def __init__(self, directory: str) -> None:
+        self.downloader = AttachmentDownloader(directory)
+        # the archive consumer waits on this, the consumers finish at the same time
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def start(self) -> None:
+        await asyncio.to_thread(os.makedirs, self.downloader.directory, exist_ok=True)
+
+    async def consume(self, message: discord.Message) -> None:
+        for attachment in message.attachments:
+            await self.downloader.put(message.id, attachment)
+
+    async def finish(self) -> list[StoredAttachment]:
+        stored = await self.downloader.finish()
+        self.result.set_result(stored)
+        return stored
+
+    async def abort(self) -> None:
+        await self.downloader.close()
+        if not self.result.done():
+            self.result.set_result([])
+
+
+class ArchiveConsumer(HistoryConsumer):
+    """Puts the downloaded attachments in one zip while the other downloads are still running.
+
+    A ticket with a single attachment gets that file instead of a zip, so the zip is only started
+    once a second unique file comes in.
+    """
+    name = "archive"
+
+    def __init__(self, source: AttachmentConsumer, output: str | BinaryIO) -> None:
+        self.source = source
+        self.output = output
+        self._first: StoredAttachment | None = None
+        self._writer: ZipStreamWriter | None = None
+        source.downloader.on_stored.append(self._stored)
+
+    def _stored(self, attachment: StoredAttachment) -> None:
+        if attachment.duplicate:
+            return
+        if self._first is None:
+            self._first = attachment
+            return
+        if self._writer is None:
+            self._writer = ZipStreamWriter(self.output)
+            self._writer.add(self._first.blob, self._first.filename, self._first.content_type)
+        self._writer.add(attachment.blob, attachment.filename, attachment.content_type)
+
+    async def consume(self, message: discord.Message) -> None:
+        return  # the entries come in through the downloader
+
+    async def finish(self) -> str | BinaryIO | StoredAttachment | None:
+        """The zip, or the attachment itself when there was only one, its blob is named after its hash instead of the filename."""
+        await self.source.result  # every download has been stored
+        if self._writer is not None:
+            await self._writer.close()
+            return self.output
+        return self._first
+
+    async def abort(self) -> None:
+        if self._writer is not None:
+            await self._writer.abort()
+
+
+class StatsConsumer(HistoryConsumer):
+    name = "stats"
+
+    def __init__(self) -> None:
+        self.messages = 0
+        self.attachments = 0
+        self.authors: set[int] = set()
+        self.first: discord.Message | None = None
+        self.last: discord.Message | None = None
+
+    async def consume(self, message: discord.Message) -> None:
+        self.messages += 1
+        self.attachments += len(message.attachments)
+        self.authors.add(message.author.id)
+        if self.first is None:
+            self.first = message
+        self.last = message
+
+    async def finish(self) -> dict[str, Any]:
+        return {
+            "messages": self.messages,
+            "attachments": self.attachments,
+            "authors": len(self.authors),
+            "first_message_at": self.first.created_at.isoformat() if self.first else None,
+            "last_message_at": self.last.created_at.isoformat() if self.last else None,
+        }
+
+
+class TicketPipeline(object):
+    """Walks the history of a ticket once and hands every message to all consumers.
+
+    Every consumer runs in its own task with a bounded queue in front of it, so the consumers
+    work at the same time while the next page of history is fetched. When one consumer falls
+    `queue_size` messages behind, the walk waits for it. A consumer that fails is skipped from
+    then on, the others still finish.
+    """
+
+    def __init__(self, consumers: list[HistoryConsumer], queue_size: int = PIPELINE_QUEUE_SIZE) -> None:
+        self.consumers = consumers
+        self.queue_size = queue_size
+
+    async def _work(self, consumer: HistoryConsumer, queue: asyncio.Queue) -> Any:
+        try:
+            await consumer.start()
+            failed = False
+        except Exception as e:
+            logger.error(f"The {consumer.name} consumer failed to start: {e!r}")
+            failed = True
+        while True:
+            message = await queue.get()
+            if message is _DONE:
+                break
+            if failed:
+                continue  # keep emptying the queue so the walk never waits on a dead consumer
+            try:
+                await consumer.consume(message)
+            except Exception as e:
+                logger.error(f"The {consumer.name} consumer failed on message {message.id}: {e!r}")
+                failed = True
+        if failed:
+            await consumer.abort()
+            return None
+        try:
+            return await consumer.finish()
+        except Exception as e:
+            logger.error(f"The {consumer.name} consumer failed to finish: {e!r}")
+            await consumer.abort()
+            return None
+
+    async def run(self, history: AsyncIterable[discord.Message]) -> dict[str, Any]:
+        """Walk the history and return the result of every consumer by its name."""
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.consumers]
+        workers = [asyncio.create_task(self._work(consumer, queue)) for consumer, queue in zip(self.consumers, queues)]
+        try:
+            async for message in history:
+                for queue in queues:
+                    await queue.put(message)
+        except Exception as e:
+            # keep what was walked so far, a partial transcript beats none
+            logger.critical(f"Walking the ticket history failed, the archive is incomplete: {e!r}")
+        finally:
+            for queue in queues:
+                await queue.put(_DONE)
+        results = await asyncio.gather(*workers)
+        return {consumer.name: result for consumer, result in zip(self.consumers, results)}
+
+
+async def archive_ticket(channel: discord.TextChannel, directory: str, transcript: bool = True, attachments: bool = True, footer: str = "") -> dict[str, Any]:
+    """Build the transcript, attachments and zip of a ticket in one walk over its history.
+
+    Returns:
+        dict[str, Any]: `transcript` (path), `attachments` (list of StoredAttachment), `archive` (path of the zip, or the StoredAttachment when there was only one), `skipped` (attachments over the size budgets) and `stats`, the ones that were asked for
+    """
+    consumers: list[HistoryConsumer] = [StatsConsumer()]
+    if transcript:
+        consumers.append(TranscriptConsumer(os.path.join(directory, f"transcript-{channel.name}.txt"), channel.name, footer))
+    if attachments:
+        source = AttachmentConsumer(directory)
+        consumers.append(source)
+        consumers.append(ArchiveConsumer(source, os.path.join(directory, f"attachments-{channel.name}.zip")))
+    results = await TicketPipeline(consumers).run(segmented_history(channel))
+    if attachments:
+        results["skipped"] = source.downloader.skipped
+    logger.info(f"Archived ticket {channel.name}: " + ", ".join(f"{key}={value}" for key, value in results["stats"].items()))
+    return results
+
+
+async def archive_attachments(directory: str, name: str, attachments: list[tuple[int, Any]]) -> dict[str, Any]:
+    """Store and zip a list of attachments without walking the history, for tickets whose messages were captured.
+
+    `attachments` holds the message id and the attachment, anything with the filename, url, size and
+    content type of a discord.Attachment works. Returns the same keys as `archive_ticket` without the transcript.
+    """
+    source = AttachmentConsumer(directory)
+    archive = ArchiveConsumer(source, os.path.join(directory, f"attachments-{name}.zip"))
+    results: dict[str, Any] = {"attachments": None, "archive": None, "stats": {"attachments": len(attachments)}}
+    try:
+        await source.start()
+        for message_id, attachment in attachments:
+            await source.downloader.put(message_id, attachment)
+        results["attachments"] = await source.finish()
+        results["archive"] = await archive.finish()
+    except Exception as e:
+        logger.error(f"Archiving the attachments of {name} failed: {e!r}")
+        await source.abort()
+        await archive.abort()
+    results["skipped"] = source.downloader.skipped
+    logger.info(f"Archived {len(attachments)} captured attachment(s) of ticket {name}")
+    return results
@@ -0,0 +1,265 @@
+# discord imports
+from discord.ext import commands
+import discord
+
+# python imports
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from typing import Any
+from urllib.parse import urlparse, parse_qs
+import asyncio
+import json
+import time
+import os
+
+# local imports
+from ticketIndex import open_tickets
+from transcript import TranscriptWriter
+from segmentedHistory import segmented_history
+from logger import logger
+
+load_dotenv()
+TICKET_CAPTURE: bool = os.getenv("TICKET_CAPTURE", "False") == "True"
+TICKET_CAPTURE_DIR: str = os.getenv("TICKET_CAPTURE_DIR", "/dreamy-data/tickets/capture")
+TICKET_CAPTURE_FLUSH_INTERVAL: float = 1.0  # seconds the captured events may wait before they are appended to disk
+CAPTURE_LOG_NAME: str = "capture.jsonl"
+LINK_EXPIRY_MARGIN: float = 300.0  # seconds before a captured attachment link expires that it is fetched again
+
+
+@dataclass(slots=True, frozen=True)
+class CapturedAttachment:
+    """What the attachment downloader needs of an attachment, as it was captured."""
+    id: int
+    filename: str
+    url: str
+    size: int
+    content_type: str | None
+
+    @classmethod
+    def from_data(cls, data: dict[str, Any]) -> "CapturedAttachment":
+        return cls(int(data["id"]), data["filename"], data["url"], int(data["size"]), data.get("content_type"))
+
+    @property
+    def expired(self) -> bool:
+        # discord signs attachment links with the hex timestamp they stop working at
+        expires = parse_qs(urlparse(self.url).query).get("ex")
+        try:
+            return bool(expires) and int(expires[0], 16) - LINK_EXPIRY_MARGIN < time.time()
+        except ValueError:
+            return False
+
+
+class TicketCapture(object):
+    """Records the messages of open tickets while they are posted, so closing a ticket doesn't have to read its history.
+
+    Every ticket channel gets an append-only JSON lines log in `TICKET_CAPTURE_DIR` with one line per
+    created, edited or deleted message. `finalize` replays the log into a transcript. Messages are
+    written by a background task every `TICKET_CAPTURE_FLUSH_INTERVAL` seconds, `reconcile` fetches
+    what was posted while the bot was offline.
+    """
+
+    def __init__(self, enabled: bool = TICKET_CAPTURE, directory: str = TICKET_CAPTURE_DIR) -> None:
+        self.enabled = enabled
+        self.directory = directory
+        self._pending: dict[int, list[str]] = {}
+        self._flusher: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._stopped: set[int] = set()  # tickets that are being closed, nothing of them is captured anymore
+
+    def path(self, channel_id: int) -> str:
+        return os.path.join(self.directory, f"{channel_id}.jsonl")
+
+    def has_log(self, channel_id: int) -> bool:
+        return self.enabled and (channel_id in self._pending or os.path.exists(self.path(channel_id)))
+
+    def _append(self, channel_id: int, event: dict[str, Any]) -> None:
+        self._pending.setdefault(channel_id, []).append(json.dumps(event, ensure_ascii=False) + "\n")
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(TICKET_CAPTURE_FLUSH_INTERVAL)
+        await self.flush()
+
+    async def flush(self, channel_id: int | None = None) -> None:
+        """Append the pending events to the logs, optionally only those of one channel."""
+        async with self._flush_lock:
+            channel_ids = [channel_id] if channel_id is not None else list(self._pending)
+            batches = {key: self._pending.pop(key) for key in channel_ids if key in self._pending}
+            if batches:
+                await asyncio.to_thread(self._write, batches)
+
+    def _write(self, batches: dict[int, list[str]]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        for channel_id, lines in batches.items():
+            with open(self.path(channel_id), "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+    @staticmethod
+    def _created(message: discord.Message) -> dict[str, Any]:
+        return {
+            "op": "create",
+            "id": message.id,
+            "author": message.author.name,
+            "author_id": message.author.id,
+            "content": message.content,
+            "attachments": [TicketCapture._attachment(attachment.to_dict()) for attachment in message.attachments],
+        }
+
+    @staticmethod
+    def _attachment(data: dict[str, Any]) -> dict[str, Any]:
+        return {key: data.get(key) for key in ("id", "filename", "url", "size", "content_type")}
+
+    def _is_captured(self, channel_id: int) -> bool:
+        return self.enabled and channel_id not in self._stopped and open_tickets.loaded and open_tickets.get(channel_id) is not None
+
+    def stop(self, channel_id: int) -> None:
+        """Stop capturing a ticket that is being closed, otherwise its last messages would start a new log after `finalize` moved it."""
+        self._stopped.add(channel_id)
+
+    def forget(self, channel_id: int) -> None:
+        """The ticket is closed and its channel is gone."""
+        self._stopped.discard(channel_id)
+
+    # event listeners, registered with `listen`
+    async def on_message(self, message: discord.Message) -> None:
+        if self._is_captured(message.channel.id):
+            self._append(message.channel.id, self._created(message))
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        if self._is_captured(payload.channel_id) and "content" in payload.data:
+            event = {"op": "edit", "id": payload.message_id, "content": payload.data["content"]}
+            if "attachments" in payload.data:
+                # attachments can be removed from a message, but never added
+                event["attachments"] = [self._attachment(data) for data in payload.data["attachments"]]
+            self._append(payload.channel_id, event)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        if self._is_captured(payload.channel_id):
+            self._append(payload.channel_id, {"op": "delete", "id": payload.message_id})
+
+    def listen(self, client: commands.Bot) -> None:
+        if not self.enabled:
+            return
+        client.add_listener(self.on_message)
+        client.add_listener(self.on_raw_message_edit)
+        client.add_listener(self.on_raw_message_delete)
+        logger.info(f"Capturing the messages of open tickets in {self.directory}")
+
+    def _last_message_id(self, channel_id: int) -> int | None:
+        last = None
+        try:
+            with open(self.path(channel_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    event = json.loads(line)
+                    if event["op"] == "create" and (last is None or event["id"] > last):
+                        last = event["id"]
+        except FileNotFoundError:
+            return None
+        return last
+
+    async def start(self, channel: discord.TextChannel) -> None:
+        """Capture the messages that were posted before the ticket was registered, like the ticket's opening message."""
+        await self.backfill(channel)
+
+    async def backfill(self, channel: discord.TextChannel) -> int:
+        """Fetch the messages posted after the last captured one, or the whole channel when nothing was captured yet."""
+        if not self.enabled or channel.id in self._stopped:
+            return 0
+        await self.flush(channel.id)
+        last = await asyncio.to_thread(self._last_message_id, channel.id)
+        count = 0
+        async for message in segmented_history(channel, after=last):
+            self._append(channel.id, self._created(message))
+            count += 1
+        await self.flush(channel.id)
+        return count
+
+    async def reconcile(self, client: commands.Bot) -> None:
+        """Fill the gaps in the logs of the open tickets, after the bot was offline for a while.
+
+        Edits and deletes that happened while the bot was offline can't be seen, those messages keep
+        their captured content.
+        """
+        if not self.enabled:
+            return
+        for channel_id in open_tickets.channel_ids:
+            channel = client.get_channel(channel_id)
+            if channel is None or channel_id in self._stopped:
+                continue
+            try:
+                count = await self.backfill(channel)
+            except discord.HTTPException as e:
+                logger.error(f"Could not reconcile the capture of ticket {channel_id}: {e}")
+                continue
+            if count:
+                logger.info(f"Captured {count} message(s) of ticket {channel.name} that were posted while the bot was offline")
+
+    def _replay(self, channel_id: int) -> list[dict[str, Any]]:
+        messages: dict[int, dict[str, Any]] = {}
+        with open(self.path(channel_id), "r", encoding="utf-8") as f:
+            for line in f:
+                event = json.loads(line)
+                if event["op"] == "create":
+                    messages.setdefault(event["id"], event)  # a backfill can capture a live message a second time
+                elif event["op"] == "edit" and event["id"] in messages:
+                    messages[event["id"]]["content"] = event["content"]
+                    if "attachments" in event:
+                        messages[event["id"]]["attachments"] = event["attachments"]
+                elif event["op"] == "delete":
+                    messages.pop(event["id"], None)
+        # snowflakes go up with time, so sorting on them restores the order of the channel
+        return [messages[message_id] for message_id in sorted(messages)]
+
+    async def finalize(self, channel: discord.TextChannel, path: str, footer: str = "") -> tuple[str, list[tuple[int, CapturedAttachment]] | None]:
+        """Turn the captured log into a transcript at `path`, the log is moved next to it.
+
+        Returns:
+            tuple[str, list | None]: The path of the transcript and the attachments of the ticket with the id of their message,
+            None when the log is from before the attachment links were captured
+        """
+        self.stop(channel.id)
+        await self.flush(channel.id)
+        messages = await asyncio.to_thread(self._replay, channel.id)
+        attachments: list[tuple[int, CapturedAttachment]] | None = []
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        async with TranscriptWriter(path, channel.name) as writer:
+            for message in messages:
+                # older logs only have the filenames
+                await writer.add(message["author"], message["content"], [item if isinstance(item, str) else item["filename"] for item in message["attachments"]])
+                for item in message["attachments"]:
+                    if isinstance(item, str):
+                        attachments = None
+                    elif attachments is not None:
+                        attachments.append((message["id"], CapturedAttachment.from_data(item)))
+            path = await writer.close(footer)
+        # keep the log next to the transcript, the capture folder only holds the logs of open tickets
+        await asyncio.to_thread(os.replace, self.path(channel.id), os.path.join(os.path.dirname(path), CAPTURE_LOG_NAME))
+        logger.debug(f"Finalized the captured transcript of {channel.name} with {len(messages)} message(s)")
+        return path, attachments
+
+    @staticmethod
+    async def refresh_links(channel: discord.TextChannel, attachments: list[tuple[int, CapturedAttachment]]) -> list[tuple[int, CapturedAttachment]]:
+        """Fetch new links for the attachments whose links expired, only their messages are fetched instead of the whole history."""
+        fresh: dict[int, dict[int, CapturedAttachment]] = {}
+        for message_id in dict.fromkeys(message_id for message_id, attachment in attachments if attachment.expired):
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.NotFound:
+                fresh[message_id] = {}  # deleted while the bot was offline
+                continue
+            except discord.HTTPException as e:
+                logger.warning(f"Could not refresh the attachment links of message {message_id} in {channel.name}: {e}")
+                continue
+            fresh[message_id] = {attachment.id: CapturedAttachment.from_data(attachment.to_dict()) for attachment in message.attachments}
+        refreshed = []
+        for message_id, attachment in attachments:
+            if message_id in fresh:
+                attachment = fresh[message_id].get(attachment.id)
+                if attachment is None:
+                    continue  # the message or the attachment is gone
+            refreshed.append((message_id, attachment))
+        return refreshed
+
+
+ticket_capture = TicketCapture()
@@ -0,0 +1,42 @@
+# python imports
+import asyncio
+
+# local imports
+from logger import logger
+
+
+class OpenTicketIndex(object):
+    """In memory copy of the `open_tickets` table, maps the channel of a ticket to the user that opened it.
+
+    Like the rule gate index, it gets filled once at startup and is kept up to date by the ticket
+    helpers in functions.py.
+    """
+
+    def __init__(self) -> None:
+        self._tickets: dict[int, int] = {}
+        self.loaded = False
+        self.lock = asyncio.Lock()
+
+    def load(self, open_tickets: list[dict]) -> None:
+        self._tickets = {ticket["channel_id"]: ticket["user_id"] for ticket in open_tickets}
+        self.loaded = True
+        logger.info(f"Loaded {len(self._tickets)} open ticket(s).")
+
+    def get(self, channel_id: int) -> int | None:
+        return self._tickets.get(channel_id)
+
+    def add(self, channel_id: int, user_id: int) -> None:
+        self._tickets[channel_id] = user_id
+
+    def remove(self, channel_id: int) -> None:
+        self._tickets.pop(channel_id, None)
+
+    @property
+    def channel_ids(self) -> list[int]:
+        return list(self._tickets)
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+
+open_tickets = OpenTicketIndex()
@@ -7,12 +7,15 @@ from discord.ui import View, Select
 import time
 
 # local imports
-from functions import send_message_to_user, create_connection, save_ticket_to_db, load_ticket_from_db, close_connection, load_ids, delete_ticket_from_db, save_transcript, zip_files
+from functions import send_message_to_user, save_ticket_to_db, load_ticket_from_db
+from closeJobs import close_jobs, CloseJob
+from ticketCapture import ticket_capture
+from guildConfig import guild_config
 from logger import logger
+from cogs.utils.SafeView import SafeView
 
-ids: dict[int, dict[str, int]] = load_ids()
 
-class PersistentTicketView(discord.ui.View):
+class PersistentTicketView(SafeView):
     def __init__(self, client: commands.Bot):
         super().__init__(timeout=None)  
         self.add_item(discord.ui.Button(label="📬 Create a Ticket", style=discord.ButtonStyle.green, custom_id="ticket_menu"))
@@ -29,7 +32,7 @@ class PersistentTicketView(discord.ui.View):
             discord.SelectOption(label="Other Subject", value="05", emoji="❓", description="Have any other subjects you want to talk about?")
         ])
         select.callback = self.select_callback
-        view = View(timeout=60)
+        view = SafeView(timeout=60)
         view.add_item(select)
         await interaction.response.send_message("Select the type of ticket you would like to create.", view=view, ephemeral=True, delete_after=60)
     
@@ -37,25 +40,25 @@ class PersistentTicketView(discord.ui.View):
         logger.command(interaction, {"command": "ticket", "sub_command": "create_select_callback"})
         await interaction.response.defer()
         
-        support_category = discord.utils.get(interaction.guild.categories, id=ids[interaction.guild.id]["support_category_id"])
+        support_category = discord.utils.get(interaction.guild.categories, id=guild_config[interaction.guild.id].support_category_id)
         if not support_category:
             logger.error("Support category not found. Please provide a valid category ID.")
             await interaction.followup.send("```ansi\n[2;31mSupport category not found. Please provide a valid category ID.```", ephemeral=True)
             return
         
-        sky_guardians_role = interaction.guild.get_role(ids[interaction.guild.id]["sky_guardians_role_id"])
+        sky_guardians_role = interaction.guild.get_role(guild_config[interaction.guild.id].sky_guardians_role_id)
         if not sky_guardians_role:
             logger.error("Sky Guardians role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mSky Guardians role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        tech_oracle_role = interaction.guild.get_role(ids[interaction.guild.id]["tech_oracle_role_id"])
+        tech_oracle_role = interaction.guild.get_role(guild_config[interaction.guild.id].tech_oracle_role_id)
         if not tech_oracle_role:
             logger.error("Tech Oracle role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mTech Oracle role not found. Please provide a valid role ID.```", ephemeral=True)
             return
 
-        owner = await self.client.fetch_user(ids[interaction.guild.id]["owner_id"]) 
+        owner = await self.client.fetch_user(guild_config[interaction.guild.id].owner_id) 
         if not owner:
             logger.error("Owner was not found. Please provide a valid user ID.")
             await interaction.followup.send("```ansi\n[2;31mowner was not found. Please provide a valid user ID.```", ephemeral=True)
@@ -195,7 +198,7 @@ class PersistentTicketView(discord.ui.View):
         
         elif interaction.data["values"][0] == "06": # Custom Role Update
             # get the admin user to ping them
-            owner = await self.client.fetch_user(ids[interaction.guild.id]["owner_id"])
+            owner = await self.client.fetch_user(guild_config[interaction.guild.id].owner_id)
             if not owner:
                 logger.error("Owner was not found. Please provide a valid user ID.")
                 await interaction.followup.send("```ansi\n[2;31mowner was not found. Please provide a valid user ID.```", ephemeral=True)
@@ -235,11 +238,10 @@ class PersistentTicketView(discord.ui.View):
             logger.warning("Invalid selection", {"ticket_type": "invalid", "selection": interaction.data["values"][0]})
             await interaction.followup.send("Invalid selection", ephemeral=True)
             return # Exit the function
-        connection = create_connection("Server_data")
-        save_ticket_to_db(connection, interaction.user.id, ticket_channel.id)
-        close_connection(connection)
+        await save_ticket_to_db(interaction.user.id, ticket_channel.id)
+        await ticket_capture.start(ticket_channel)  # the messages above were sent before the ticket was registered
 
-class PersistentCloseTicketView(discord.ui.View):
+class PersistentCloseTicketView(SafeView):
     def __init__(self, client):
         super().__init__(timeout=None)  
         self.add_item(discord.ui.Button(label="Close Ticket", style=discord.ButtonStyle.red, custom_id="ticket_close_menu"))
@@ -254,20 +256,20 @@ class PersistentCloseTicketView(discord.ui.View):
         ])
         
         select.callback = self.select_callback
-        view = View(timeout=60)
+        view = SafeView(timeout=60)
         view.add_item(select)
         await interaction.response.send_message("Do you really want to close the ticket?", view=view, ephemeral=True, delete_after=60)
 
     async def select_callback(self, interaction: discord.Interaction):
         logger.command(interaction, {"command": "ticket", "sub_command": "close_select_callback"})
         await interaction.response.defer()
-        sky_guardians_role = interaction.guild.get_role(ids[interaction.guild.id]["sky_guardians_role_id"])
+        sky_guardians_role = interaction.guild.get_role(guild_config[interaction.guild.id].sky_guardians_role_id)
         if not sky_guardians_role:
             logger.error("Sky Guardians role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mSky Guardians role not found. Please provide a valid role ID.```", ephemeral=True)
             return
         
-        tech_oracle_role = interaction.guild.get_role(ids[interaction.guild.id]["tech_oracle_role_id"])
+        tech_oracle_role = interaction.guild.get_role(guild_config[interaction.guild.id].tech_oracle_role_id)
         if not tech_oracle_role:
             logger.error("Tech Oracle role not found. Please provide a valid role ID.")
             await interaction.followup.send("```ansi\n[2;31mTech Oracle role not found. Please provide a valid role ID.```", ephemeral=True)
@@ -275,41 +277,28 @@ class PersistentCloseTicketView(discord.ui.View):
         
         if interaction.data["values"][0] == "01": # Yes, close this ticket
             logger.info(f"Ticket closed by user {interaction.user.name} in channel {interaction.channel.name}")
-            if interaction.user.id != ids[interaction.guild.id]["owner_id"] or sky_guardians_role in interaction.user.roles or tech_oracle_role in interaction.user.roles:
-                await interaction.followup.send("Ticket will be closed.", ephemeral=True)
-                connection = create_connection("Server_data")
-                user_id = load_ticket_from_db(connection, interaction.channel.id)
-                user_id = user_id["user_id"]
+            if interaction.user.id != guild_config[interaction.guild.id].owner_id or sky_guardians_role in interaction.user.roles or tech_oracle_role in interaction.user.roles:
+                ticket = await load_ticket_from_db(interaction.channel.id)
+                user_id = ticket["user_id"] if ticket else None
                 if not user_id:
                     await interaction.followup.send("No saved ticket found for this channel.", ephemeral=True)
                     return
-                user = await self.client.fetch_user(user_id)
-                if not user:
-                    logger.error("The user that created this ticket is not found!", {"ticket_type": "close", "user_id": user_id})
-                    await interaction.followup.send("```ansi\n[2;31mThe user that created this ticket is not found!```", ephemeral=True)
-                    user = interaction.user
-                
-                ticket_logs = ""
-                path = await save_transcript(interaction.channel, ticket_logs)
-                attatchments_path = await zip_files(interaction.channel)
+                user = self.client.get_user(user_id)
+                user_label = f"{user.name} a.k.a {user.display_name}" if user else f"<@{user_id}>"
 
-                ticket_logs_channel = self.client.get_channel(ids[interaction.guild.id]["ticket_log_channel_id"])
-                if ticket_logs_channel:
-                    await ticket_logs_channel.send(f"Transcript for {interaction.channel.name}:\nThe ticket for {user.name} a.k.a {user.display_name} has been closed by {interaction.user.name} a.k.a {interaction.user.display_name}", file=discord.File(path))
-                    if attatchments_path:
-                        await ticket_logs_channel.send(file=discord.File(attatchments_path))
-                else:
-                    logger.error("Ticket logs channel not found. Please provide a valid channel ID.")
+                # the transcript, uploads, channel and DMs are handled by a close job, its progress is shown in the ticket log channel
+                job = CloseJob(
+                    channel_id=interaction.channel.id,
+                    guild_id=interaction.guild.id,
+                    channel_name=interaction.channel.name,
+                    header=f"Transcript for {interaction.channel.name}:\nThe ticket for {user_label} has been closed by {interaction.user.name} a.k.a {interaction.user.display_name}",
+                    notify_id=user_id,
+                )
+                if not await close_jobs.submit(job):
+                    await interaction.followup.send("This ticket is already being closed.", ephemeral=True)
+                    return
+                await interaction.followup.send("Ticket will be closed.", ephemeral=True)
                 logger.info(f"Ticket closed by user {interaction.user.name} in channel {interaction.channel.name}", {"ticket_type": "close", "channel_id": interaction.channel.id})
-                
-                await interaction.channel.delete()
-                connection = create_connection("Server_data")
-                delete_ticket_from_db(connection, interaction.channel.id)
-                close_connection(connection)
-                await user.send("Your ticket has been closed successfully. The Transcript of the ticket has been saved.")
-                await user.send(f"Transcript for {interaction.channel.name}:", file=discord.File(path))
-                if attatchments_path: 
-                    await user.send(file=discord.File(attatchments_path))
             else:
                 logger.error("User does not have permission to close this ticket", {"ticket_type": "close", "user_id": interaction.user.id, "channel_id": interaction.channel.name})
                 await interaction.followup.send("You do not have permission to use this command.", ephemeral=True)
@@ -0,0 +1,147 @@
+# python imports
+from collections import deque
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from typing import Any, Callable
+from urllib.parse import urlparse, parse_qs
+import asyncio
+import time
+import os
+
+# local imports
+from extractPool import ExtractPool, NOW_PLAYING, LOOKAHEAD
+from logger import logger
+
+load_dotenv()
+MUSIC_LOOKAHEAD: int = int(os.getenv("MUSIC_LOOKAHEAD", 2))  # queued songs that are resolved while the current one plays, 0 turns it off
+STREAM_EXPIRY_MARGIN: float = 120.0  # seconds before its expiry a stream URL is resolved again instead of played
+STREAM_TTL_FALLBACK: float = 3600.0  # seconds a stream URL is trusted when it doesn't say when it expires
+SWITCH_WINDOW: int = 200  # the amount of recent track switches the latency percentiles are based on
+
+
+def stream_expiry(data: dict[str, Any], resolved_at: float | None = None) -> float:
+    """The unix time the stream URL of an extracted song stops working.
+
+    YouTube signs its stream URLs with an `expire` parameter, other sites get the fallback.
+    """
+    resolved_at = time.time() if resolved_at is None else resolved_at
+    try:
+        return float(parse_qs(urlparse(data.get("url", "")).query)["expire"][0])
+    except (KeyError, IndexError, ValueError):
+        return resolved_at + STREAM_TTL_FALLBACK
+
+
+@dataclass(slots=True)
+class ResolvedTrack:
+    url: str
+    data: dict[str, Any]
+    expires_at: float
+
+    @property
+    def expiring(self) -> bool:
+        return self.expires_at - time.time() < STREAM_EXPIRY_MARGIN
+
+
+class TrackResolver(object):
+    """Resolves the next songs of every guild's queue while the current song plays.
+
+    `prefetch` starts the extraction of the first `lookahead` songs of the queue in the background,
+    `resolve` hands out such a result when the song is up and only extracts the song itself when it
+    wasn't resolved yet or its stream URL is about to expire. The extractions run in `pool`, the song
+    that is up now before the look-aheads.
+    """
+
+    def __init__(self, extract: Callable[[str], dict[str, Any]], pool: ExtractPool, lookahead: int = MUSIC_LOOKAHEAD) -> None:
+        self._extract = extract
+        self._pool = pool
+        self.lookahead = lookahead
+        self._pending: dict[int, dict[str, asyncio.Future]] = {}  # guild id -> queued url -> its extraction
+        self._current: dict[int, asyncio.Future] = {}  # the extraction of the song that is about to play
+        self._switches: deque[float] = deque(maxlen=SWITCH_WINDOW)  # seconds between the end of a song and the start of the next
+        self.ready = 0  # switches where the next song was resolved already
+        self.waited = 0  # switches that waited for a look-ahead that was still running
+        self.cold = 0  # switches that had to extract the song themselves
+
+    def _resolve(self, url: str) -> ResolvedTrack:
+        # runs on a thread of the pool
+        data = self._extract(url)
+        return ResolvedTrack(url, data, stream_expiry(data))
+
+    @staticmethod
+    def _stale(future: asyncio.Future) -> bool:
+        """A finished look-ahead that can't be used: it was cancelled, failed or its stream URL expires soon."""
+        return future.done() and (future.cancelled() or future.exception() is not None or future.result().expiring)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        # retrieving the exception here keeps asyncio from warning about it, play_next reports it when the song is up
+        if not future.cancelled() and future.exception() is not None:
+            logger.debug(f"Resolving a queued song failed: {future.exception()!r}")
+
+    def prefetch(self, guild_id: int, upcoming: list[str]) -> None:
+        """Resolve the first songs of `upcoming` in the background, look-aheads of songs that are no longer up next are cancelled."""
+        if self.lookahead <= 0:
+            return
+        wanted = list(dict.fromkeys(upcoming[:self.lookahead]))
+        pending = self._pending.setdefault(guild_id, {})
+        for url in [url for url in pending if url not in wanted]:
+            pending.pop(url).cancel()
+        for url in wanted:
+            future = pending.get(url)
+            if future is None or self._stale(future):
+                future = pending[url] = self._pool.submit(guild_id, self._resolve, url, priority=LOOKAHEAD)
+                future.add_done_callback(self._log_failure)
+
+    async def resolve(self, guild_id: int, url: str) -> ResolvedTrack | None:
+        """The extracted info of the song that is up now, None when `cancel` was called while it was resolved."""
+        future = self._pending.get(guild_id, {}).pop(url, None)
+        if future is None or self._stale(future):
+            self.cold += 1
+            future = self._pool.submit(guild_id, self._resolve, url, priority=NOW_PLAYING)
+        elif future.done():
+            self.ready += 1
+        else:
+            self.waited += 1
+            self._pool.promote(future, NOW_PLAYING)  # the look-ahead may still be waiting behind other songs
+        self._current[guild_id] = future
+        try:
+            # shielded, so only `cancel` stops the extraction and not the caller giving up on it
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return None
+            raise
+        finally:
+            if self._current.get(guild_id) is future:
+                self._current.pop(guild_id)
+
+    def cancel(self, guild_id: int) -> None:
+        """Stop resolving songs for a guild, for when its queue is cleared or the bot leaves."""
+        futures = [*self._pending.pop(guild_id, {}).values()]
+        if guild_id in self._current:
+            futures.append(self._current.pop(guild_id))
+        for future in futures:
+            future.cancel()
+        if futures:
+            logger.debug(f"Cancelled {len(futures)} song extraction(s) for guild {guild_id}")
+
+    def record_switch(self, seconds: float) -> None:
+        self._switches.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        switches = sorted(self._switches)
+        if not switches:
+            return 0.0
+        return switches[min(len(switches) - 1, int(len(switches) * fraction))]
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        return {
+            "switches": len(self._switches),
+            "p50_ms": round(self.percentile(0.5) * 1000),
+            "p95_ms": round(self.percentile(0.95) * 1000),
+            "ready": self.ready,
+            "waited": self.waited,
+            "cold": self.cold,
+            "resolving": sum(not future.done() for pending in self._pending.values() for future in pending.values()),
+        }
@@ -0,0 +1,99 @@
+# discord imports
+import discord
+
+# python imports
+from typing import AsyncIterable, TextIO
+import asyncio
+import gzip
+import os
+
+# local imports
+from logger import logger
+
+TRANSCRIPT_CHUNK_SIZE: int = 100  # messages buffered before they are written, one page of channel history
+COMPRESSED_SUFFIX: str = ".gz"  # old transcripts are gzipped by the archive compaction
+
+
+def format_message(author: str, content: str, attachments: list[str]) -> str:
+    """The transcript lines of one message."""
+    if not attachments:
+        return f"{author}: {content}\n"
+    return f"{author}: {content}\n    Attached attachment(s):\n" + "".join(f"       {filename}\n" for filename in attachments)
+
+
+class TranscriptWriter(object):
+    """Writes a ticket transcript to disk while the messages come in, oldest message first.
+
+    The messages are formatted into a small buffer that is written out every `chunk_size` messages,
+    so the memory use stays the same no matter how long the ticket is. The writes happen in a worker
+    thread to keep the event loop free.
+    """
+
+    def __init__(self, path: str, title: str, chunk_size: int = TRANSCRIPT_CHUNK_SIZE) -> None:
+        self.path = path
+        self.title = title
+        self.chunk_size = chunk_size
+        self.messages = 0
+        self._buffer: list[str] = []
+        self._file: TextIO | None = None
+
+    async def open(self) -> "TranscriptWriter":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # UTF-8 with the encoding errors replaced, a weird character should never lose the transcript
+        self._file = await asyncio.to_thread(open, self.path, "w", encoding="utf-8", errors="replace")
+        self._buffer.append(f"Transcript for {self.title}:\n```\n")
+        return self
+
+    async def add(self, author: str, content: str, attachments: list[str] | None = None) -> None:
+        self._buffer.append(format_message(author, content, attachments or []))
+        self.messages += 1
+        if self.messages % self.chunk_size == 0:
+            await self.flush()
+
+    async def add_message(self, message: discord.Message) -> None:
+        await self.add(message.author.name, message.content, [attachment.filename for attachment in message.attachments])
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        chunk = "".join(self._buffer)
+        self._buffer.clear()
+        await asyncio.to_thread(self._file.write, chunk)
+
+    async def close(self, footer: str = "") -> str:
+        """Write the rest of the transcript and close the file, returns the path of the transcript."""
+        self._buffer.append(footer + "```")
+        await self.flush()
+        await asyncio.to_thread(self._file.close)
+        self._file = None
+        return self.path
+
+    async def abort(self) -> None:
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+    async def __aenter__(self) -> "TranscriptWriter":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.abort()
+
+
+async def write_transcript(path: str, title: str, messages: AsyncIterable[discord.Message], footer: str = "") -> str:
+    """Stream the messages, oldest first, into a transcript file."""
+    async with TranscriptWriter(path, title) as writer:
+        async for message in messages:
+            await writer.add_message(message)
+        path = await writer.close(footer)
+    logger.debug(f"Wrote {writer.messages} message(s) to {path}")
+    return path
+
+
+def read_transcript(path: str) -> str:
+    """Read a transcript by the path it was written to, also after the compaction gzipped it."""
+    if not os.path.exists(path) and os.path.exists(path + COMPRESSED_SUFFIX):
+        with gzip.open(path + COMPRESSED_SUFFIX, "rt", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
@@ -0,0 +1,227 @@
+# python imports
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from typing import Any, Iterator
+import asyncio
+import sqlite3
+import glob
+import time
+import re
+import os
+
+# local imports
+from transcript import read_transcript, COMPRESSED_SUFFIX
+from logger import logger
+
+load_dotenv()
+TRANSCRIPT_SEARCH: bool = os.getenv("TRANSCRIPT_SEARCH", "True") == "True"
+TRANSCRIPT_INDEX_PATH: str = os.getenv("TRANSCRIPT_INDEX_PATH", "/dreamy-data/tickets/search.sqlite3")
+TICKETS_DIR: str = "/dreamy-data/tickets"
+BACKFILL_BATCH_SIZE: int = 500  # transcripts that are indexed in one transaction
+_AUTHOR = re.compile(r"^([\w.]{2,32}): ", re.MULTILINE)  # a message line of a transcript starts with the username of its author
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    channel TEXT NOT NULL,
+    guild_id INTEGER,
+    closed_at REAL NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_closed_at ON transcripts (closed_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(channel, authors, body, tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+
+@dataclass(slots=True)
+class SearchHit:
+    path: str
+    channel: str
+    closed_at: datetime
+    snippet: str
+    rank: float
+
+
+def parse_transcript(text: str) -> tuple[str, str]:
+    """Split a transcript in the usernames that posted in it and the text to index."""
+    authors = dict.fromkeys(match.lower() for match in _AUTHOR.findall(text))  # keeps the order, drops the repeats
+    return " ".join(authors), text
+
+
+def match_query(text: str | None = None, user: str | None = None) -> str:
+    """Build an FTS5 query from what staff typed, every word has to be in the transcript.
+
+    The words are quoted so characters like `-`, `:` or `*` are searched for instead of being read
+    as FTS5 syntax.
+    """
+    terms = [f'"{word}"' for word in _WORD.findall(text or "")]
+    if user and _WORD.search(user):
+        # one phrase, so `mod.jane` only matches the words `mod` and `jane` right after each other
+        terms.append(f'authors : "{" ".join(_WORD.findall(user.lower()))}"')
+    return " AND ".join(terms)
+
+
+class TranscriptIndex(object):
+    """A full-text index of the ticket transcripts in an SQLite file next to them.
+
+    Transcripts are added when a ticket is closed, `backfill` adds the ones that were archived
+    before the index existed. Like the SQLite backend, the file has a single connection that is
+    used from one thread, so the event loop never waits on the disk.
+    """
+
+    def __init__(self, path: str = TRANSCRIPT_INDEX_PATH) -> None:
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcript-search")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            connection.execute("PRAGMA cache_size=-65536")  # 64 MiB, keeps the index of a big archive in memory between searches
+            self._connection = connection
+        return self._connection
+
+    async def _call(self, function, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _index(self, connection: sqlite3.Connection, path: str, guild_id: int | None, mtime: float) -> None:
+        authors, body = parse_transcript(read_transcript(path))
+        # the folder has the channel id in it, the file is named after the channel only
+        channel = os.path.basename(path).removeprefix("transcript-").removesuffix(".txt")
+        row = connection.execute("SELECT id FROM transcripts WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            rowid = connection.execute("INSERT INTO transcripts (path, channel, guild_id, closed_at, mtime) VALUES (?, ?, ?, ?, ?)",
+                                       (path, channel, guild_id, mtime, mtime)).lastrowid
+        else:
+            rowid = row[0]
+            # a new ticket with the same channel name is written to the same path, so it closed at the new time
+            connection.execute("UPDATE transcripts SET guild_id = COALESCE(?, guild_id), closed_at = ?, mtime = ? WHERE id = ?", (guild_id, mtime, mtime, rowid))
+            connection.execute("DELETE FROM transcripts_fts WHERE rowid = ?", (rowid,))
+        connection.execute("INSERT INTO transcripts_fts (rowid, channel, authors, body) VALUES (?, ?, ?, ?)", (rowid, channel, authors, body))
+
+    def _add(self, path: str, guild_id: int | None) -> None:
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._index(connection, path, guild_id, os.path.getmtime(path))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    async def add(self, path: str, guild_id: int | None = None) -> bool:
+        """Index a transcript, a transcript that was indexed already is replaced.
+
+        The search is a nice to have, so a failure is logged instead of raised and the ticket closes as usual.
+        """
+        try:
+            await self._call(self._add, path, guild_id)
+            return True
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Could not add the transcript {path} to the search index: {e!r}")
+            return False
+
+    @staticmethod
+    def _transcripts(root: str) -> Iterator[tuple[str, float]]:
+        # a gzipped transcript is indexed by the name it was written to, read_transcript finds it by that name
+        for path in glob.iglob(os.path.join(glob.escape(root), "*", "transcript-*.txt*")):
+            if path.endswith(".txt") or path.endswith(".txt" + COMPRESSED_SUFFIX):
+                yield path.removesuffix(COMPRESSED_SUFFIX), os.path.getmtime(path)
+
+    def _backfill(self, root: str) -> int:
+        connection = self._connect()
+        known = dict(connection.execute("SELECT path, mtime FROM transcripts").fetchall())
+        todo = [(path, mtime) for path, mtime in self._transcripts(root) if known.get(path) != mtime]
+        for start in range(0, len(todo), BACKFILL_BATCH_SIZE):
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for path, mtime in todo[start:start + BACKFILL_BATCH_SIZE]:
+                    self._index(connection, path, None, mtime)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        if todo:
+            connection.execute("INSERT INTO transcripts_fts (transcripts_fts) VALUES ('optimize')")
+        return len(todo)
+
+    async def backfill(self, root: str = TICKETS_DIR) -> int:
+        """Index the transcripts under `root` that are new or changed since they were indexed, returns how many."""
+        started = time.perf_counter()
+        count = await self._call(self._backfill, root)
+        logger.info(f"Indexed {count} transcript(s) for the ticket search in {time.perf_counter() - started:.1f}s")
+        return count
+
+    def _search(self, text: str | None, user: str | None, since: float | None, until: float | None, guild_id: int | None, unassigned: bool, limit: int) -> list[SearchHit]:
+        connection = self._connect()
+        filters, values = [], []
+        if since is not None:
+            filters.append("t.closed_at >= ?")
+            values.append(since)
+        if until is not None:
+            filters.append("t.closed_at < ?")
+            values.append(until)
+        if guild_id is not None:
+            # transcripts from the backfill don't know their guild, they could be from any server the bot is in
+            filters.append("(t.guild_id = ? OR t.guild_id IS NULL)" if unassigned else "t.guild_id = ?")
+            values.append(guild_id)
+
+        match = match_query(text, user)
+        if match:
+            # bm25 weights: a hit in the channel name or the authors counts more than one in the messages.
+            # The snippets are made afterwards, only for the hits that are returned
+            query = ("SELECT t.id, t.path, t.channel, t.closed_at, bm25(transcripts_fts, 5.0, 3.0, 1.0) AS score "
+                     "FROM transcripts_fts JOIN transcripts t ON t.id = transcripts_fts.rowid WHERE transcripts_fts MATCH ?")
+            values.insert(0, match)
+            order = "score"
+        else:
+            query = "SELECT t.id, t.path, t.channel, t.closed_at, 0.0 FROM transcripts t WHERE 1"
+            order = "t.closed_at DESC"
+        query += "".join(f" AND {condition}" for condition in filters) + f" ORDER BY {order} LIMIT ?"
+        rows = connection.execute(query, (*values, limit)).fetchall()
+        snippets = {}
+        if match and rows:
+            snippets = dict(connection.execute(
+                f"SELECT rowid, snippet(transcripts_fts, 2, '**', '**', '...', 12) FROM transcripts_fts WHERE transcripts_fts MATCH ? AND rowid IN ({', '.join('?' * len(rows))})",
+                (match, *(row[0] for row in rows))).fetchall())
+        return [SearchHit(path, channel, datetime.fromtimestamp(closed_at, timezone.utc), snippets.get(rowid, ""), rank) for rowid, path, channel, closed_at, rank in rows]
+
+    async def search(self, text: str | None = None, user: str | None = None, since: datetime | None = None, until: datetime | None = None, guild_id: int | None = None, unassigned: bool = False, limit: int = 10) -> list[SearchHit]:
+        """The best matching transcripts for some words and/or a username, optionally closed between `since` and `until`.
+
+        Without words or a username the newest transcripts in the date range are returned. With a `guild_id`
+        only that guild's transcripts are searched, plus the backfilled ones without a guild when `unassigned`.
+        """
+        return await self._call(self._search, text, user, since.timestamp() if since else None, until.timestamp() if until else None, guild_id, unassigned, limit)
+
+    def _prune(self) -> int:
+        connection = self._connect()
+        gone = [(rowid,) for rowid, path in connection.execute("SELECT id, path FROM transcripts").fetchall()
+                if not os.path.exists(path) and not os.path.exists(path + COMPRESSED_SUFFIX)]
+        if gone:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("DELETE FROM transcripts WHERE id = ?", gone)
+            connection.executemany("DELETE FROM transcripts_fts WHERE rowid = ?", gone)
+            connection.execute("COMMIT")
+        return len(gone)
+
+    async def prune(self) -> int:
+        """Forget the transcripts that were removed from the disk, returns how many."""
+        return await self._call(self._prune)
+
+    def _count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+
+    async def count(self) -> int:
+        return await self._call(self._count)
+
+
+transcript_index = TranscriptIndex()
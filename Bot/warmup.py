@@ -0,0 +1,78 @@
+# discord imports
+from discord.ext import commands
+import discord
+
+# python imports
+from dotenv import load_dotenv
+import asyncio
+import time
+import os
+
+# local imports
+from functions import load_rule_gates, load_open_tickets
+from guildConfig import guild_config
+from ruleIndex import rule_gates
+from cogs.AccessManager import PersistentAcceptRulesView
+from logger import logger
+
+load_dotenv()
+WARMUP_FETCH_CONCURRENCY: int = int(os.getenv("WARMUP_FETCH_CONCURRENCY", 8))  # channels fetched over REST at the same time
+
+
+async def _fetch_channel(client: commands.Bot, channel_id: int, semaphore: asyncio.Semaphore) -> discord.abc.GuildChannel | None:
+    async with semaphore:
+        try:
+            return await client.fetch_channel(channel_id)
+        except discord.NotFound:
+            logger.warning(f"Rule channel {channel_id} no longer exists, its accept button is not registered.")
+        except discord.HTTPException as e:
+            logger.error(f"Could not fetch rule channel {channel_id}: {e}")
+    return None
+
+
+async def resolve_channels(client: commands.Bot, channel_ids: list[int]) -> dict[int, discord.abc.GuildChannel]:
+    """Look the channels up in the gateway cache, only the ones that are missing are fetched over REST."""
+    channels = {}
+    missing = []
+    for channel_id in channel_ids:
+        channel = client.get_channel(channel_id)
+        if channel is not None:
+            channels[channel_id] = channel
+        else:
+            missing.append(channel_id)
+    if missing:
+        logger.debug(f"Fetching {len(missing)} rule channel(s) that are not in the cache.")
+        semaphore = asyncio.Semaphore(WARMUP_FETCH_CONCURRENCY)
+        fetched = await asyncio.gather(*(_fetch_channel(client, channel_id, semaphore) for channel_id in missing))
+        for channel_id, channel in zip(missing, fetched):
+            if channel is not None:
+                channels[channel_id] = channel
+    return channels
+
+
+async def warm_up(client: commands.Bot) -> dict[str, float]:
+    """Load everything the bot needs to answer interactions before it reports ready.
+
+    The guild settings, rule gates and open tickets are loaded at the same time in a few bulk queries,
+    after that the accept buttons of the rule channels are registered.
+
+    Returns:
+        dict[str, float]: The seconds every stage took
+    """
+    timings = {}
+    started = time.perf_counter()
+    await asyncio.gather(guild_config.load(), load_rule_gates(), load_open_tickets())
+    timings["database"] = time.perf_counter() - started
+
+    stage = time.perf_counter()
+    channels = await resolve_channels(client, rule_gates.channel_ids)
+    timings["channels"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    for channel in channels.values():
+        client.add_view(PersistentAcceptRulesView(client, channel))
+    timings["views"] = time.perf_counter() - stage
+
+    timings["total"] = time.perf_counter() - started
+    logger.info(f"Warm-up done in {timings['total'] * 1000:.0f}ms with {len(channels)} rule channel(s): " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items() if name != "total"))
+    return timings
@@ -0,0 +1,260 @@
+# python imports
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from typing import Any, Callable
+import asyncio
+import time
+import os
+
+# local imports
+from storage import get_storage, DatabaseUnavailable
+from queryStats import current_query
+from logger import logger
+
+load_dotenv()
+WRITE_BEHIND_ENABLED: bool = os.getenv("DATABASE_WRITE_BEHIND", "False") == "True"
+WRITE_BEHIND_MAX_BATCH: int = int(os.getenv("DATABASE_WRITE_BEHIND_MAX_BATCH", 100))  # rows per table before a flush is forced
+WRITE_BEHIND_MAX_DELAY: float = float(os.getenv("DATABASE_WRITE_BEHIND_MAX_DELAY", 0.5))  # seconds a write may wait before it is flushed
+WRITE_BEHIND_MAX_ATTEMPTS: int = 3  # times a batch the database refused is retried before it is dropped
+WRITE_BEHIND_RETRY_DELAY: float = 1.0  # seconds before the first retry of a failed flush, doubled after every failure in a row
+WRITE_BEHIND_MAX_RETRY_DELAY: float = 60.0
+
+
+@dataclass(slots=True)
+class _Operation:
+    kind: str  # "insert" or "delete"
+    columns: tuple[str, ...]  # the inserted columns, or the one column a delete filters on
+    values: tuple
+    attempts: int = 0
+    on_dropped: Callable[[], None] | None = None  # called when the write is given up on
+
+
+class WriteBehindQueue(object):
+    """Collects inserts and deletes and writes them to the database in multi-row statements.
+
+    The writes are kept in order per table, consecutive writes of the same kind are merged into one
+    `INSERT IGNORE ... VALUES (...), (...)` or `DELETE ... WHERE column IN (...)` statement and every flush
+    runs in a single transaction. Because of the `IGNORE`, a batched insert of a duplicate row is skipped
+    instead of failing the whole batch. A batch the database refuses for another reason is written row by
+    row, so only the rows it refuses are retried and, after `WRITE_BEHIND_MAX_ATTEMPTS`, dropped.
+    """
+
+    def __init__(self, enabled: bool = WRITE_BEHIND_ENABLED, max_batch: int = WRITE_BEHIND_MAX_BATCH, max_delay: float = WRITE_BEHIND_MAX_DELAY) -> None:
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: dict[tuple[str, str], list[_Operation]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        self._failures = 0  # flushes that failed in a row
+        self._retry_at = 0.0  # time.monotonic() before which the flusher doesn't try again
+        # metrics
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batch_sizes: dict[int, int] = {}  # rows per statement rounded up to a power of two -> times seen
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def _add(self, database_name: str, table: str, operation: _Operation) -> None:
+        if self._closed:
+            raise RuntimeError("The write-behind queue is closed")
+        pending = self._pending.setdefault((database_name, table), [])
+        pending.append(operation)
+        if self._task is None or self._task.done():
+            # started on the first write, and again if the flusher ever died
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+        if len(pending) >= self.max_batch:
+            self._full.set()
+
+    def insert(self, database_name: str, table: str, columns: tuple[str, ...], values: tuple, on_dropped: Callable[[], None] | None = None) -> None:
+        self._add(database_name, table, _Operation("insert", columns, values, on_dropped=on_dropped))
+
+    def delete(self, database_name: str, table: str, column: str, value: Any, on_dropped: Callable[[], None] | None = None) -> None:
+        self._add(database_name, table, _Operation("delete", (column,), (value,), on_dropped=on_dropped))
+
+    @property
+    def accepting(self) -> bool:
+        """Whether writes should go through the queue, when False they must be written directly."""
+        return self.enabled and not self._closed
+
+    @property
+    def pending(self) -> int:
+        return sum(len(operations) for operations in self._pending.values())
+
+    async def _run(self) -> None:
+        while not self._closed:
+            await self._wakeup.wait()
+            backoff = self._retry_at - time.monotonic()
+            try:
+                if backoff > 0:
+                    # the last flush failed, wait it out unless the bot shuts down
+                    await asyncio.wait_for(self._closing.wait(), timeout=backoff)
+                else:
+                    # wait for the time threshold, unless a table reaches the size threshold first
+                    await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # the flusher has to keep running, otherwise nothing is written anymore
+                logger.error(f"The write-behind flusher failed: {type(e).__name__} {e}")
+                self._wakeup.set()
+
+    def _statements(self, table: str, operations: list[_Operation]) -> list[tuple[str, tuple]]:
+        """Merge consecutive operations of the same kind into as few statements as possible."""
+        statements = []
+        start = 0
+        while start < len(operations):
+            first = operations[start]
+            end = start + 1
+            while end < len(operations) and end - start < self.max_batch and operations[end].kind == first.kind and operations[end].columns == first.columns:
+                end += 1
+            group = operations[start:end]
+            if first.kind == "insert":
+                placeholders = "(" + ", ".join(["%s"] * len(first.columns)) + ")"
+                query = f"INSERT IGNORE INTO {table} ({', '.join(first.columns)}) VALUES " + ", ".join([placeholders] * len(group))
+            else:
+                query = f"DELETE FROM {table} WHERE {first.columns[0]} IN (" + ", ".join(["%s"] * len(group)) + ")"
+            statements.append((query, tuple(value for operation in group for value in operation.values)))
+            size = 1 << (len(group) - 1).bit_length()
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            start = end
+        return statements
+
+    async def flush(self, database_name: str | None = None, table: str | None = None) -> None:
+        """Write the pending operations, optionally only those of one database or table."""
+        async with self._flush_lock:
+            keys = [key for key in self._pending if (database_name is None or key[0] == database_name) and (table is None or key[1] == table)]
+            for key in keys:
+                operations = self._pending.pop(key, [])
+                if not operations:
+                    continue
+                started = time.perf_counter()
+                # the flusher runs in the context of whichever helper queued first, record the batch under its own name
+                token = current_query.set(f"write_behind:{key[1]}")
+                written = len(operations)
+                try:
+                    await get_storage().run_batch(key[0], self._statements(key[1], operations), idempotent=True)
+                except Exception as e:
+                    # whatever went wrong, the popped operations go back in the queue
+                    if isinstance(e, DatabaseUnavailable) or len(operations) == 1:
+                        self._retry(key, operations, e)
+                        continue
+                    # one bad row fails the whole transaction, so the rows are tried on their own to find it
+                    failed, error = await self._write_each(key, operations)
+                    if failed:
+                        self._retry(key, failed, error)
+                    written -= len(failed)
+                    if not written:
+                        continue
+                finally:
+                    current_query.reset(token)
+                if written == len(operations):
+                    self._failures = 0
+                    self._retry_at = 0.0
+                latency = time.perf_counter() - started
+                self.flushes += 1
+                self.rows_written += written
+                self.last_flush_latency = latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+                self.total_flush_latency += latency
+                logger.debug(f"Flushed {written} write(s) to {key[0]}.{key[1]} in {latency * 1000:.1f}ms")
+
+    async def _write_each(self, key: tuple[str, str], operations: list[_Operation]) -> tuple[list[_Operation], Exception | None]:
+        """Write the operations of a refused batch one at a time, returns the ones that failed and the last error."""
+        failed = []
+        error = None
+        for index, operation in enumerate(operations):
+            try:
+                await get_storage().run_batch(key[0], self._statements(key[1], [operation]), idempotent=True)
+            except DatabaseUnavailable as e:
+                return failed + operations[index:], e  # the rest waits for the database to come back
+            except Exception as e:
+                failed.append(operation)
+                error = e
+        return failed, error
+
+    def _retry(self, key: tuple[str, str], operations: list[_Operation], error: Exception) -> None:
+        self._failures += 1
+        delay = min(WRITE_BEHIND_MAX_RETRY_DELAY, WRITE_BEHIND_RETRY_DELAY * 2 ** (self._failures - 1))
+        self._retry_at = time.monotonic() + delay
+        if isinstance(error, DatabaseUnavailable):
+            # the database is down or its breaker is open, the writes wait for it however long that takes
+            kept = operations
+        else:
+            kept = []
+            for operation in operations:
+                operation.attempts += 1
+                if operation.attempts < WRITE_BEHIND_MAX_ATTEMPTS:
+                    kept.append(operation)
+                else:
+                    self._dropped(operation)
+        dropped = len(operations) - len(kept)
+        if dropped:
+            self.rows_dropped += dropped
+            logger.critical(f"Dropped {dropped} write(s) to {key[0]}.{key[1]} after {WRITE_BEHIND_MAX_ATTEMPTS} attempts: {error}")
+        else:
+            logger.error(f"The error '{error}' occurred while flushing {key[0]}.{key[1]}, retrying {len(kept)} write(s) in {delay:.0f}s")
+        if kept:
+            # the failed writes are older than anything queued since, so they go in front
+            self._pending[key] = kept + self._pending.get(key, [])
+            self._wakeup.set()
+
+    @staticmethod
+    def _dropped(operation: _Operation) -> None:
+        if operation.on_dropped is None:
+            return
+        try:
+            operation.on_dropped()
+        except Exception as e:
+            logger.error(f"The callback of a dropped write failed: {type(e).__name__} {e}")
+
+    async def close(self) -> None:
+        """Stop accepting writes and flush everything that is still pending."""
+        self._closed = True
+        if self._task is not None:
+            # wake the flusher so it runs its last flush and stops, cancelling it could lose a batch mid-flight
+            self._wakeup.set()
+            self._full.set()
+            self._closing.set()
+            await self._task
+            self._task = None
+        for _ in range(WRITE_BEHIND_MAX_ATTEMPTS):
+            if not self._pending:
+                break
+            await self.flush()
+        if self._pending:
+            for operations in self._pending.values():
+                for operation in operations:
+                    self._dropped(operation)
+            self.rows_dropped += self.pending
+            logger.critical(f"Dropped {self.pending} write(s) that could not be written before the bot stopped")
+        logger.info(f"The write-behind queue has been drained, {self.rows_written} write(s) in {self.flushes} flush(es).")
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "failed_flushes_in_a_row": self._failures,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "last_flush_ms": round(self.last_flush_latency * 1000, 2),
+            "max_flush_ms": round(self.max_flush_latency * 1000, 2),
+            "avg_flush_ms": round(self.total_flush_latency / self.flushes * 1000, 2) if self.flushes else 0.0,
+        }
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,88 @@
+# python imports
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO
+import mimetypes
+import asyncio
+import zipfile
+import os
+
+# local imports
+from attachments import unique_name
+from logger import logger
+
+# types that are compressed already, deflating them again costs time and saves next to nothing
+_STORED_TYPES: tuple[str, ...] = ("image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/heic", "video/", "audio/",
+                                  "application/zip", "application/gzip", "application/x-7z-compressed", "application/x-rar-compressed", "application/pdf")
+
+
+def compression_for(filename: str, content_type: str | None = None) -> int:
+    """Pick ZIP_STORED for files that are compressed already and ZIP_DEFLATED for everything else."""
+    content_type = content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type.startswith(_STORED_TYPES):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ZipStreamWriter(object):
+    """Builds a zip archive one entry at a time in its own thread.
+
+    `add` returns right away, the entries are read and compressed in the background in the order
+    they were added, so the archive grows while the other files are still downloading. The output
+    can be a path or any writable binary stream, streams that can't seek (like a pipe) are written
+    with data descriptors.
+    """
+
+    def __init__(self, output: str | BinaryIO) -> None:
+        self.output = output
+        self.entries = 0
+        self._names: set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="zip")  # one thread keeps the entries in order
+        self._zip = self._executor.submit(zipfile.ZipFile, output, "w")
+        self._pending: list[Future] = []
+
+    def add(self, path: str, arcname: str, content_type: str | None = None) -> None:
+        """Queue a file for the archive, `arcname` gets a counter when the name is used already."""
+        arcname = unique_name(arcname, self._names)
+        self._pending.append(self._executor.submit(self._write, path, arcname, compression_for(arcname, content_type)))
+        self.entries += 1
+
+    def _write(self, path: str, arcname: str, compression: int) -> None:
+        self._zip.result().write(path, arcname, compress_type=compression)
+
+    def _close(self) -> None:
+        self._zip.result().close()
+
+    async def close(self) -> None:
+        """Wait for the queued entries and finish the archive, without blocking the event loop.
+
+        When an entry fails the archive is closed and removed before the error is raised, a half written zip is never kept.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            for future in self._pending:
+                await asyncio.wrap_future(future, loop=loop)
+            await loop.run_in_executor(self._executor, self._close)
+        except BaseException:
+            await self._discard(loop)
+            raise
+        finally:
+            self._executor.shutdown(wait=False)
+        logger.debug(f"Wrote {self.entries} entries to the archive {self.output if isinstance(self.output, str) else 'stream'}")
+
+    async def _discard(self, loop: asyncio.AbstractEventLoop) -> None:
+        for future in self._pending:
+            future.cancel()
+        try:
+            await loop.run_in_executor(self._executor, self._close)
+        except Exception as e:
+            logger.debug(f"The error '{e}' occurred while closing an aborted archive")
+        if isinstance(self.output, str) and os.path.exists(self.output):
+            os.remove(self.output)
+
+    async def abort(self) -> None:
+        """Stop the archive, the entries that are still queued are dropped and a half written file is removed."""
+        try:
+            await self._discard(asyncio.get_running_loop())
+        finally:
+            self._executor.shutdown(wait=False)
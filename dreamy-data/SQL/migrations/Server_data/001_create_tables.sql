@@ -0,0 +1,35 @@
+-- The tables as created by Tickets.sql, the IF NOT EXISTS makes it safe on existing installs
+CREATE TABLE IF NOT EXISTS open_tickets (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id bigint NOT NULL,
+    channel_id BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS rule_channels (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    channel_id BIGINT NOT NULL,
+    creator_id BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS rules_accepted (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    channel_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reminders (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    reminder_id BIGINT NOT NULL,
+    begin_event_time DATETIME NOT NULL,
+    reminder_time DATETIME NOT NULL,
+    end_event_time DATETIME,
+    end_reminder_time DATETIME,
+    channel_id BIGINT,
+    message_id BIGINT
+);
+CREATE TABLE IF NOT EXISTS reminder_participants (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    reminder_id BIGINT NOT NULL,
+    subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
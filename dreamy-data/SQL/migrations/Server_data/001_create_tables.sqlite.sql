@@ -0,0 +1,35 @@
+-- SQLite version of 001_create_tables.sql
+CREATE TABLE IF NOT EXISTS open_tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id bigint NOT NULL,
+    channel_id BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS rule_channels (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id BIGINT NOT NULL,
+    creator_id BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS rules_accepted (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id BIGINT NOT NULL,
+    reminder_id BIGINT NOT NULL,
+    begin_event_time DATETIME NOT NULL,
+    reminder_time DATETIME NOT NULL,
+    end_event_time DATETIME,
+    end_reminder_time DATETIME,
+    channel_id BIGINT,
+    message_id BIGINT
+);
+CREATE TABLE IF NOT EXISTS reminder_participants (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id BIGINT NOT NULL,
+    reminder_id BIGINT NOT NULL,
+    subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,11 @@
+-- Indexes for the columns the helpers in functions.py filter on
+-- Duplicate rows are removed first (keeping the oldest one), otherwise the unique indexes can't be created
+DELETE newer FROM open_tickets newer JOIN open_tickets older ON newer.channel_id = older.channel_id AND newer.id > older.id;
+ALTER TABLE open_tickets ADD UNIQUE INDEX uq_open_tickets_channel_id (channel_id);
+
+DELETE newer FROM rule_channels newer JOIN rule_channels older ON newer.channel_id = older.channel_id AND newer.id > older.id;
+ALTER TABLE rule_channels ADD UNIQUE INDEX uq_rule_channels_channel_id (channel_id);
+
+-- (channel_id, user_id) also serves the lookups that only filter on channel_id
+DELETE newer FROM rules_accepted newer JOIN rules_accepted older ON newer.channel_id = older.channel_id AND newer.user_id = older.user_id AND newer.id > older.id;
+ALTER TABLE rules_accepted ADD UNIQUE INDEX uq_rules_accepted_channel_user (channel_id, user_id);
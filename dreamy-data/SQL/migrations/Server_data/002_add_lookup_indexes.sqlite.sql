@@ -0,0 +1,9 @@
+-- SQLite version of 002_add_lookup_indexes.sql
+DELETE FROM open_tickets WHERE id NOT IN (SELECT MIN(id) FROM open_tickets GROUP BY channel_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_open_tickets_channel_id ON open_tickets (channel_id);
+
+DELETE FROM rule_channels WHERE id NOT IN (SELECT MIN(id) FROM rule_channels GROUP BY channel_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_rule_channels_channel_id ON rule_channels (channel_id);
+
+DELETE FROM rules_accepted WHERE id NOT IN (SELECT MIN(id) FROM rules_accepted GROUP BY channel_id, user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_rules_accepted_channel_user ON rules_accepted (channel_id, user_id);
@@ -0,0 +1,18 @@
+-- SQLite version of 001_create_guilds.sql
+CREATE TABLE IF NOT EXISTS guilds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id bigint NOT NULL,
+    owner_id bigint NOT NULL,
+    sancturary_keeper_role_id bigint NOT NULL,
+    sky_guardians_role_id bigint NOT NULL,
+    tech_oracle_role_id bigint NOT NULL,
+    event_luminary_role_id bigint NOT NULL,
+    assistaint_role_id bigint NOT NULL,
+    support_category_id bigint NOT NULL,
+    general_category_id bigint NOT NULL,
+    music_voice_id bigint NOT NULL,
+    bot_channel_id bigint NOT NULL,
+    music_channel_id bigint NOT NULL,
+    ticket_channel_id bigint NOT NULL,
+    ticket_log_channel_id bigint NOT NULL
+);
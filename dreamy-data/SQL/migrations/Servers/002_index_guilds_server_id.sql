@@ -0,0 +1,4 @@
+-- Every guild lookup filters on server_id, there can only be one row per guild
+-- Remove duplicate rows first (keeping the oldest one), otherwise the unique index can't be created
+DELETE newer FROM guilds newer JOIN guilds older ON newer.server_id = older.server_id AND newer.id > older.id;
+ALTER TABLE guilds ADD UNIQUE INDEX uq_guilds_server_id (server_id);
@@ -0,0 +1,3 @@
+-- SQLite version of 002_index_guilds_server_id.sql
+DELETE FROM guilds WHERE id NOT IN (SELECT MIN(id) FROM guilds GROUP BY server_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_guilds_server_id ON guilds (server_id);
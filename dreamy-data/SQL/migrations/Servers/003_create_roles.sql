@@ -0,0 +1,9 @@
+-- The roles set with /setup_roles, one row per guild so the command can upsert on guild_id
+CREATE TABLE IF NOT EXISTS roles (
+    guild_id bigint NOT NULL PRIMARY KEY,
+    owner_role_id bigint NOT NULL,
+    moderator_role_id bigint NOT NULL,
+    tech_role_id bigint NOT NULL,
+    event_organiser_role_id bigint NOT NULL,
+    member_role_id bigint NOT NULL
+);
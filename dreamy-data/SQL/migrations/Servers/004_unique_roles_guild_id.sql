@@ -0,0 +1,10 @@
+-- Deployments from before the migrations already had a roles table, 003 leaves it as it is and it has no key on guild_id,
+-- so the upsert of /setup_roles would add a row every time. The old command updated every row of a guild at once,
+-- so the duplicates are the same and any one of them can stay. The rows are copied into a table with the unique key
+-- and swapped in, roles has no id to tell the rows apart in a DELETE
+DROP TABLE IF EXISTS roles_old;
+CREATE TABLE IF NOT EXISTS roles_dedup LIKE roles;
+ALTER TABLE roles_dedup ADD UNIQUE INDEX uq_roles_guild_id (guild_id);
+INSERT IGNORE INTO roles_dedup SELECT * FROM roles;
+RENAME TABLE roles TO roles_old, roles_dedup TO roles;
+DROP TABLE roles_old;
@@ -0,0 +1,3 @@
+-- SQLite version of 004_unique_roles_guild_id.sql
+DELETE FROM roles WHERE rowid NOT IN (SELECT MIN(rowid) FROM roles GROUP BY guild_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_roles_guild_id ON roles (guild_id);